@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+'''
+The ahdp agent is an optional long running process of the target host keeping the authenticated webhdfs clients and
+hive server 2 connections of the modules open between their invocations. Every module invocation is otherwise a new
+python process importing pywhdfs or impyla, requesting a TGT, finding the active namenode and opening the thrift
+transport before sending its first request.
+
+The agent listens on a unix socket readable only by its owner and only accepts the connections of processes of the
+same user. A module opens a session with its connection parameters, the agent creates the client the same way the
+module would (HDFSAnsibleModule or HS2AnsibleModule) and keeps it for the next sessions opened with the same
+parameters, then the module forwards its calls to it. The calls returning streams (read, write, ...) are not
+forwarded, the module runs them with a client of its own.
+
+The messages are json documents prefixed with their length. Start the agent with:
+
+    python -m ahdp.module_utils.agent --socket ~/.ahdp/agent.sock --idle-timeout 3600
+'''
+
+import os
+import os.path as osp
+import sys
+import json
+import socket
+import struct
+import threading
+import time
+import SocketServer
+from subprocess import Popen
+
+try:
+    import hashlib
+    _sha1 = hashlib.sha1
+except ImportError:
+    import sha
+    _sha1 = sha.sha
+
+AGENT_DEFAULT_SOCKET = '~/.ahdp/agent.sock'
+# the agent exits after this number of seconds without any request
+AGENT_IDLE_TIMEOUT = 3600
+# the clients are created again after this number of seconds, so expired credentials are never kept
+AGENT_SESSION_MAX_AGE = 3600
+# seconds a module waits for the reply of the agent to a call, so a wedged agent fails the task instead of hanging it
+AGENT_CALL_TIMEOUT = 600
+
+# pywhdfs client methods forwarded to the agent, they all return json like results
+HDFS_AGENT_METHODS = frozenset([
+    'resolvepath', 'status', 'list', 'content', 'checksum', 'walk',
+    'delete', 'makedirs', 'rename', 'set_times', 'set_owner', 'set_permission', 'set_replication',
+    'getAclStatus', 'setAcl', 'modifyAclEntries', 'removeAclEntries', 'removeDefaultAcl', 'removeAcl',
+    'getxattrs', 'listxattrs', 'setxattr', 'removexattr',
+    'create_snapshot', 'delete_snapshot', 'rename_snapshot',
+    'getDelegationToken', 'renewDelegationToken', 'cancelDelegationToken',
+])
+
+# module parameters which do not change the client created by the agent
+AGENT_PARAMETERS = ('agent', 'agent_socket')
+
+_SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+class AgentError(Exception):
+    pass
+
+def _send(sock, message):
+    data = json.dumps(message)
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+def _recv_exactly(sock, length):
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(min(length, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+    return ''.join(chunks)
+
+def _recv(sock):
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    length, = struct.unpack('>I', header)
+    data = _recv_exactly(sock, length)
+    if data is None:
+        return None
+    return json.loads(data)
+
+def session_key(kind, params):
+    ''' the sessions opened with the same connection parameters share a client '''
+    digest = _sha1()
+    digest.update(kind + '\0' + json.dumps(dict( (k, v) for k, v in params.items() if k not in AGENT_PARAMETERS ), sort_keys=True))
+    return digest.hexdigest()
+
+#################################################################################################################
+#                                     Module side
+#################################################################################################################
+
+class AgentConnection(object):
+    ''' A session opened in the agent, each thread of the module talks to the agent on its own connection. '''
+
+    def __init__(self, path, kind, params, timeout=None):
+        self.path = osp.expanduser(path)
+        self.kind = kind
+        self.timeout = timeout
+        self.local = threading.local()
+        self.key = self.call(None, 'open', kind=kind, params=params)
+
+    def _socket(self):
+        sock = getattr(self.local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self.local.sock = sock
+        return sock
+
+    def call(self, key, method, *args, **kwargs):
+        sock = self._socket()
+        try:
+            _send(sock, { 'session': key, 'method': method, 'args': args, 'kwargs': kwargs })
+            response = _recv(sock)
+        except (socket.error, ValueError), e:
+            self.local.sock = None
+            raise AgentError('ahdp agent connection failed: %s' % str(e))
+        if response is None:
+            self.local.sock = None
+            raise AgentError('ahdp agent closed the connection')
+        if 'error' in response:
+            raise AgentError(response['error'])
+        return response['result']
+
+    def __call__(self, method, *args, **kwargs):
+        return self.call(self.key, method, *args, **kwargs)
+
+def connect_agent(path, kind, params, timeout=None, start=False):
+    ''' Open a session in the agent listening on path, None if no agent is running or it refused the session.
+        With start, an agent is started in the background when none is running. '''
+    path = osp.expanduser(path)
+    if not osp.exists(path):
+        if start:
+            start_agent(path)
+        return None
+    try:
+        return AgentConnection(path, kind, params, timeout=timeout)
+    except (socket.error, AgentError):
+        return None
+
+def start_agent(path, idle_timeout=AGENT_IDLE_TIMEOUT):
+    ''' Start an agent in the background, the invocations following the next one use it. '''
+    try:
+        with open(os.devnull, 'r+') as devnull:
+            Popen([ sys.executable, '-m', 'ahdp.module_utils.agent', '--socket', path, '--idle-timeout', str(idle_timeout) ],
+                  stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+    except OSError:
+        pass
+
+class AgentHDFSClient(object):
+    ''' Stands for the pywhdfs client of a module, forwards HDFS_AGENT_METHODS to the client kept by the agent and the
+        other calls to the client returned by local(), created on first use. The agent errors are raised as error. '''
+
+    def __init__(self, connection, local, error=AgentError):
+        self._connection = connection
+        self._local = local
+        self._local_client = None
+        self._error = error
+
+    def _remote(self, method):
+        def call(*args, **kwargs):
+            try:
+                return self._connection(method, *args, **kwargs)
+            except AgentError, e:
+                raise self._error(str(e))
+        return call
+
+    def __getattr__(self, name):
+        if name in HDFS_AGENT_METHODS:
+            return self._remote(name)
+        if self._local_client is None:
+            self._local_client = self._local()
+        return getattr(self._local_client, name)
+
+class AgentHS2Cursor(object):
+    ''' Stands for an impyla cursor, the rows of a query are returned by the agent with its execution. '''
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._rows = []
+
+    def execute(self, query):
+        self._rows = self._connection('execute', query)
+
+    def execute_in(self, database, query):
+        ''' Run query in database. The agent runs the USE and the query in a single call, so the other invocations
+            sharing the connection never run their queries in between. '''
+        self._rows = self._connection('execute', query, database=database)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def database_exists(self, db_name):
+        return self._connection('database_exists', db_name)
+
+    def close(self):
+        pass
+
+class AgentHS2Connection(object):
+    ''' Stands for an impyla connection kept by the agent. '''
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self):
+        return AgentHS2Cursor(self._connection)
+
+    def close(self):
+        pass
+
+#################################################################################################################
+#                                     Agent side
+#################################################################################################################
+
+class _AgentModule(object):
+    ''' The minimal AnsibleModule interface used by HDFSAnsibleModule and HS2AnsibleModule. '''
+
+    def __init__(self, params):
+        self.params = params
+
+    def fail_json(self, **kwargs):
+        raise AgentError(kwargs.get('msg', str(kwargs)))
+
+class _Session(object):
+
+    def __init__(self, kind, params):
+        params = dict(params)
+        params['agent'] = False
+        if kind == 'hdfs':
+            from ahdp.module_utils.hdfsbase import HDFSAnsibleModule
+            self.module = HDFSAnsibleModule(_AgentModule(params), bypass_checks=True, observer_reads=params.pop('observer_reads', False))
+        elif kind == 'hs2':
+            from ahdp.module_utils.hs2base import HS2AnsibleModule
+            self.module = HS2AnsibleModule(_AgentModule(params), bypass_checks=True)
+        else:
+            raise AgentError('unknown session kind %s' % kind)
+        self.kind = kind
+        self.principal = params.get('principal')
+        self.created = time.time()
+        # impyla cursors can not be shared between threads
+        self.lock = threading.Lock()
+        # set when the connection was lost, the session is then dropped
+        self.broken = False
+
+    def reset(self):
+        ''' Start the invocation opening the session in the default database, whatever the previous one used. '''
+        if self.kind == 'hs2':
+            self.call('execute', [ 'USE default' ], {})
+
+    def call(self, method, args, kwargs):
+        if self.kind == 'hdfs':
+            if method not in HDFS_AGENT_METHODS:
+                raise AgentError('%s is not run by the agent' % method)
+            result = getattr(self.module.client, method)(*args, **kwargs)
+            if method == 'walk':
+                result = list(result)
+            return result
+        from ahdp.module_utils.hs2base import TTransportException
+        with self.lock:
+            cursor = self.module.cursor
+            try:
+                if method == 'execute':
+                    database = kwargs.get('database')
+                    if database:
+                        cursor.execute('USE %s' % database)
+                    try:
+                        cursor.execute(*args)
+                        return cursor.fetchall() if cursor.has_result_set else []
+                    finally:
+                        # the next calls do not inherit the database
+                        if database:
+                            cursor.execute('USE default')
+                elif method == 'database_exists':
+                    return cursor.database_exists(*args)
+            except (TTransportException, socket.error):
+                self.broken = True
+                raise
+        raise AgentError('%s is not run by the agent' % method)
+
+class AgentServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout=AGENT_IDLE_TIMEOUT):
+        self.path = osp.expanduser(path)
+        self.idle_timeout = idle_timeout
+        self.last_request = time.time()
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        directory = osp.dirname(self.path)
+        if not osp.isdir(directory):
+            os.makedirs(directory, 0700)
+        if osp.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # left by an agent which did not exit cleanly
+                os.remove(self.path)
+            else:
+                raise AgentError('an agent is already listening on %s' % self.path)
+            finally:
+                probe.close()
+        old_umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, self.path, AgentRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def verify_request(self, request, client_address):
+        ''' only the processes of the agent user are served '''
+        try:
+            _, uid, _ = struct.unpack('3i', request.getsockopt(socket.SOL_SOCKET, _SO_PEERCRED, struct.calcsize('3i')))
+        except socket.error:
+            return False
+        return uid == os.getuid()
+
+    def open_session(self, kind, params):
+        key = session_key(kind, params)
+        with self.sessions_lock:
+            if key not in self.sessions or time.time() - self.sessions[key].created > AGENT_SESSION_MAX_AGE:
+                # the credential cache is exported to the whole process, so one kerberos principal per agent
+                principals = set( s.principal for s in self.sessions.values() if s.principal )
+                if params.get('principal') and principals and params['principal'] not in principals:
+                    raise AgentError('the agent serves the kerberos principal %s' % ', '.join(principals))
+                self.sessions[key] = _Session(kind, params)
+            session = self.sessions[key]
+        self.call_session(key, session, 'reset')
+        return key
+
+    def call_session(self, key, session, method, args=(), kwargs=None):
+        ''' run a session method, drop the session if its connection was lost '''
+        try:
+            if method == 'reset':
+                return session.reset()
+            return session.call(method, args, kwargs or {})
+        except Exception:
+            if session.broken:
+                with self.sessions_lock:
+                    if self.sessions.get(key) is session:
+                        del self.sessions[key]
+            raise
+
+    def dispatch(self, message):
+        self.last_request = time.time()
+        if message.get('method') == 'open':
+            return self.open_session(message['kwargs']['kind'], message['kwargs']['params'])
+        key = message.get('session')
+        session = self.sessions.get(key)
+        if session is None:
+            raise AgentError('unknown session')
+        # the TGT of the shared credential cache is renewed when needed
+        ccache = getattr(session.module, 'ccache', None)
+        if ccache is not None and hasattr(ccache, 'valid') and not ccache.valid():
+            ccache.acquire()
+        return self.call_session(key, session, message['method'], message.get('args') or [], message.get('kwargs') or {})
+
+    def serve_until_idle(self):
+        self.timeout = min(60, self.idle_timeout) if self.idle_timeout > 0 else None
+        try:
+            while self.idle_timeout <= 0 or time.time() - self.last_request < self.idle_timeout:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if osp.exists(self.path):
+                os.remove(self.path)
+
+class AgentRequestHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                message = _recv(self.request)
+            except (socket.error, ValueError):
+                return
+            if message is None:
+                return
+            try:
+                response = { 'result': self.server.dispatch(message) }
+            except Exception, e:
+                response = { 'error': '%s: %s' % (type(e).__name__, str(e)) }
+            try:
+                _send(self.request, response)
+            except (TypeError, ValueError), e:
+                _send(self.request, { 'error': 'result can not be serialized: %s' % str(e) })
+            except socket.error:
+                return
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [--socket PATH] [--idle-timeout SECONDS]')
+    parser.add_option('--socket', default=AGENT_DEFAULT_SOCKET, help='unix socket the agent listens on')
+    parser.add_option('--idle-timeout', type='int', default=AGENT_IDLE_TIMEOUT,
+                      help='exit after this number of seconds without requests, 0 never exits')
+    options, _ = parser.parse_args()
+    try:
+        server = AgentServer(options.socket, idle_timeout=options.idle_timeout)
+    except (AgentError, socket.error), e:
+        sys.stderr.write('%s\n' % str(e))
+        sys.exit(1)
+    server.serve_until_idle()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+import posixpath
+import tempfile
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    has_sqlite3 = False
+else:
+    has_sqlite3 = True
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+#################################################################################################################
+# Offline index of the namespace, built from a local dump of the fsimage made with the offline image viewer:
+#   hdfs oiv -p Delimited -i fsimage_0000000000000000042 -o fsimage.tsv
+#   hdfs oiv -p XML -i fsimage_0000000000000000042 -o fsimage.xml
+# The dump is parsed as a stream into a sqlite file holding one row per inode sorted by path, so listings
+# are an indexed lookup and content summaries a range scan on the path, with no namenode request.
+#################################################################################################################
+
+FSIMAGE_INDEX_VERSION = '1'
+
+# columns of the Delimited processor output, used when the dump has no header
+DELIMITED_COLUMNS = [ 'Path', 'Replication', 'ModificationTime', 'AccessTime', 'PreferredBlockSize', 'BlocksCount',
+                      'FileSize', 'NSQUOTA', 'DSQUOTA', 'Permission', 'UserName', 'GroupName' ]
+
+# the Delimited processor writes the dates in the local time of the dump
+DELIMITED_TIME_FORMATS = [ '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S' ]
+
+INODE_COLUMNS = [ 'path', 'parent', 'name', 'type', 'length', 'replication', 'blockSize', 'modificationTime',
+                  'accessTime', 'permission', 'owner', 'grp', 'quota', 'spaceQuota', 'fileId', 'childrenNum' ]
+
+INSERT_BATCH_SIZE = 10000
+
+class FsImageError(Exception):
+    pass
+
+def _parse_time(value):
+    ''' Delimited dates to milliseconds since epoch '''
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    for time_format in DELIMITED_TIME_FORMATS:
+        try:
+            return int(time.mktime(time.strptime(value, time_format))) * 1000
+        except ValueError:
+            pass
+    return 0
+
+def _parse_permission(value):
+    ''' Convert a permission string (ex: drwxrwxrwt or -rw-r--r--+) to its type and octal
+        permission string as in the webhdfs FileStatus (ex: 1777) '''
+    value = value.rstrip('+')
+    kind = { 'd': 'DIRECTORY', 'l': 'SYMLINK' }.get(value[:1], 'FILE')
+    bits = value[1:10]
+    mode = 0
+    for i, c in enumerate(bits):
+        # s and t also mean the execute bit is set, S and T that it is not
+        if c in 'rwxst':
+            mode |= 1 << (8 - i)
+    if bits[2:3] in ('s', 'S'):
+        mode |= 04000
+    if bits[5:6] in ('s', 'S'):
+        mode |= 02000
+    if bits[8:9] in ('t', 'T'):
+        mode |= 01000
+    return kind, '%o' % mode
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def _row(path, kind, length=0, replication=0, blockSize=0, modificationTime=0, accessTime=0, permission='0',
+         owner=None, group=None, quota=-1, spaceQuota=-1, fileId=0):
+    if path == '/':
+        parent, name = None, ''
+    else:
+        parent, name = posixpath.split(path)
+    return ( path, parent, name, kind, length, replication, blockSize, modificationTime, accessTime,
+             permission, owner, group, quota, spaceQuota, fileId, 0 )
+
+def read_delimited(stream, delimiter='\t'):
+    ''' Yield the index rows of a Delimited processor output '''
+    columns = None
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        values = line.split(delimiter)
+        if columns is None:
+            if values[0] == 'Path':
+                columns = dict( (column, i) for i, column in enumerate(values) )
+                continue
+            columns = dict( (column, i) for i, column in enumerate(DELIMITED_COLUMNS) )
+
+        def get(column, default=''):
+            i = columns.get(column)
+            return values[i] if i is not None and i < len(values) else default
+
+        path = posixpath.normpath(get('Path'))
+        kind, permission = _parse_permission(get('Permission'))
+        yield _row(path, kind,
+                   length=_int(get('FileSize')),
+                   replication=_int(get('Replication')),
+                   blockSize=_int(get('PreferredBlockSize')),
+                   modificationTime=_parse_time(get('ModificationTime')),
+                   accessTime=_parse_time(get('AccessTime')),
+                   permission=permission,
+                   owner=get('UserName'),
+                   group=get('GroupName'),
+                   quota=_int(get('NSQUOTA'), -1),
+                   spaceQuota=_int(get('DSQUOTA'), -1))
+
+def _xml_permission(value):
+    ''' user:group:mode of the XML processor, the mode is octal (0755) or a permission string '''
+    owner, group, mode = value.split(':', 2)
+    if mode.isdigit():
+        return owner, group, '%o' % (int(mode, 8) & 07777)
+    return owner, group, _parse_permission('-' + mode)[1]
+
+def _load_xml(stream, conn):
+    ''' Load the inodes and the directory tree of an XML processor output in temporary tables,
+        the elements are dropped once read so the document is never fully in memory '''
+    conn.execute('CREATE TEMP TABLE xinodes (id INTEGER PRIMARY KEY, name TEXT, type TEXT, length INTEGER, replication INTEGER, '
+                 'blockSize INTEGER, modificationTime INTEGER, accessTime INTEGER, permission TEXT, owner TEXT, grp TEXT, '
+                 'quota INTEGER, spaceQuota INTEGER)')
+    conn.execute('CREATE TEMP TABLE xchildren (parent INTEGER, child INTEGER)')
+    inodes, children = [], []
+    root_id = None
+    section = None
+    for event, elem in ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag in ('INodeSection', 'INodeDirectorySection'):
+                section = elem
+            continue
+        if elem.tag in ('INodeSection', 'INodeDirectorySection'):
+            section = None
+        elif section is None:
+            # the snapshot sections are not indexed
+            continue
+        elif elem.tag == 'inode' and section.tag == 'INodeSection':
+            owner, group, permission = _xml_permission(elem.findtext('permission', '::0'))
+            length = sum( _int(block.findtext('numBytes')) for block in elem.iterfind('blocks/block') )
+            inode = ( _int(elem.findtext('id')), elem.findtext('name') or '', elem.findtext('type'), length,
+                      _int(elem.findtext('replication')), _int(elem.findtext('preferredBlockSize')),
+                      _int(elem.findtext('mtime')), _int(elem.findtext('atime')), permission, owner, group,
+                      _int(elem.findtext('nsquota'), -1), _int(elem.findtext('dsquota'), -1) )
+            if root_id is None and inode[2] == 'DIRECTORY' and inode[1] == '':
+                root_id = inode[0]
+            inodes.append(inode)
+            section.clear()
+        elif elem.tag == 'directory' and section.tag == 'INodeDirectorySection':
+            parent = _int(elem.findtext('parent'))
+            children.extend( (parent, _int(child.text)) for child in elem.iterfind('child') )
+            section.clear()
+        if len(inodes) >= INSERT_BATCH_SIZE:
+            conn.executemany('INSERT INTO xinodes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', inodes)
+            inodes = []
+        if len(children) >= INSERT_BATCH_SIZE:
+            conn.executemany('INSERT INTO xchildren VALUES (?,?)', children)
+            children = []
+    conn.executemany('INSERT INTO xinodes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', inodes)
+    conn.executemany('INSERT INTO xchildren VALUES (?,?)', children)
+    conn.execute('CREATE INDEX xchildren_parent ON xchildren (parent)')
+    if root_id is None:
+        raise FsImageError('no root directory found in the fsimage dump')
+    return root_id
+
+def read_xml(stream, conn):
+    ''' Yield the index rows of an XML processor output, the paths are built walking the directory tree '''
+    root_id = _load_xml(stream, conn)
+    query = ('SELECT i.id, i.name, i.type, i.length, i.replication, i.blockSize, i.modificationTime, i.accessTime, '
+             'i.permission, i.owner, i.grp, i.quota, i.spaceQuota FROM xinodes i')
+    inode = conn.execute(query + ' WHERE i.id = ?', (root_id,)).fetchone()
+    stack = [ ('/', inode) ]
+    while stack:
+        path, inode = stack.pop()
+        yield _row(path, inode[2], length=inode[3], replication=inode[4], blockSize=inode[5], modificationTime=inode[6],
+                   accessTime=inode[7], permission=inode[8], owner=inode[9], group=inode[10], quota=inode[11],
+                   spaceQuota=inode[12], fileId=inode[0])
+        if inode[2] == 'DIRECTORY':
+            for child in conn.execute(query + ' JOIN xchildren c ON c.child = i.id WHERE c.parent = ?', (inode[0],)).fetchall():
+                stack.append( (posixpath.join(path, child[1]), child) )
+
+def _is_xml(source):
+    with open(source, 'rb') as f:
+        return f.read(1024).lstrip().startswith('<')
+
+def _is_index(source):
+    with open(source, 'rb') as f:
+        return f.read(16) == 'SQLite format 3\0'
+
+def build_fsimage_index(source, index, delimiter='\t'):
+    ''' Build the index of an offline image viewer dump (Delimited or XML processor) into the sqlite file index.
+        The index is written to a temporary file renamed once complete, so a partial index is never used. '''
+    if not has_sqlite3:
+        raise FsImageError('the python sqlite3 module is required to index the fsimage')
+    fd, tmp_index = tempfile.mkstemp(prefix='.%s.' % os.path.basename(index), dir=os.path.dirname(os.path.abspath(index)))
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_index)
+        conn.text_factory = str
+        # nothing to recover if the build fails
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE inodes (%s)' % ', '.join(INODE_COLUMNS))
+        with open(source, 'rb') as stream:
+            rows = read_xml(stream, conn) if _is_xml(source) else read_delimited(stream, delimiter)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    conn.executemany('INSERT INTO inodes VALUES (%s)' % ','.join('?' * len(INODE_COLUMNS)), batch)
+                    batch = []
+            conn.executemany('INSERT INTO inodes VALUES (%s)' % ','.join('?' * len(INODE_COLUMNS)), batch)
+        # the indexes are faster to build once the rows are loaded
+        conn.execute('CREATE UNIQUE INDEX inodes_path ON inodes (path)')
+        conn.execute('CREATE INDEX inodes_parent ON inodes (parent, name)')
+        conn.execute('UPDATE inodes SET childrenNum = (SELECT count(*) FROM inodes c WHERE c.parent = inodes.path) '
+                     'WHERE type = \'DIRECTORY\'')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [ ('version', FSIMAGE_INDEX_VERSION), ('source', os.path.abspath(source)) ])
+        conn.commit()
+        conn.close()
+        os.rename(tmp_index, index)
+    except:
+        os.remove(tmp_index)
+        raise
+
+def open_fsimage_index(source, index=None, delimiter='\t'):
+    ''' Return the FsImageIndex of a dump, the index is (re)built if it is missing or older than the dump.
+        source can also be an index built earlier. '''
+    if not os.path.exists(source):
+        raise FsImageError('fsimage dump %s does not exist' % source)
+    if _is_index(source):
+        return FsImageIndex(source)
+    if index is None:
+        index = source + '.idx'
+    if not os.path.exists(index) or os.path.getmtime(index) < os.path.getmtime(source):
+        build_fsimage_index(source, index, delimiter=delimiter)
+    fsimage = FsImageIndex(index)
+    if fsimage.version != FSIMAGE_INDEX_VERSION:
+        fsimage.close()
+        build_fsimage_index(source, index, delimiter=delimiter)
+        fsimage = FsImageIndex(index)
+    return fsimage
+
+class FsImageIndex(object):
+    ''' Read only view of an fsimage index implementing the parts of the pywhdfs client used to search the
+        namespace (resolvepath, status, list and content), so the walk and the filters can use it in place of
+        the client. The connection is shared by the worker threads under a lock. '''
+
+    def __init__(self, index):
+        if not has_sqlite3:
+            raise FsImageError('the python sqlite3 module is required to read the fsimage index')
+        self.index = index
+        self.conn = sqlite3.connect(index, check_same_thread=False)
+        self.conn.text_factory = str
+        self.lock = threading.Lock()
+        try:
+            self.version = self._query('SELECT value FROM meta WHERE key = ?', ('version',))[0][0]
+        except (sqlite3.DatabaseError, IndexError):
+            self.version = None
+
+    def close(self):
+        self.conn.close()
+
+    def _query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def _status(self, row):
+        return {
+            'pathSuffix'       : row[2],
+            'type'             : row[3],
+            'length'           : row[4],
+            'replication'      : row[5],
+            'blockSize'        : row[6],
+            'modificationTime' : row[7],
+            'accessTime'       : row[8],
+            'permission'       : row[9],
+            'owner'            : row[10],
+            'group'            : row[11],
+            'fileId'           : row[14],
+            'childrenNum'      : row[15],
+            # the dump has no storage policy, 0 is unspecified
+            'storagePolicy'    : 0,
+            }
+
+    def resolvepath(self, path):
+        return posixpath.normpath('/' + path.lstrip('/'))
+
+    def status(self, hdfs_path, strict=True):
+        rows = self._query('SELECT * FROM inodes WHERE path = ?', (self.resolvepath(hdfs_path),))
+        if not rows:
+            if strict:
+                raise FsImageError('File does not exist: %s' % hdfs_path)
+            return None
+        return self._status(rows[0])
+
+    def list(self, hdfs_path, status=False):
+        path = self.resolvepath(hdfs_path)
+        rows = self._query('SELECT * FROM inodes WHERE parent = ? ORDER BY name', (path,))
+        if not rows and self.status(path)['type'] != 'DIRECTORY':
+            raise FsImageError('%s is not a directory' % hdfs_path)
+        if status:
+            return [ (row[2], self._status(row)) for row in rows ]
+        return [ row[2] for row in rows ]
+
+    def content(self, hdfs_path, strict=True):
+        ''' content summary of a path, a range scan of the paths below it '''
+        path = self.resolvepath(hdfs_path)
+        row = self._query('SELECT type, length, replication, quota, spaceQuota FROM inodes WHERE path = ?', (path,))
+        if not row:
+            if strict:
+                raise FsImageError('File does not exist: %s' % hdfs_path)
+            return None
+        kind, length, replication, quota, spaceQuota = row[0]
+        summary = { 'directoryCount': 0, 'fileCount': 0, 'length': 0, 'spaceConsumed': 0, 'quota': quota, 'spaceQuota': spaceQuota }
+        if kind != 'DIRECTORY':
+            summary.update(fileCount=1, length=length, spaceConsumed=length * replication, quota=-1, spaceQuota=-1)
+            return summary
+        prefix = path.rstrip('/') + '/'
+        # '0' follows '/', so the range holds all the paths below the directory
+        totals = self._query('SELECT sum(type = \'DIRECTORY\'), sum(type != \'DIRECTORY\'), sum(length), sum(length * replication) '
+                             'FROM inodes WHERE path > ? AND path < ?', (prefix, prefix[:-1] + '0'))[0]
+        summary.update(directoryCount=(totals[0] or 0) + 1, fileCount=totals[1] or 0, length=totals[2] or 0, spaceConsumed=totals[3] or 0)
+        return summary
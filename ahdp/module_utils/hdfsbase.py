@@ -7,22 +7,96 @@ import stat
 import json
 import ast
 import os.path as osp
+import posixpath
+import fnmatch
+import sys
+import tempfile
+import zlib
+import bz2
+import struct
+import time
+import fcntl
+import errno
+import hmac
+from itertools import islice
 from subprocess import call, Popen, PIPE
 
-try:
-    from pywhdfs.client import *
-    from pywhdfs.utils.utils import HdfsError
-except ImportError:
-    has_pywhdfs = False
-else:
-    has_pywhdfs = True
+#################################################################################################################
+# pywhdfs (and requests), requests_kerberos, gssapi and snappy make most of the import time of this module, which
+# every hdfs module pays before parsing its arguments, while many invocations never need some of them (or none when
+# the calls are forwarded to the ahdp agent). They are imported when first needed by the load_* functions, which
+# set the matching has_* flag (None until then).
+#################################################################################################################
 
-try:
-    import requests_kerberos as rk
-except ImportError:
-    has_kerberos_ext = False
-else:
-    has_kerberos_ext = True
+has_pywhdfs = None
+has_requests = None
+has_kerberos_ext = None
+has_gssapi = None
+has_snappy = None
+
+class HdfsError(Exception):
+    ''' Stands for the pywhdfs HdfsError until load_pywhdfs replaces it. '''
+
+    def __init__(self, message, *args):
+        super(HdfsError, self).__init__(message % args if args else message)
+
+def load_pywhdfs():
+    global has_pywhdfs, requests, WebHDFSClient, HdfsError
+    if has_pywhdfs is None:
+        try:
+            import requests
+            from pywhdfs.client import WebHDFSClient
+            from pywhdfs.utils.utils import HdfsError
+        except ImportError:
+            has_pywhdfs = False
+        else:
+            has_pywhdfs = True
+    return has_pywhdfs
+
+def load_requests():
+    global has_requests, requests
+    if has_requests is None:
+        try:
+            import requests
+        except ImportError:
+            has_requests = False
+        else:
+            has_requests = True
+    return has_requests
+
+def load_kerberos_ext():
+    global has_kerberos_ext
+    if has_kerberos_ext is None:
+        try:
+            import requests_kerberos
+        except ImportError:
+            has_kerberos_ext = False
+        else:
+            has_kerberos_ext = True
+    return has_kerberos_ext
+
+def load_gssapi():
+    global has_gssapi, gssapi
+    if has_gssapi is None:
+        try:
+            import gssapi
+        except ImportError:
+            has_gssapi = False
+        else:
+            # the password and credential store extensions (MIT krb5) are needed to get a TGT in-process
+            has_gssapi = hasattr(gssapi.raw, 'acquire_cred_with_password') and hasattr(gssapi.raw, 'store_cred_into')
+    return has_gssapi
+
+def load_snappy():
+    global has_snappy, snappy
+    if has_snappy is None:
+        try:
+            import snappy
+        except ImportError:
+            has_snappy = False
+        else:
+            has_snappy = True
+    return has_snappy
 
 AVAILABLE_HASH_ALGORITHMS = dict()
 try:
@@ -52,6 +126,551 @@ PERM_BITS = int('07777', 8)      # file mode permission bits
 EXEC_PERM_BITS = int('00111', 8) # execute permission bits
 DEFAULT_PERM = int('0666', 8)    # default file permission bits
 
+SYMBOLIC_MODE_RE = re.compile(r'^(?P<users>[ugoa]+)(?P<operator>[-+=])(?P<perms>[rwxXst-]*|[ugo])$')
+
+# Permission bits constants documented at:
+# http://docs.python.org/2/library/stat.html#stat.S_ISUID
+SYMBOLIC_PERM_BITS = {
+    'u': { 'r': stat.S_IRUSR, 'w': stat.S_IWUSR, 'x': stat.S_IXUSR, 's': stat.S_ISUID, 't': 0 },
+    'g': { 'r': stat.S_IRGRP, 'w': stat.S_IWGRP, 'x': stat.S_IXGRP, 's': stat.S_ISGID, 't': 0 },
+    'o': { 'r': stat.S_IROTH, 'w': stat.S_IWOTH, 'x': stat.S_IXOTH, 's': 0, 't': stat.S_ISVTX },
+}
+SYMBOLIC_USER_SHIFT = { 'u': 6, 'g': 3, 'o': 0 }
+
+def _apply_operation_to_mode(user, operator, mode_to_apply, current_mode):
+    if operator  ==  '=':
+        if user == 'u': mask = stat.S_IRWXU | stat.S_ISUID
+        elif user == 'g': mask = stat.S_IRWXG | stat.S_ISGID
+        elif user == 'o': mask = stat.S_IRWXO | stat.S_ISVTX
+
+        # mask out u, g, or o permissions from current_mode and apply new permissions
+        inverse_mask = mask ^ PERM_BITS
+        new_mode = (current_mode & inverse_mask) | mode_to_apply
+    elif operator == '+':
+        new_mode = current_mode | mode_to_apply
+    elif operator == '-':
+        new_mode = current_mode - (current_mode & mode_to_apply)
+    return new_mode
+
+class SymbolicMode(object):
+    ''' A symbolic mode (ex: u+rwX,g+rX,o-rwx) parsed once into its clauses.
+
+        Calling the instance with the current mode of a path and whether it is a directory
+        returns the target mode without any call to hdfs, so it can be applied to every
+        status of a listing. As with chmod, X and the u/g/o copies refer to the mode the
+        path had before the change.
+    '''
+
+    def __init__(self, symbolic_mode):
+        self.symbolic_mode = symbolic_mode
+        # list of (user, operator, static bits, perms resolved against the current mode)
+        self.clauses = []
+
+        for mode in symbolic_mode.split(','):
+            match = SYMBOLIC_MODE_RE.match(mode)
+            if not match:
+                raise ValueError("bad symbolic permission for mode: %s" % mode)
+
+            users = match.group('users')
+            operator = match.group('operator')
+            perms = match.group('perms')
+
+            if users == 'a':
+                users = 'ugo'
+
+            for user in users:
+                static_bits = 0
+                dynamic_perms = ''
+                for perm in perms:
+                    if perm in 'Xugo':
+                        dynamic_perms += perm
+                    else:
+                        static_bits |= SYMBOLIC_PERM_BITS[user][perm]
+                self.clauses.append( (user, operator, static_bits, dynamic_perms) )
+
+    def __call__(self, current_mode, is_dir=False):
+        apply_X_permission = is_dir or (current_mode & EXEC_PERM_BITS) > 0
+
+        new_mode = current_mode
+        for user, operator, static_bits, dynamic_perms in self.clauses:
+            mode_to_apply = static_bits
+            for perm in dynamic_perms:
+                if perm == 'X':
+                    if apply_X_permission:
+                        mode_to_apply |= SYMBOLIC_PERM_BITS[user]['x']
+                else:
+                    # copy the permissions of another class, ex: g=u
+                    bits = (current_mode >> SYMBOLIC_USER_SHIFT[perm]) & 7
+                    mode_to_apply |= bits << SYMBOLIC_USER_SHIFT[user]
+            new_mode = _apply_operation_to_mode(user, operator, mode_to_apply, new_mode)
+        return new_mode
+
+_SYMBOLIC_MODES = {}
+
+def compile_symbolic_mode(symbolic_mode):
+    ''' Return the SymbolicMode of symbolic_mode, every distinct mode is parsed only once. '''
+    compiled = _SYMBOLIC_MODES.get(symbolic_mode)
+    if compiled is None:
+        compiled = _SYMBOLIC_MODES[symbolic_mode] = SymbolicMode(symbolic_mode)
+    return compiled
+
+def hdfs_status_mode(status):
+    ''' Return the numeric mode of a FileStatus, webhdfs already includes the sticky bit
+        in the permission string (ex: 1777) so no acl status is needed. '''
+    return int(str(status['permission']), 8)
+
+# fields of hdfs_statinfo, the content ones come from the content summary
+STATINFO_STATUS_FIELDS = [ 'pathSuffix', 'type', 'owner', 'group', 'permission', 'isdir', 'isfile', 'childrenNum', 'replication',
+                           'storagePolicy', 'fileId', 'blockSize', 'accessTime', 'modificationTime', 'length',
+                           'rusr', 'wusr', 'xusr', 'rgrp', 'wgrp', 'xgrp', 'roth', 'woth', 'xoth' ]
+STATINFO_CONTENT_FIELDS = [ 'length', 'spaceConsumed', 'quota', 'spaceQuota', 'directoryCount', 'fileCount' ]
+STATINFO_FIELDS = STATINFO_STATUS_FIELDS + STATINFO_CONTENT_FIELDS[1:]
+
+def hdfs_statinfo_needs_content(status, fields=None):
+    ''' Tell if the content summary of a path is needed to return fields, the length of
+        a file is already in its status. '''
+    if fields is None:
+        return True
+    needed = [ f for f in fields if f in STATINFO_CONTENT_FIELDS ]
+    if status['type'] == 'FILE' and 'length' in needed:
+        needed.remove('length')
+    return len(needed) > 0
+
+def hdfs_statinfo(status, content=None, fields=None):
+    ''' Return the stat dictionary of a path from its FileStatus and content summary, restricted to
+        fields if given. The content summary fields are missing if content is None. '''
+    mode = hdfs_status_mode(status)
+    d = {
+        'pathSuffix'        : status['pathSuffix'],
+        'type'              : status['type'],
+        'owner'             : status['owner'],
+        'group'             : status['group'],
+        'permission'        : status['permission'],
+        'isdir'             : bool(status['type'] == 'DIRECTORY'),
+        'isfile'            : bool(status['type'] == 'FILE'),
+        'childrenNum'       : status['childrenNum'],
+        'replication'       : status['replication'],
+        'storagePolicy'     : status['storagePolicy'],
+        'fileId'            : status['fileId'],
+        'blockSize'         : status['blockSize'],
+        'accessTime'        : status['accessTime'],
+        'modificationTime'  : status['modificationTime'],
+        'length'            : status['length'],
+        # permissions for owner
+        'rusr'              : bool(mode & stat.S_IRUSR),
+        'wusr'              : bool(mode & stat.S_IWUSR),
+        'xusr'              : bool(mode & stat.S_IXUSR),
+        # permission for owner's group
+        'rgrp'              : bool(mode & stat.S_IRGRP),
+        'wgrp'              : bool(mode & stat.S_IWGRP),
+        'xgrp'              : bool(mode & stat.S_IXGRP),
+        # permissions for others
+        'roth'              : bool(mode & stat.S_IROTH),
+        'woth'              : bool(mode & stat.S_IWOTH),
+        'xoth'              : bool(mode & stat.S_IXOTH),
+        }
+    if content is not None:
+        for field in STATINFO_CONTENT_FIELDS:
+            d[field] = content[field]
+    if fields is not None:
+        d = dict( (field, d[field]) for field in fields if field in d )
+    return d
+
+def hdfs_columnar(records, fields):
+    ''' Return a list of dictionaries as a dictionary of parallel lists, much smaller to serialize. '''
+    columns = dict( (field, []) for field in fields )
+    for record in records:
+        for field in fields:
+            columns[field].append(record.get(field))
+    return columns
+
+class ResultSpool(object):
+    ''' Write result records as newline delimited json to a local file while they are produced, so large
+        results are neither kept in memory nor returned through ansible. Records go to a temporary file
+        in the same directory, renamed to path when the spool is closed, so a failed run never leaves a
+        partial result file. Use it as a context manager, the file is discarded if the block fails
+        (note that exit_json also exits the block with an exception). '''
+
+    FLUSH_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = osp.abspath(osp.expanduser(path))
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.%s.' % osp.basename(self.path), dir=osp.dirname(self.path))
+        self.file = os.fdopen(fd, 'w')
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write('\n')
+        self.count += 1
+        if self.count % self.FLUSH_EVERY == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+        # mkstemp creates the file readable only by its owner, it gets the mode of a file created with the user umask
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.tmp_path, 0666 & ~umask)
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if osp.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def hdfs_map(func, items, concurrency=1):
+    ''' Apply func to every item on a pool of concurrency threads and yield (item, result)
+        in order. Items are consumed in bounded windows so huge listings are never fully
+        loaded, and an exception raised by func is raised again in the calling thread. '''
+    items = iter(items)
+    if concurrency is None or concurrency <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    def _call(item):
+        try:
+            return True, func(item)
+        except Exception:
+            return False, sys.exc_info()
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(concurrency)
+    try:
+        while True:
+            window = list(islice(items, concurrency * 4))
+            if not window:
+                break
+            for item, (ok, result) in zip(window, pool.imap(_call, window)):
+                if not ok:
+                    raise result[0], result[1], result[2]
+                yield item, result
+    finally:
+        pool.terminate()
+
+def _acl_perm(bits):
+    return ''.join( c if bits & b else '-' for c, b in (('r', 4), ('w', 2), ('x', 1)) )
+
+def _acl_bits(perm):
+    return sum( b for c, b in (('r', 4), ('w', 2), ('x', 1)) if c in perm )
+
+class HdfsAcl(object):
+    ''' The canonical acl of a path, ex: {(False, 'user', ''): 'rwx', (True, 'group', 'hadoop'): 'r-x'}
+        keyed by (default scope, type, name). webhdfs only returns the extended entries, the base
+        user, other and group (or mask) entries are rebuilt from the permission bits.
+
+        apply() follows the hdfs AclTransformation rules (merge, replace and filter, defaults copied
+        from the access entries, mask recalculation) so the acl resulting from a mutation is known
+        without reading it back.
+    '''
+
+    def __init__(self, entries):
+        self.entries = dict(entries)
+
+    @staticmethod
+    def parse_entry(entry):
+        fields = entry.split(':')
+        default = fields[0] == 'default'
+        if default:
+            fields = fields[1:]
+        return (default, fields[0], fields[1]), (fields[2] if len(fields) > 2 else '')
+
+    @classmethod
+    def from_status(cls, status, acl_status):
+        mode = hdfs_status_mode(status)
+        entries = dict( cls.parse_entry(entry) for entry in acl_status['entries'] )
+        # with extended access entries the group bits hold the mask and the group:: entry is returned
+        if [ key for key in entries if not key[0] ]:
+            entries[(False, 'mask', '')] = _acl_perm(mode >> 3)
+        else:
+            entries[(False, 'group', '')] = _acl_perm(mode >> 3)
+        entries[(False, 'user', '')] = _acl_perm(mode >> 6)
+        entries[(False, 'other', '')] = _acl_perm(mode)
+        return cls(entries)
+
+    def __eq__(self, other):
+        return self.entries == other.entries
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def to_list(self):
+        return sorted( '%s%s:%s:%s' % ('default:' if key[0] else '', key[1], key[2], perm) for key, perm in self.entries.items() )
+
+    def apply(self, operation, spec=None):
+        ''' Return the acl after an operation: modify, set, remove or remove_all. '''
+        if operation == 'remove_all':
+            # removeAcl restores the group bits from the group:: entry, removeDefaultAcl drops the defaults
+            return HdfsAcl( (key, perm) for key, perm in self.entries.items()
+                            if not key[0] and not key[2] and key[1] != 'mask' )
+
+        spec = dict( self.parse_entry(entry) for entry in spec )
+        entries = {}
+        provided_mask = {}
+        mask_dirty = set()
+        scope_dirty = set()
+
+        if operation == 'modify':
+            for key, perm in self.entries.items() + spec.items():
+                if key[1] == 'mask':
+                    provided_mask[key[0]] = perm
+                else:
+                    entries[key] = perm
+            for key in spec:
+                (mask_dirty if key[1] == 'mask' else scope_dirty).add(key[0])
+        elif operation == 'set':
+            for key, perm in spec.items():
+                scope_dirty.add(key[0])
+                if key[1] == 'mask':
+                    provided_mask[key[0]] = perm
+                    mask_dirty.add(key[0])
+                else:
+                    entries[key] = perm
+            # a scope absent from the spec is kept
+            for key, perm in self.entries.items():
+                if key[0] not in scope_dirty:
+                    if key[1] == 'mask':
+                        provided_mask[key[0]] = perm
+                    else:
+                        entries[key] = perm
+        elif operation == 'remove':
+            for key, perm in self.entries.items():
+                if key in spec:
+                    scope_dirty.add(key[0])
+                    if key[1] == 'mask':
+                        mask_dirty.add(key[0])
+                elif key[1] == 'mask':
+                    provided_mask[key[0]] = perm
+                else:
+                    entries[key] = perm
+        else:
+            raise ValueError("unknown acl operation %s" % operation)
+
+        # default base entries not provided are copied from the access ones
+        if [ key for key in entries if key[0] ]:
+            for etype in ('user', 'group', 'other'):
+                if (True, etype, '') not in entries and (False, etype, '') in entries:
+                    entries[(True, etype, '')] = entries[(False, etype, '')]
+
+        # the mask is kept if provided or if its scope did not change, otherwise it is recalculated
+        # as the union of the group class permissions (named users, group and named groups)
+        for default in set( key[0] for key in entries ):
+            union = 0
+            mask_needed = False
+            for key, perm in entries.items():
+                if key[0] != default:
+                    continue
+                if key[1] == 'group' or key[2]:
+                    union |= _acl_bits(perm)
+                if key[2]:
+                    mask_needed = True
+            if default in provided_mask and (default not in scope_dirty or default in mask_dirty):
+                entries[(default, 'mask', '')] = provided_mask[default]
+            elif mask_needed or default in provided_mask:
+                entries[(default, 'mask', '')] = _acl_perm(union)
+
+        return HdfsAcl(entries)
+
+GLOB_MAGIC_RE = re.compile(r'[*?[]')
+
+def hdfs_glob(client, pattern):
+    ''' Yield the (path, status) of the hdfs paths matching a glob pattern, ex: /data/*/dt=2024-*/hour=0[0-5].
+        The pattern is matched one component at a time and only the directories matching all the
+        previous components are listed, so the non matching branches are never traversed. '''
+    components = [ c for c in pattern.split('/') if c ]
+    # the literal prefix is resolved without any listing
+    i = 0
+    while i < len(components) and not GLOB_MAGIC_RE.search(components[i]):
+        i += 1
+    base = client.resolvepath(('/' if pattern.startswith('/') else '') + '/'.join(components[:i]))
+    status = client.status(base, strict=False)
+    if status is None:
+        return
+    matchers = [ re.compile(fnmatch.translate(c)) if GLOB_MAGIC_RE.search(c) else c for c in components[i:] ]
+
+    def _expand(path, status, depth):
+        if depth == len(matchers):
+            yield path, status
+            return
+        if status['type'] != 'DIRECTORY':
+            return
+        matcher = matchers[depth]
+        if isinstance(matcher, basestring):
+            # a literal component only needs a status
+            child_status = client.status(posixpath.join(path, matcher), strict=False)
+            children = [ (matcher, child_status) ] if child_status is not None else []
+        else:
+            children = [ (name, s) for name, s in client.list(path, status=True) if matcher.match(name) ]
+        for name, child_status in sorted(children, key=lambda child: child[0]):
+            for match in _expand(posixpath.join(path, name), child_status, depth + 1):
+                yield match
+
+    for match in _expand(base, status, 0):
+        yield match
+
+def hdfs_walk(client, path, status=None, max_depth=None, prune=None, concurrency=1):
+    ''' Walk a directory tree top down like os.walk and yield ((root, root status), dirs, files), dirs and files
+        being the (name, status) of the listing. max_depth limits the listing depth (1 lists the top directory
+        only), directories matching one of the prune patterns are neither returned nor listed and, like with
+        os.walk, the directories removed from dirs by the caller are not listed either. The listings of the next
+        directories to walk are requested concurrency at a time, once the caller is done with their parent. '''
+    prune_regexes = [ re.compile(fnmatch.translate(p)) for p in prune or [] ]
+    path = client.resolvepath(path)
+    if status is None:
+        status = client.status(path)
+    if status['type'] != 'DIRECTORY':
+        return
+
+    pool = None
+    if concurrency is not None and concurrency > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(concurrency)
+    # [ path, status, depth, pending listing ], the top of the stack is walked next
+    stack = [ [ path, status, 1, None ] ]
+    prefetched = 0
+    try:
+        while stack:
+            root, root_status, depth, listing = stack.pop()
+            if listing is not None:
+                prefetched -= 1
+                infos = listing.get()
+            else:
+                infos = client.list(root, status=True)
+            dirs = [ (name, s) for name, s in infos if s['type'] == 'DIRECTORY' and not [ r for r in prune_regexes if r.match(name) ] ]
+            files = [ (name, s) for name, s in infos if s['type'] == 'FILE' ]
+            yield (root, root_status), dirs, files
+            if max_depth is None or depth < max_depth:
+                for name, s in reversed(dirs):
+                    stack.append( [ posixpath.join(root, name), s, depth + 1, None ] )
+            if pool is None:
+                continue
+            # the directories on the top of the stack are walked next whatever the caller does with their listings
+            for entry in reversed(stack):
+                if prefetched >= concurrency * 4:
+                    break
+                if entry[3] is None:
+                    entry[3] = pool.apply_async(client.list, (entry[0],), { 'status': True })
+                    prefetched += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+class _StreamDecompressor(object):
+    ''' Incremental gzip/bzip2 decompression, concatenated streams (ex: multi member gzip) are supported. '''
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.decompressor = factory()
+
+    def decompress(self, data):
+        out = []
+        while data:
+            try:
+                out.append(self.decompressor.decompress(data))
+            except EOFError:
+                # the previous stream ended exactly at the end of the last chunk
+                self.decompressor = self.factory()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self.factory()
+        return ''.join(out)
+
+class _HadoopSnappyDecompressor(object):
+    ''' Incremental decompression of the hadoop SnappyCodec block format: every block starts with its
+        uncompressed length followed by (compressed length, raw snappy data) chunks until the block
+        is complete. All the lengths are 4 bytes big endian integers. '''
+
+    def __init__(self):
+        self.buffer = ''
+        self.remaining = 0
+
+    def decompress(self, data):
+        self.buffer += data
+        out = []
+        while len(self.buffer) >= 4:
+            length = struct.unpack('>I', self.buffer[:4])[0]
+            if self.remaining == 0:
+                # new block
+                self.remaining = length
+                self.buffer = self.buffer[4:]
+                continue
+            if len(self.buffer) < 4 + length:
+                break
+            chunk = snappy.uncompress(self.buffer[4:4 + length])
+            self.buffer = self.buffer[4 + length:]
+            self.remaining = max(0, self.remaining - len(chunk))
+            out.append(chunk)
+        return ''.join(out)
+
+CONTENT_DECOMPRESSORS = {
+    '.gz': lambda: _StreamDecompressor(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    '.bz2': lambda: _StreamDecompressor(bz2.BZ2Decompressor),
+    '.snappy': _HadoopSnappyDecompressor,
+}
+
+class HdfsContentSearch(object):
+    ''' Search the content of files for a regular expression matched at the begining of every line.
+        The pattern is compiled once, files are streamed by chunks and read only up to the first
+        match (or max_bytes), .gz, .bz2 and .snappy files are decompressed on the fly.
+        match() raises the read errors, it can be called from several threads. '''
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, client, pattern, max_bytes=None):
+        self.client = client
+        # the lines are matched as read, undecoded: a non ascii pattern matches their utf-8 bytes
+        if isinstance(pattern, unicode):
+            pattern = pattern.encode('utf-8')
+        self.regex = re.compile(pattern)
+        self.max_bytes = max_bytes
+
+    def _decompressor(self, path):
+        ext = osp.splitext(path)[1].lower()
+        if ext == '.snappy' and not load_snappy():
+            raise HdfsError("python library python-snappy required to search %s: pip install python-snappy", path)
+        factory = CONTENT_DECOMPRESSORS.get(ext)
+        return factory() if factory else None
+
+    def _lines(self, chunks):
+        # the pieces of a line spanning several chunks are only joined once its end is read
+        pending = []
+        for chunk in chunks:
+            if '\n' not in chunk:
+                pending.append(chunk)
+                continue
+            lines = chunk.split('\n')
+            pending.append(lines[0])
+            yield ''.join(pending)
+            for line in lines[1:-1]:
+                yield line
+            pending = [ lines[-1] ]
+        pending = ''.join(pending)
+        if pending:
+            yield pending
+
+    def match(self, path):
+        decompressor = self._decompressor(path)
+        # leaving the with block closes the connection, so the rest of the file is never transfered
+        with self.client.read(path, length=self.max_bytes, chunk_size=self.CHUNK_SIZE) as reader:
+            if decompressor is not None:
+                reader = ( decompressor.decompress(chunk) for chunk in reader )
+            for line in self._lines(reader):
+                if self.regex.match(line):
+                    return True
+        return False
+
 def _check_required_if(module, spec):
         ''' ensure that parameters which conditionally required are present '''
         if spec is None:
@@ -122,6 +741,33 @@ def hdfs_argument_spec():
         # Root path, this will be prefixed to all HDFS paths passed to the client. If the root is relative, 
         # the path will be assumed relative to the user's home directory.
         root= dict(required=False, default=None),
+        # Maximum number of concurrent requests sent to the namenode by operations applied to many paths.
+        concurrency= dict(required=False, default=10, type='int'),
+        # Client sending the webhdfs requests: pywhdfs, or the ahdp webhdfs engine running the requests of the operations
+        # applied to many paths concurrently (see webhdfs.py).
+        engine= dict(required=False, default='pywhdfs', choices=['pywhdfs','webhdfs']),
+        # Reuse the kerberos TGT between invocations from a credential cache of ccache_dir, renewed before it expires.
+        ccache_reuse= dict(required=False, default=True, type='bool'),
+        ccache_dir= dict(required=False, default=CCACHE_DEFAULT_DIR, type='path'),
+        # Lifetime of the TGT requested, in the kinit -l format (ex: 10h).
+        ccache_lifetime= dict(required=False, default=None, type='str'),
+        # With kerberos, authenticate with a delegation token kept in token_cache_dir between invocations instead of SPNEGO.
+        token_cache= dict(required=False, default=False, type='bool'),
+        token_cache_dir= dict(required=False, default=TOKEN_CACHE_DEFAULT_DIR, type='path'),
+        # Connections kept open per host (at least concurrency) and number of hosts (namenodes and datanodes) kept in the pool.
+        pool_size= dict(required=False, default=None, type='int'),
+        pool_hosts= dict(required=False, default=100, type='int'),
+        # Keep the connections open between requests.
+        keep_alive= dict(required=False, default=True, type='bool'),
+        # Send the SPNEGO token with the first request instead of waiting for the namenode challenge.
+        spnego_preemptive= dict(required=False, default=False, type='bool'),
+        # File where the last known active namenode of each nameservice is kept, and for how long (seconds, 0 disables it).
+        namenode_cache= dict(required=False, default=NAMENODE_CACHE_DEFAULT_PATH, type='path'),
+        namenode_cache_ttl= dict(required=False, default=3600, type='int'),
+        # Forward the requests to the ahdp agent listening on agent_socket (~/.ahdp/agent.sock by default), started
+        # in the background if none is running.
+        agent= dict(required=False, default=False, type='bool'),
+        agent_socket= dict(required=False, default=None, type='path'),
     )
 
 def hdfs_required_together():
@@ -139,51 +785,550 @@ def hdfs_required_if():
 def hdfs_invalid_if():
     return [ ('verify', False, ['truststore']),('authentication', 'none', ['principal','password','keytab','token']),('authentication', 'token', ['principal','password','keytab','user']),('authentication', 'kerberos', ['token','user'])  ]
 
-def kinit(principal,password=None,keytab=None):
+def kinit(principal,password=None,keytab=None,ccache=None,lifetime=None,renew=False):
     kinit = '/usr/bin/kinit'
+    kinit_args = [ kinit ]
+    if ccache is not None:
+        kinit_args.extend([ '-c', '%s' % ccache ])
+    if lifetime is not None:
+        kinit_args.extend([ '-l', '%s' % lifetime ])
+    stdin = None
+    if renew:
+        kinit_args.append('-R')
+    elif password is not None:
+        stdin = '%s\n' % _utf8(password)
+    elif keytab is not None:
+        kinit_args.extend([ '-kt' , '%s' % keytab ])
+    else:
+        raise ValueError("Kerberos authentication need either a password or a keytab.")
+    kinit_args.append('%s' % principal)
+
+    kinit = Popen(kinit_args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    out, err = kinit.communicate(stdin)
+    if kinit.returncode != 0:
+        raise Exception("kinit failed: %s" % (err or out).strip())
+
+def _lifetime_seconds(lifetime):
+    ''' convert a kinit lifetime (ex: 10h) to seconds, None if not set or not in that simple form '''
+    m = re.match(r'^(\d+)([smhd]?)$', str(lifetime).strip()) if lifetime is not None else None
+    if m:
+        return int(m.group(1)) * { '': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400 }[m.group(2)]
+    return None
+
+def gss_kinit(principal, ccache, password=None, keytab=None, lifetime=None):
+    ''' Request a TGT in-process through gssapi and store it in the ccache, no kinit process is spawned. '''
+    name = gssapi.Name(principal, gssapi.NameType.kerberos_principal)
     if password is not None:
-        kinit_args = [ kinit, '%s' % principal ]
-        try:
-            kinit = Popen(kinit_args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            kinit.stdin.write('%s\n' % password)
-            kinit.wait()
-        except Exception, e:
-            raise e
+        creds = gssapi.raw.acquire_cred_with_password(name, _utf8(password), lifetime=_lifetime_seconds(lifetime), usage='initiate').creds
     elif keytab is not None:
-        kinit_args = [ kinit, '-kt' , '%s' % keytab,'%s' % principal ]
-        try:
-            kinit = Popen(kinit_args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            kinit.wait()
-        except Exception, e:
-            raise e
+        creds = gssapi.raw.acquire_cred_from({ 'client_keytab': keytab, 'ccache': ccache }, name,
+                                             lifetime=_lifetime_seconds(lifetime), usage='initiate').creds
     else:
         raise ValueError("Kerberos authentication need either a password or a keytab.")
+    gssapi.raw.store_cred_into({ 'ccache': ccache }, creds, usage='initiate', overwrite=True)
 
-def kdestroy():
+def kerberos_authenticate(principal, ccache, password=None, keytab=None, lifetime=None):
+    ''' Get a TGT in the ccache, in-process when gssapi is available, with kinit otherwise. '''
+    if load_gssapi():
+        try:
+            return gss_kinit(principal, ccache, password=password, keytab=keytab, lifetime=lifetime)
+        except Exception:
+            # a memory cache can not be filled by kinit
+            if ccache.startswith('MEMORY:'):
+                raise
+    kinit(principal, password, keytab, ccache=ccache, lifetime=lifetime)
+
+#################################################################################################################
+# The kerberos credentials are kept between the module invocations in a cache directory, one credential cache per
+# principal and credentials fingerprint, so the tasks of a playbook reuse the same TGT instead of running kinit
+# (one AS-REQ to the KDC) and kdestroy every time. The TGT is renewed before it expires, or requested again once it
+# can not be renewed anymore, under a lock so the concurrent invocations do not all kinit at once.
+#################################################################################################################
+
+CCACHE_DEFAULT_DIR = '~/.ahdp/ccache'
+# random key of the credential fingerprints naming the caches of a cache directory
+CCACHE_KEY_FILE = '.fingerprint_key'
+# the TGT is renewed when it expires in less than this number of seconds
+CCACHE_RENEW_BEFORE = 600
+
+def _utf8(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+def _ccache_counted(data, offset):
+    length, = struct.unpack_from('>I', data, offset)
+    return data[offset + 4:offset + 4 + length], offset + 4 + length
+
+def _ccache_principal(data, offset):
+    _, count = struct.unpack_from('>II', data, offset)
+    realm, offset = _ccache_counted(data, offset + 8)
+    components = []
+    for i in range(count):
+        component, offset = _ccache_counted(data, offset)
+        components.append(component)
+    return realm, components, offset
+
+def ccache_tgt_times(path):
+    ''' Return the (principal, endtime, renew_till) of the TGT held by a FILE credential cache (format 3 and 4,
+        the ones written by MIT kinit), None if there is no TGT or the cache can not be read. This avoids
+        spawning klist to check a cache. '''
     try:
-        kdestroy = '/usr/bin/kdestroy'
-        kdestroy_args = [ kdestroy, '-q', '-A' ]
-        kdestroy = Popen(kdestroy_args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        kdestroy.wait()
-    except Exception, e:
-        raise e
+        with open(path, 'rb') as f:
+            data = f.read()
+        version, = struct.unpack_from('>H', data, 0)
+        offset = 2
+        if version == 0x0504:
+            header_length, = struct.unpack_from('>H', data, offset)
+            offset += 2 + header_length
+        elif version != 0x0503:
+            return None
+        realm, components, offset = _ccache_principal(data, offset)
+        principal = '%s@%s' % ('/'.join(components), realm)
+        while offset < len(data):
+            # client, server, keyblock and times of a credential
+            _, _, offset = _ccache_principal(data, offset)
+            server_realm, server, offset = _ccache_principal(data, offset)
+            offset += 4 if version == 0x0503 else 2
+            _, offset = _ccache_counted(data, offset)
+            _, _, endtime, renew_till = struct.unpack_from('>IIII', data, offset)
+            offset += 16 + 1 + 4
+            # addresses and authorization data
+            for i in range(2):
+                count, = struct.unpack_from('>I', data, offset)
+                offset += 4
+                for j in range(count):
+                    _, offset = _ccache_counted(data, offset + 2)
+            # ticket and second ticket
+            _, offset = _ccache_counted(data, offset)
+            _, offset = _ccache_counted(data, offset)
+            if server == [ 'krbtgt', realm ] and server_realm == realm:
+                return principal, endtime, renew_till
+    except (IOError, OSError, struct.error):
+        pass
+    return None
+
+class KerberosCredentialCache(object):
+    ''' A credential cache of cache_dir shared by the invocations using the same principal and credentials.
+        acquire makes sure it holds a valid TGT and exports it as KRB5CCNAME for the clients. '''
+
+    def __init__(self, principal, password=None, keytab=None, cache_dir=None, lifetime=None, renew_before=CCACHE_RENEW_BEFORE):
+        if password is None and keytab is None:
+            raise ValueError("Kerberos authentication need either a password or a keytab.")
+        self.principal = principal
+        self.password = password
+        self.keytab = keytab
+        self.cache_dir = osp.expanduser(cache_dir or CCACHE_DEFAULT_DIR)
+        self.lifetime = lifetime
+        self.renew_before = renew_before
+        self.path = osp.join(self.cache_dir, 'krb5cc_%s' % self.fingerprint())
+        self.name = 'FILE:%s' % self.path
+
+    def _key(self):
+        ''' the random key of cache_dir, so the cache names can not be used to guess the passwords '''
+        if not osp.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        key_path = osp.join(self.cache_dir, CCACHE_KEY_FILE)
+        if not osp.exists(key_path):
+            # mkstemp creates the file readable only by its owner, linked in place unless a concurrent invocation did first
+            fd, tmp_path = tempfile.mkstemp(prefix=CCACHE_KEY_FILE + '.', dir=self.cache_dir)
+            try:
+                os.write(fd, os.urandom(32))
+                os.close(fd)
+                os.link(tmp_path, key_path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            finally:
+                os.remove(tmp_path)
+        with open(key_path, 'rb') as f:
+            return f.read()
+
+    def fingerprint(self):
+        ''' caches are keyed by principal and credentials, a new keytab or password gets a new cache '''
+        digest = hmac.new(self._key(), digestmod=AVAILABLE_HASH_ALGORITHMS['sha1'])
+        digest.update('%s\0' % _utf8(self.principal))
+        if self.keytab is not None:
+            with open(self.keytab, 'rb') as f:
+                digest.update('keytab\0%s\0%s' % (_utf8(osp.abspath(self.keytab)), f.read()))
+        else:
+            digest.update('password\0%s' % _utf8(self.password))
+        return digest.hexdigest()
+
+    def _principal_matches(self, principal):
+        if '@' in self.principal:
+            return principal == self.principal
+        return principal.split('@')[0] == self.principal
+
+    def valid(self, now=None):
+        ''' tell if the cache holds a TGT of the principal valid for more than renew_before seconds '''
+        times = ccache_tgt_times(self.path)
+        now = now if now is not None else time.time()
+        return times is not None and self._principal_matches(times[0]) and times[1] - now > self.renew_before
+
+    def acquire(self):
+        if not osp.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not self.valid():
+                    self._refresh()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        os.environ['KRB5CCNAME'] = self.name
+        return self.name
+
+    def _refresh(self):
+        # the TGT is renewed or requested in a new cache renamed in place, so the others never read a partial cache
+        fd, tmp_path = tempfile.mkstemp(prefix='.krb5cc_', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            if not self._renew(tmp_path):
+                kerberos_authenticate(self.principal, 'FILE:%s' % tmp_path, password=self.password, keytab=self.keytab, lifetime=self.lifetime)
+            os.rename(tmp_path, self.path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def _renew(self, tmp_path):
+        ''' renew the TGT of the cache into a copy at tmp_path, tell if it could be renewed '''
+        times = ccache_tgt_times(self.path)
+        now = time.time()
+        if times is None or not self._principal_matches(times[0]) or times[1] <= now or times[2] - now <= self.renew_before:
+            return False
+        try:
+            with open(self.path, 'rb') as src:
+                with open(tmp_path, 'wb') as dst:
+                    dst.write(src.read())
+            kinit(self.principal, ccache='FILE:%s' % tmp_path, renew=True)
+            return True
+        except Exception:
+            # not renewable, request a new TGT
+            return False
+
+    def release(self):
+        ''' the cache is kept for the next invocations '''
+        pass
+
+class PrivateCredentialCache(object):
+    ''' A credential cache used by a single invocation, in a private file (mode 0600) dropped on release. The default
+        cache is never used, so the concurrent invocations running on the same host do not overwrite nor destroy each
+        other credentials. It is a file even when the TGT is requested in-process with gssapi, a memory cache can not
+        be read by the processes the module runs (hdfs dfsadmin). '''
+
+    def __init__(self, principal, password=None, keytab=None, lifetime=None):
+        if password is None and keytab is None:
+            raise ValueError("Kerberos authentication need either a password or a keytab.")
+        self.principal = principal
+        self.password = password
+        self.keytab = keytab
+        self.lifetime = lifetime
+        fd, self.path = tempfile.mkstemp(prefix='krb5cc_ahdp_')
+        os.close(fd)
+        self.name = 'FILE:%s' % self.path
+
+    def acquire(self):
+        try:
+            kerberos_authenticate(self.principal, self.name, password=self.password, keytab=self.keytab, lifetime=self.lifetime)
+        except:
+            self.release()
+            raise
+        os.environ['KRB5CCNAME'] = self.name
+        return self.name
+
+    def release(self):
+        ''' drop the cache '''
+        if osp.exists(self.path):
+            os.remove(self.path)
+
+def kerberos_login(params):
+    ''' Get a TGT for the module credentials and return its credential cache, which is released once the module
+        is done. Unless ccache_reuse is off it is the cache shared by the invocations using the same credentials,
+        otherwise a cache private to this invocation. '''
+    if params.get('ccache_reuse', True):
+        ccache = KerberosCredentialCache(params['principal'], params['password'], params['keytab'],
+                                         cache_dir=params.get('ccache_dir'), lifetime=params.get('ccache_lifetime'))
+    else:
+        ccache = PrivateCredentialCache(params['principal'], params['password'], params['keytab'], lifetime=params.get('ccache_lifetime'))
+    ccache.acquire()
+    return ccache
+
+#################################################################################################################
+# With token_cache, a delegation token obtained once with kerberos is kept between the module invocations, so the
+# tasks of a principal authenticate their requests with the token instead of a SPNEGO negotiation (and a TGT). The
+# token is renewed before it expires, or requested again once it reached its maximum lifetime, under a lock so the
+# concurrent invocations do not all request a token.
+#################################################################################################################
+
+TOKEN_CACHE_DEFAULT_DIR = '~/.ahdp/tokens'
+# the delegation token is renewed when it expires in less than this number of seconds
+TOKEN_RENEW_BEFORE = 600
+
+class DelegationTokenCache(object):
+    ''' The delegation token of a principal for a nameservice, kept with its expiration time in a file of cache_dir
+        readable only by its owner. '''
+
+    def __init__(self, principal, urls, cache_dir=None, renew_before=TOKEN_RENEW_BEFORE):
+        self.principal = principal
+        self.cache_dir = osp.expanduser(cache_dir or TOKEN_CACHE_DEFAULT_DIR)
+        self.renew_before = renew_before
+        digest = AVAILABLE_HASH_ALGORITHMS['sha1']()
+        digest.update('%s\0%s' % (principal, ','.join(sorted(urls))))
+        self.path = osp.join(self.cache_dir, 'token_%s' % digest.hexdigest())
+
+    def load(self):
+        ''' return the cached (token, expiration in seconds since epoch), None if there is none '''
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+            return str(entry['token']), float(entry['expiration'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def store(self, token, expiration):
+        # mkstemp creates the file readable only by its owner, renamed in place so the others never read a partial file
+        fd, tmp_path = tempfile.mkstemp(prefix='.token_', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({ 'token': token, 'expiration': expiration }, f)
+            os.rename(tmp_path, self.path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def acquire(self, renew, create):
+        ''' Return a token valid for more than renew_before seconds. renew(token) returns the new expiration of the
+            cached token and create() a new (token, expiration), they are called only when needed. '''
+        if not osp.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entry = self.load()
+                now = time.time()
+                if entry is not None and entry[1] - now > self.renew_before:
+                    return entry[0]
+                if entry is not None and entry[1] > now:
+                    try:
+                        expiration = renew(entry[0])
+                        if expiration - now > self.renew_before:
+                            self.store(entry[0], expiration)
+                            return entry[0]
+                    except Exception:
+                        # the token reached its maximum lifetime or was canceled, request a new one
+                        pass
+                token, expiration = create()
+                self.store(token, expiration)
+                return token
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def hdfs_configure_session(session, pool_size=10, pool_hosts=100, keep_alive=True, preemptive=False):
+    ''' Size the connection pools of a client session. All the threads of a module share the client session, so it
+        keeps up to pool_size connections per host (the namenodes and the datanodes the reads and writes are redirected
+        to) for the pool_hosts most recently used hosts. Connections returned to a full pool are closed, so a pool smaller
+        than the number of threads reopens a connection (TCP, TLS and SPNEGO) for most requests. '''
+    adapter = requests.adapters.HTTPAdapter(max_retries=5, pool_connections=pool_hosts, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    # the namenode then sets the hadoop.auth cookie on the first response, the session sends it with the next requests
+    if preemptive and hasattr(session.auth, 'force_preemptive'):
+        session.auth.force_preemptive = True
+
+#################################################################################################################
+# The active namenode of each nameservice is remembered between invocations, so the clients send their first request
+# to it instead of probing the namenodes in the configured order, which costs a failed request (and a SPNEGO
+# handshake) every time the first namenode is the standby.
+#################################################################################################################
+
+NAMENODE_CACHE_DEFAULT_PATH = '~/.ahdp/namenodes.json'
+
+class ActiveNamenodeCache(object):
+    ''' On-disk cache of the last known active namenode of the nameservices, keyed by their namenodes urls.
+        The entries older than ttl seconds are ignored. The file is replaced atomically, concurrent invocations
+        may overwrite each other updates which only costs a failover probe. '''
+
+    def __init__(self, path, ttl=3600):
+        self.path = osp.expanduser(path)
+        self.ttl = ttl
+
+    def _key(self, urls):
+        return ','.join(sorted(urls))
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def order(self, urls, now=None):
+        ''' return urls with the cached active namenode first '''
+        entry = self._load().get(self._key(urls))
+        now = now if now is not None else time.time()
+        if entry is None or entry.get('url') not in urls or now - entry.get('time', 0) > self.ttl:
+            return list(urls)
+        return [ str(entry['url']) ] + [ url for url in urls if url != entry['url'] ]
+
+    def update(self, urls, active):
+        entries = self._load()
+        entries[self._key(urls)] = { 'url': active, 'time': int(time.time()) }
+        directory = osp.dirname(self.path)
+        try:
+            if not osp.isdir(directory):
+                os.makedirs(directory, 0700)
+            fd, tmp_path = tempfile.mkstemp(prefix='.namenodes.', dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            # the cache is only an optimization
+            pass
+
+class CachedHostsList(object):
+    ''' Wraps the namenodes list of a client to record the namenode switched to on failover in the ActiveNamenodeCache. '''
+
+    def __init__(self, host_list, cache):
+        self.host_list = host_list
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.host_list, name)
+
+    def switch_active_host(self, url, hdfs_path):
+        switched = self.host_list.switch_active_host(url, hdfs_path)
+        if switched:
+            hosts = self.resolve_hosts_from_path(hdfs_path)
+            self.cache.update(hosts, hosts[0])
+        return switched
+
+# Units accepted by hdfs dfsadmin for quotas, ex: 10g
+QUOTA_UNITS = { '': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4, 'p': 1024**5, 'e': 1024**6 }
+
+def parse_quota(quota):
+    ''' Return a quota as a number of names or bytes, -1 means no quota. '''
+    m = re.match(r'^\s*(-?\d+)\s*([kmgtpe]?)b?\s*$', str(quota).lower())
+    if not m:
+        raise ValueError("invalid quota value %r" % quota)
+    return int(m.group(1)) * QUOTA_UNITS[m.group(2)]
+
+class HdfsQuotaError(Exception):
+    pass
+
+class HdfsQuotaManager(object):
+    ''' Set name and space quotas on many directories at once.
+
+        Quotas are set with the webhdfs SETQUOTA and SETQUOTABYSTORAGETYPE operations when
+        the cluster supports them (Hadoop 3.3+, HDFS-8631). Otherwise the pending quotas are
+        grouped by value and each group is applied with a single hdfs dfsadmin invocation,
+        since dfsadmin accepts many directories, instead of starting one JVM per directory.
+    '''
+
+    # keep the dfsadmin command lines far from ARG_MAX
+    DFSADMIN_MAX_PATHS = 500
+
+    def __init__(self, client, dfsadmin='hdfs', use_webhdfs=True, login=None):
+        self.client = client
+        self.dfsadmin = dfsadmin
+        # called before running dfsadmin, which needs a TGT when the client uses a delegation token
+        self.login = login
+        # None until the first webhdfs call tells us if the operations are supported
+        self.webhdfs_supported = None if use_webhdfs else False
+        # (kind, quota, storage type) -> list of directories
+        self.pending = {}
+
+    def add(self, path, quota=None, spaceQuota=None, storage_type=None):
+        ''' Queue the quotas of a directory, None leaves a quota unchanged and -1 clears it. '''
+        if quota is not None:
+            self.pending.setdefault( ('name', parse_quota(quota), None), [] ).append(path)
+        if spaceQuota is not None:
+            self.pending.setdefault( ('space', parse_quota(spaceQuota), storage_type), [] ).append(path)
+
+    def flush(self):
+        ''' Apply all the queued quotas, raise HdfsQuotaError if any of them failed. '''
+        pending = self.pending
+        self.pending = {}
+
+        for (kind, quota, storage_type), paths in sorted(pending.items()):
+            if self.webhdfs_supported is not False:
+                paths = self._webhdfs_set_quotas(kind, quota, storage_type, paths)
+            if paths:
+                for i in range(0, len(paths), self.DFSADMIN_MAX_PATHS):
+                    self._dfsadmin_set_quotas(kind, quota, storage_type, paths[i:i + self.DFSADMIN_MAX_PATHS])
+
+    def _webhdfs_set_quotas(self, kind, quota, storage_type, paths):
+        ''' Set quotas through webhdfs, return the paths left to dfsadmin if the operation is not supported. '''
+        if kind == 'name':
+            params = { 'op': 'SETQUOTA', 'namespacequota': quota }
+        elif storage_type is None:
+            params = { 'op': 'SETQUOTA', 'storagespacequota': quota }
+        else:
+            params = { 'op': 'SETQUOTABYSTORAGETYPE', 'storagetype': storage_type, 'storagespacequota': quota }
+
+        for i, path in enumerate(paths):
+            try:
+                self.client._api_request(method='PUT', hdfs_path=path, params=params)
+                self.webhdfs_supported = True
+            except Exception, e:
+                if self.webhdfs_supported is None and self._is_unsupported_operation(e):
+                    self.webhdfs_supported = False
+                    return paths[i:]
+                raise HdfsQuotaError("%s quota %s failed on %s : %s" % (kind, quota, path, str(e)))
+        return []
+
+    def _is_unsupported_operation(self, e):
+        message = str(e)
+        return ( 'Invalid value for webhdfs parameter' in message or 'No enum constant' in message
+                 or 'Unsupported operation' in message or 'UnsupportedOperationException' in message )
+
+    def _dfsadmin_set_quotas(self, kind, quota, storage_type, paths):
+        if self.login is not None:
+            self.login()
+        args = [ self.dfsadmin, 'dfsadmin' ]
+        if kind == 'name':
+            args += [ '-clrQuota' ] if quota == -1 else [ '-setQuota', str(quota) ]
+        else:
+            args += [ '-clrSpaceQuota' ] if quota == -1 else [ '-setSpaceQuota', str(quota) ]
+            if storage_type is not None:
+                args += [ '-storageType', storage_type ]
+        args += [ self.client.resolvepath(path) for path in paths ]
+
+        try:
+            dfsadmin = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            out, err = dfsadmin.communicate()
+        except Exception, e:
+            raise HdfsQuotaError("could not run %s dfsadmin : %s" % (self.dfsadmin, str(e)))
+        # dfsadmin goes on with the other directories when one fails, and then exits with an error
+        if dfsadmin.returncode != 0:
+            raise HdfsQuotaError("%s failed : %s" % (' '.join(args[:4]), (err or out).strip()))
+
+# HDFSAnsibleModule instances by connection parameters, when they share their connections (see hdfs_share_connections)
+_shared_connections = None
+
+def hdfs_share_connections(enabled=True):
+    ''' Make the next HDFSAnsibleModule of this process reuse the client and credentials of the first one created
+        with the same connection parameters instead of authenticating and connecting again, for instance to run many
+        module operations in a single process. '''
+    global _shared_connections
+    _shared_connections = {} if enabled else None
 
 class HDFSAnsibleModule(object):
 
-    def __init__(self, module, bypass_checks=False,required_if=None,required_one_of_if=None,invalid_if=None):
+    def __init__(self, module, bypass_checks=False,required_if=None,required_one_of_if=None,invalid_if=None,use_token_cache=True,observer_reads=False):
         self.module = module
+        # only the modules changing nothing read from the observer namenodes, they may lag behind the active one
+        self.observer_reads = observer_reads
 
         self.file_cleanup_onfail = []
         self.file_restore_onfail = []
         self.local_file_cleanup_onfail = []
         self.local_file_restore_onfail = []
 
-        if not has_pywhdfs:
-            self.hdfs_fail_json(msg="python library pywhdfs required: pip install pywhdfs")
-
-        authentication = self.module.params.get('authentication')
-        if not has_kerberos_ext and authentication == 'kerberos':
-            self.hdfs_fail_json(msg="python library requests-kerberos required: pip install requests-kerberos")
+        self.quota_manager = None
+        self.ccache = None
+        self.token = None
+        self.use_token_cache = use_token_cache
 
         self.hdfs_required_if = hdfs_required_if()
         self.hdfs_required_one_of_if = hdfs_required_one_of_if()
@@ -203,27 +1348,78 @@ class HDFSAnsibleModule(object):
             _check_required_one_of_if(module,self.hdfs_required_one_of_if)
             _check_invalid_if(module,self.hdfs_invalid_if)
 
-        # Request a TGT if the authentication uses kerberos
-        if authentication == 'kerberos':
-            principal = module.params['principal']
-            password = module.params['password']
-            keytab = module.params['keytab']
+        ## Get the client, the one of a module with the same connection parameters if they are shared, or the
+        ## one kept by the ahdp agent if it is running
+        self.client = None
+        key = None
+        if _shared_connections is not None:
+            key = json.dumps(self.connection_params(), sort_keys=True)
+            shared = _shared_connections.get(key)
+            if shared is not None:
+                self.client = shared.client
+                self.token = shared.token
+        if self.client is None and module.params.get('agent'):
+            self.client = self.get_agent_client()
+        if self.client is None:
+            self.client = self.connect()
+        # the shared module keeps the credentials until the process exits
+        if key is not None and key not in _shared_connections:
+            _shared_connections[key] = self
+
+    def connection_params(self):
+        ''' the module parameters of hdfs_argument_spec, and observer_reads which gets a client of its own '''
+        spec = hdfs_argument_spec()
+        params = dict( (k, v) for k, v in self.module.params.items() if k in spec )
+        if self.observer_reads:
+            params['observer_reads'] = True
+        return params
+
+    def connect(self):
+        ''' authenticate and return a client of this process '''
+        if self.module.params.get('engine') == 'webhdfs':
+            if not load_requests():
+                self.hdfs_fail_json(msg="python library requests required: pip install requests")
+        elif not load_pywhdfs():
+            self.hdfs_fail_json(msg="python library pywhdfs required: pip install pywhdfs")
+
+        authentication = self.module.params.get('authentication')
+        if authentication == 'kerberos' and not load_kerberos_ext():
+            self.hdfs_fail_json(msg="python library requests-kerberos required: pip install requests-kerberos")
+
+        # Authenticate with the cached delegation token of the principal if token_cache is on
+        if authentication == 'kerberos' and self.use_token_cache and self.module.params.get('token_cache'):
             try:
-               kinit(principal, password, keytab)
+               self.token = self.get_cached_token()
+            except Exception, e:
+               self.hdfs_fail_json(msg="Could not get a delegation token: %s." % str(e))
+
+        # Otherwise request a TGT if the authentication uses kerberos, or reuse the cached one
+        if authentication == 'kerberos' and self.token is None:
+            try:
+               self.kerberos_login()
             except Exception, e:
                self.hdfs_fail_json(msg="Kerberos authentication failed: %s." % str(e))
 
-        ## Get the client
         try:
-          self.client = self.get_client()
+          return self.get_client()
         except Exception, e:
-          self.hdfs_fail_json(msg="Error instanciating pywhdfs client: %s." % str(e))
+          self.hdfs_fail_json(msg="Error instanciating %s client: %s." % (self.module.params.get('engine') or 'pywhdfs', str(e)))
+
+    def get_agent_client(self):
+        ''' Return a client forwarding the calls to the ahdp agent, None if the agent is not running. The calls the
+            agent does not run are sent by a client of this process, created when first needed. '''
+        from .agent import AGENT_CALL_TIMEOUT, AGENT_DEFAULT_SOCKET, AgentHDFSClient, connect_agent
+        params = self.connection_params()
+        connection = connect_agent(params['agent_socket'] or AGENT_DEFAULT_SOCKET, 'hdfs', params, timeout=AGENT_CALL_TIMEOUT, start=True)
+        if connection is None:
+            return None
+        # HdfsError is looked up when raised, pywhdfs may have been loaded since
+        return AgentHDFSClient(connection, local=self.connect, error=lambda message: HdfsError(message))
 
     def __del__(self):
-        authentication = self.module.params.get('authentication')
-    	if authentication == 'kerberos':
+    	if getattr(self, 'ccache', None) is not None:
             try:
-    	       kdestroy()
+    	       self.ccache.release()
             except Exception, e:
                self.hdfs_fail_json(msg="failed to clean kerberos TGT: %s." % str(e))
 
@@ -318,19 +1514,52 @@ class HDFSAnsibleModule(object):
           else:
             # no mount point provided so mount to /
             mounts = [ "/" ]
-          return { 'urls' : urls, 'mounts' : mounts }
+          # the observer namenodes serving the reads (engine webhdfs only)
+          if "observers" in nameservice:
+            if isinstance(nameservice["observers"], list):
+              observers = [ str(url).strip(' ').strip('"').strip('\'')  for url in nameservice["observers"] ]
+            else:
+              observers = [ str(url)  for url in re.split(r',|;', str(nameservice["observers"]).strip(' ').strip('"').strip('\'')) if url ]
+          else:
+            observers = []
+          return { 'urls' : urls, 'mounts' : mounts, 'observers' : observers }
                      
-    def get_client(self):
-        """Load HDFS client.
+    def kerberos_login(self):
+        ''' get a TGT for the module principal, once '''
+        if self.ccache is None:
+            self.ccache = kerberos_login(self.module.params)
+        return self.ccache
+
+    def get_cached_token(self):
+        ''' Return the delegation token of the principal from the token cache, requested or renewed with kerberos
+            when needed. The tokens are issued by the namenodes of a nameservice, None is returned when several
+            nameservices are configured and the module authenticates with kerberos. '''
+        nameservices = self.get_nameservices()
+        if len(nameservices) != 1:
+            return None
+        params = self.module.params
+        cache = DelegationTokenCache(params['principal'], nameservices[0]['urls'], cache_dir=params.get('token_cache_dir'))
+        # the token can only be renewed by its renewer, the principal short name
+        renewer = params['principal'].split('@')[0].split('/')[0]
+        clients = []
 
-        Further calls to this method for the same alias will return the same client
-        instance (in particular, any option changes to this alias will not be taken
-        into account).
+        def kerberos_client():
+            if not clients:
+                self.kerberos_login()
+                clients.append(self.get_client())
+            return clients[0]
 
-        """
-        params = self.module.params
-        options = {}
+        def renew(token):
+            return kerberos_client().renewDelegationToken(token=token) / 1000.0
+
+        def create():
+            token = kerberos_client().getDelegationToken(renewer=renewer)['urlString']
+            return token, renew(token)
+
+        return cache.acquire(renew, create)
 
+    def get_nameservices(self):
+        params = self.module.params
         try:
           #nameservices = json.loads(params.get('nameservices'))
           nameservices = ast.literal_eval(params.get('nameservices'))
@@ -340,10 +1569,23 @@ class HDFSAnsibleModule(object):
         # nameservices could be parsed, check its format now
         if not isinstance(nameservices, list):
           # one nameservice defined
-          options['nameservices'] = [ self._parse_nameservice_parameter(nameservices) ]
+          return [ self._parse_nameservice_parameter(nameservices) ]
         else:
           # provided a list of namespaces
-          options['nameservices'] = [ self._parse_nameservice_parameter(nameservice) for nameservice in nameservices ]
+          return [ self._parse_nameservice_parameter(nameservice) for nameservice in nameservices ]
+
+    def get_client(self):
+        """Load HDFS client.
+
+        Further calls to this method for the same alias will return the same client
+        instance (in particular, any option changes to this alias will not be taken
+        into account).
+
+        """
+        params = self.module.params
+        options = {}
+
+        options['nameservices'] = self.get_nameservices()
 
         options.update ({
             'root'          : params.get('root', None),
@@ -354,7 +1596,12 @@ class HDFSAnsibleModule(object):
             })
         authentication = params.get('authentication', 'none')
 
-        if (authentication == 'token'):
+        if self.token is not None:
+            options.update({
+            'auth_mechanism' : 'TOKEN',
+            'token'    : self.token,
+            })
+        elif (authentication == 'token'):
             options.update({
             'auth_mechanism' : 'TOKEN',
             'token'    : params.get('token'),
@@ -369,7 +1616,32 @@ class HDFSAnsibleModule(object):
             'user'     : params.get('user', None),
             })
 
-        return WebHDFSClient(**options) 
+        # try the last known active namenodes first
+        namenode_cache = None
+        if params.get('namenode_cache') and params.get('namenode_cache_ttl', 0) > 0:
+            namenode_cache = ActiveNamenodeCache(params['namenode_cache'], ttl=params['namenode_cache_ttl'])
+            for nameservice in options['nameservices']:
+                nameservice['urls'] = namenode_cache.order(nameservice['urls'])
+
+        if params.get('engine') == 'webhdfs':
+            from .webhdfs import WebHDFSEngine
+            client = WebHDFSEngine(concurrency=params.get('concurrency'), error=lambda message: HdfsError(message),
+                                   observer_reads=self.observer_reads, **options)
+        else:
+            client = WebHDFSClient(**options)
+
+        if namenode_cache is not None and getattr(client, 'host_list', None) is not None:
+            client.host_list = CachedHostsList(client.host_list, namenode_cache)
+
+        # the pools are sized for the concurrent operations sharing the client session
+        session = getattr(client, '_session', None)
+        if session is not None:
+            hdfs_configure_session(session,
+                                   pool_size=max(params.get('pool_size') or 10, params.get('concurrency') or 1),
+                                   pool_hosts=params.get('pool_hosts') or 100,
+                                   keep_alive=params.get('keep_alive', True),
+                                   preemptive=params.get('spnego_preemptive', False))
+        return client
 
     def get_authentication_type(self):
         return self.module.params.get('authentication')
@@ -378,19 +1650,17 @@ class HDFSAnsibleModule(object):
     #                                     Common files functions
     #################################################################################################################
 
-    def hdfs_set_attributes(self, path, owner=None, group=None, replication=None, quota=None, spaceQuota=None, permission=None):
+    def hdfs_set_attributes(self, path, owner=None, group=None, replication=None, quota=None, spaceQuota=None, permission=None, status=None, storage_type=None, batch_quotas=False):
 
         changed = False
 
-        # performance improvement: get status and content only once
+        # performance improvement: get status and content only once, the status
+        # can also be provided by the caller (ex: from a directory listing)
         ''' Find out current state '''
-        status = self.hdfs_status(path, strict=False)
-        content = self.hdfs_content(path, strict=False)
-        aclStatus = self.client.getAclStatus(path, strict=False)
+        if status is None:
+            status = self.hdfs_status(path, strict=False)
 
         curr_type = status['type']
-        curr_space_quota = content['spaceQuota']
-        curr_name_quota = content['quota']
         curr_replication = status['replication']
         curr_group = status['group']
         curr_owner = status['owner']
@@ -404,32 +1674,45 @@ class HDFSAnsibleModule(object):
             changed = self.hdfs_set_group(path, group)
             changed = True
 
-        changed |= self.hdfs_set_mode(path, permission)
+        changed |= self.hdfs_set_mode(path, permission, status=status)
 
         # only files can have a replication factor
         if curr_replication != replication and curr_type == 'FILE' and replication is not None:
             self.hdfs_set_replication(path, replication)
             changed = True
 
-        # only dirs can have a name quota
-        if curr_name_quota != quota and curr_type == 'DIRECTORY' and quota is not None:
-            self.hdfs_set_namequota(path, quota)
-            changed = True
-
-        # only dirs can have a name quota
-        if curr_space_quota != spaceQuota and curr_type == 'DIRECTORY' and spaceQuota is not None:
-            self.hdfs_set_spacequota(path, spaceQuota)
-            changed = True
+        # the content summary is only needed for quotas
+        if curr_type == 'DIRECTORY' and (quota is not None or spaceQuota is not None):
+            curr_name_quota, curr_space_quota = self.hdfs_get_quotas(path, storage_type=storage_type)
+            try:
+                # only dirs can have quotas
+                if quota is not None and parse_quota(quota) == curr_name_quota:
+                    quota = None
+                if spaceQuota is not None and parse_quota(spaceQuota) == curr_space_quota:
+                    spaceQuota = None
+            except ValueError, e:
+                self.hdfs_fail_json(path=path, msg="invalid quota: %s" % str(e))
+
+            if quota is not None or spaceQuota is not None:
+                if batch_quotas:
+                    # applied later in one go by flush_quotas
+                    self.get_quota_manager().add(path, quota=quota, spaceQuota=spaceQuota, storage_type=storage_type)
+                else:
+                    self.hdfs_set_quotas([path], quota=quota, spaceQuota=spaceQuota, storage_type=storage_type)
+                changed = True
 
         return changed
 
-    def hdfs_set_attributes_recursive(self, path, owner=None, group=None, replication=None, quota=None, spaceQuota=None, permission=None):
+    def hdfs_set_attributes_recursive(self, path, owner=None, group=None, replication=None, quota=None, spaceQuota=None, permission=None, storage_type=None):
         changed = False
-        for root, dirs, files in self.client.walk(path, depth=0, status=False):
-            for fsobj in dirs + files:
+        # the listing statuses are reused, so no extra status call is done per path
+        for (root, _), dirs, files in self.client.walk(path, depth=0, status=True):
+            for fsobj, status in dirs + files:
                 # still works in hdfs :)
-                path = os.path.join(root, fsobj)
-                changed |= self.hdfs_set_attributes(path=path, owner=owner, group=group, replication=replication, quota=quota, spaceQuota=spaceQuota, permission=permission)
+                fpath = os.path.join(root, fsobj)
+                changed |= self.hdfs_set_attributes(path=fpath, owner=owner, group=group, replication=replication, quota=quota, spaceQuota=spaceQuota, permission=permission, status=status, storage_type=storage_type, batch_quotas=True)
+        # quotas of all the sub directories are set at once
+        self.hdfs_flush_quotas()
         return changed
 
     def hdfs_resolvepath(self, hdfs_path):
@@ -604,172 +1887,79 @@ class HDFSAnsibleModule(object):
         return True
 
     #####################################################################################
-    # Infortunately right now there is no way to Set Quotas in webHDFS
-    # Check https://hadoop.apache.org/docs/r1.0.4/webhdfs.html for the full API specs
-    # This is beeing adressed in https://issues.apache.org/jira/browse/HDFS-6192
-    # Right now the only solution is to use shell to set Quotas until something better comes out.
+    # Quotas can be set in webHDFS only since Hadoop 3.3 (https://issues.apache.org/jira/browse/HDFS-8631)
+    # Check https://hadoop.apache.org/docs/current/hadoop-project-dist/hadoop-hdfs/WebHDFS.html for the full API specs
+    # On older clusters the HdfsQuotaManager falls back to hdfs dfsadmin, batching directories
+    # so that a single JVM is started for all the directories sharing the same quota.
     #####################################################################################
 
-    def hdfs_set_namequota(self, path, quota):
-
-        if quota is None:
+    def get_quota_manager(self):
+        if self.quota_manager is None:
+            self.quota_manager = HdfsQuotaManager(self.client, login=self.kerberos_login if self.token is not None else None)
+        return self.quota_manager
+
+    def hdfs_get_quotas(self, path, storage_type=None, content=None):
+        ''' Return the current (name quota, space quota) of a directory. '''
+        if content is None:
+            content = self.hdfs_content(path, strict=False)
+        if storage_type is None:
+            return content['quota'], content['spaceQuota']
+        type_quota = content.get('typeQuota', {}).get(storage_type.upper(), {})
+        return content['quota'], type_quota.get('quota', -1)
+
+    def hdfs_set_quotas(self, paths, quota=None, spaceQuota=None, storage_type=None):
+        ''' Set the same quotas on a list of directories in one batch, -1 clears a quota. '''
+        if quota is None and spaceQuota is None:
             return False
-        if quota == "-1" :
-            try:
-                call("hdfs dfsadmin -clrQuota %s" % path, shell=True)
-            except Exception, e:
-                self.hdfs_fail_json(path=path, msg="clear name quota failed, maybe check that directory exist and is not a file and didn\'t already exceed the new quota : %s" % str(e))
-        else:
-            try:
-                # I don't know why this seems to work only this way
-                call("hdfs dfsadmin -setQuota %s %s" % (quota, path), shell=True)
-            except Exception, e:
-                self.hdfs_fail_json(path=path, msg="set name quota failed, maybe check that directory exist and is not a file and didn\'t already exceed the new quota : %s" % str(e))
+
+        manager = self.get_quota_manager()
+        try:
+            for path in paths:
+                manager.add(path, quota=quota, spaceQuota=spaceQuota, storage_type=storage_type)
+            manager.flush()
+        except (HdfsQuotaError, ValueError), e:
+            self.hdfs_fail_json(msg="set quota failed, maybe check that directories exist and are not files and didn\'t already exceed the new quota : %s" % str(e))
         return True
 
-    def hdfs_set_spacequota(self, path, quota):
+    def hdfs_flush_quotas(self):
+        ''' Apply the quotas queued by hdfs_set_attributes(batch_quotas=True). '''
+        if self.quota_manager is None:
+            return
+        try:
+            self.quota_manager.flush()
+        except HdfsQuotaError, e:
+            self.hdfs_fail_json(msg="set quota failed, maybe check that directories exist and are not files and didn\'t already exceed the new quota : %s" % str(e))
 
-        if quota is None:
-            return False
+    def hdfs_set_namequota(self, path, quota):
+        return self.hdfs_set_quotas([path], quota=quota)
 
-        if quota == "-1" :
-            try:
-                call("hdfs dfsadmin -clrSpaceQuota %s" % path, shell=True)
-            except Exception, e:
-                self.hdfs_fail_json(path=path, msg="set space quota failed, maybe check that directory exist and is not a file and didn\'t already exceed the new quota : %s" % str(e))
-        else:
-            try:
-                call("hdfs dfsadmin -setSpaceQuota %s %s" % (quota, path), shell=True)
-            except Exception, e:
-                self.hdfs_fail_json(path=path, msg="set space quota failed, maybe check that directory exist and is not a file and didn\'t already exceed the new quota : %s" % str(e))
-        return True
+    def hdfs_set_spacequota(self, path, quota, storage_type=None):
+        return self.hdfs_set_quotas([path], spaceQuota=quota, storage_type=storage_type)
 
     #################################################################################################################
     #                                     Permissions functions
     #################################################################################################################
 
-    def get_norm_permissions(self, path):
-
-        status = self.hdfs_status(path, strict=False)
-        aclStatus = self.client.getAclStatus(path, strict=False)
-
-        permission = status['permission']
-        stickybyte = aclStatus['stickyBit']
-
-        if len(str(permission)) == 3:
-            if stickybyte == True:
-                permission = "1" + permission
-            else:
-                permission = "0" + permission
-
-        return int(permission,8)
-
-    def _symbolic_mode_to_octal(self, path, symbolic_mode):
-        new_mode = self.get_norm_permissions(path)
-        mode_re = re.compile(r'^(?P<users>[ugoa]+)(?P<operator>[-+=])(?P<perms>[rwxXst-]*|[ugo])$')
-
-        for mode in symbolic_mode.split(','):
-            match = mode_re.match(mode)
-            if match:
-                users = match.group('users')
-                operator = match.group('operator')
-                perms = match.group('perms')
-
-                if users == 'a':
-                    users = 'ugo'
-
-                for user in users:
-                    mode_to_apply = self._get_octal_mode_from_symbolic_perms(path, user, perms)
-                    new_mode = self._apply_operation_to_mode(user, operator, mode_to_apply, new_mode)
-            else:
-                raise ValueError("bad symbolic permission for mode: %s" % mode)
-        return new_mode
-
-    def _apply_operation_to_mode(self, user, operator, mode_to_apply, current_mode):
-        if operator  ==  '=':
-            if user == 'u': mask = stat.S_IRWXU | stat.S_ISUID
-            elif user == 'g': mask = stat.S_IRWXG | stat.S_ISGID
-            elif user == 'o': mask = stat.S_IRWXO | stat.S_ISVTX
-
-            # mask out u, g, or o permissions from current_mode and apply new permissions
-            inverse_mask = mask ^ PERM_BITS
-            new_mode = (current_mode & inverse_mask) | mode_to_apply
-        elif operator == '+':
-            new_mode = current_mode | mode_to_apply
-        elif operator == '-':
-            new_mode = current_mode - (current_mode & mode_to_apply)
-        return new_mode
-
-    def _get_octal_mode_from_symbolic_perms(self, path, user, perms):
-        prev_mode = self.get_norm_permissions(path)
-
-        is_directory = self.hdfs_is_dir(path)
-        has_x_permissions = (prev_mode & EXEC_PERM_BITS) > 0
-        apply_X_permission = is_directory or has_x_permissions
-
-        # Permission bits constants documented at:
-        # http://docs.python.org/2/library/stat.html#stat.S_ISUID
-        if apply_X_permission:
-            X_perms = {
-                'u': {'X': stat.S_IXUSR},
-                'g': {'X': stat.S_IXGRP},
-                'o': {'X': stat.S_IXOTH}
-            }
-        else:
-            X_perms = {
-                'u': {'X': 0},
-                'g': {'X': 0},
-                'o': {'X': 0}
-            }
-
-        user_perms_to_modes = {
-            'u': {
-                'r': stat.S_IRUSR,
-                'w': stat.S_IWUSR,
-                'x': stat.S_IXUSR,
-                's': stat.S_ISUID,
-                't': 0,
-                'u': prev_mode & stat.S_IRWXU,
-                'g': (prev_mode & stat.S_IRWXG) << 3,
-                'o': (prev_mode & stat.S_IRWXO) << 6 },
-            'g': {
-                'r': stat.S_IRGRP,
-                'w': stat.S_IWGRP,
-                'x': stat.S_IXGRP,
-                's': stat.S_ISGID,
-                't': 0,
-                'u': (prev_mode & stat.S_IRWXU) >> 3,
-                'g': prev_mode & stat.S_IRWXG,
-                'o': (prev_mode & stat.S_IRWXO) << 3 },
-            'o': {
-                'r': stat.S_IROTH,
-                'w': stat.S_IWOTH,
-                'x': stat.S_IXOTH,
-                's': 0,
-                't': stat.S_ISVTX,
-                'u': (prev_mode & stat.S_IRWXU) >> 6,
-                'g': (prev_mode & stat.S_IRWXG) >> 3,
-                'o': prev_mode & stat.S_IRWXO }
-        }
-
-        # Insert X_perms into user_perms_to_modes
-        for key, value in X_perms.items():
-            user_perms_to_modes[key].update(value)
-
-        or_reduce = lambda mode, perm: mode | user_perms_to_modes[user][perm]
-        return reduce(or_reduce, perms, 0)
+    def _symbolic_mode_to_octal(self, path, symbolic_mode, status=None):
+        if status is None:
+            status = self.hdfs_status(path, strict=False)
+        symbolic = compile_symbolic_mode(symbolic_mode)
+        return symbolic(hdfs_status_mode(status), status['type'] == 'DIRECTORY')
 
-    def hdfs_set_mode(self, path, mode):
+    def hdfs_set_mode(self, path, mode, status=None):
 
         if mode is None:
             return False
 
+        if status is None:
+            status = self.hdfs_status(path, strict=False)
+
         if not isinstance(mode, int):
             try:
                 mode = int(mode, 8)
             except Exception:
                 try:
-                    mode = self._symbolic_mode_to_octal(path, mode)
+                    mode = self._symbolic_mode_to_octal(path, mode, status=status)
                 except Exception, e:
                     self.hdfs_fail_json(path=path,
                                    msg="mode must be in octal or symbolic form : %s " % mode,
@@ -779,7 +1969,7 @@ class HDFSAnsibleModule(object):
                     # prevent mode from having extra info orbeing invalid long number
                     self.hdfs_fail_json(path=path, msg="Invalid mode supplied, only permission info is allowed", details=mode)
 
-        curr_mode = self.get_norm_permissions(path)
+        curr_mode = hdfs_status_mode(status)
 
         if curr_mode != mode:
             try:
@@ -968,24 +2158,6 @@ class HDFSAnsibleModule(object):
                 self.hdfs_fail_json(msg='Invalid acl entry %r.' % entry, changed=False)
         return True
 
-    def compare_acl_entries(self, orig_entries, new_entries):
-        equal = True
-        for orig_ent in orig_entries:
-            if orig_ent not in new_entries:
-                return False
-        # invert the loop
-        for new_ent in new_entries:
-            if new_ent not in orig_entries:
-                return False
-        return True
-
-    def check_acl_entries_exist(self, orig_entries, new_entries):
-        for new_ent in new_entries:
-            if new_ent not in orig_entries:
-                return False
-        return True
-
-
     def hdfs_getacls(self, path, strict=False):
         entries = None
         try:
@@ -997,63 +2169,84 @@ class HDFSAnsibleModule(object):
             self.hdfs_fail_json(msg="unknown error, could not fetch file acls: %s" % str(e))
         return entries
 
-    def hdfs_remove_all_file_acl(self, path, strict=False):
-        changed = False
+    def _hdfs_acl_worker(self, path, status, operation, entries=None, verify=False):
+        ''' Bring the acls of a single path in line with the spec. This runs on the worker
+            threads, so errors are raised instead of reported with hdfs_fail_json. '''
+        if entries is not None and status['type'] == 'FILE':
+            # default acls only apply to directories
+            entries = [ entry for entry in entries if not entry.startswith('default:') ]
+            if not entries:
+                return False
 
-        status = self.hdfs_status(path=path,strict=False)
-        if status is None:
+        acl_status = self.client.getAclStatus(hdfs_path=path, strict=False)
+        if acl_status is None:
+            # removed since it was listed
             return False
 
-        try:
-            orig_entries = self.hdfs_getacls(path=path,strict=strict)
-            self.client.removeAcl(hdfs_path=path, strict=strict)
-            self.client.removeDefaultAcl(hdfs_path=path, strict=strict)
-            new_entries = self.hdfs_getacls(path=path,strict=strict)
-            if not self.compare_acl_entries(orig_entries=orig_entries, new_entries=new_entries):
-                changed = True
-        except HdfsError, e:
-            self.hdfs_fail_json(msg="hdfs error, could not remove file acls: %s" % str(e))
-        except Exception, e:
-            self.hdfs_fail_json(msg="unknown error, could not remove file acls: %s" % str(e))
-        return changed
-
-    def hdfs_remove_allacls(self, path, recursive=False, strict=False):
-        # Fail if file does not exist
-        status = self.hdfs_status(path=path,strict=strict)
-        if status is None:
+        # the resulting acl is computed locally, so nothing is sent if it does not change
+        # and it does not need to be read back after the mutation
+        current = HdfsAcl.from_status(status, acl_status)
+        expected = current.apply(operation, entries)
+        if expected == current:
             return False
 
-        changed = False
-        changed |= self.hdfs_remove_all_file_acl(path=path, strict=False)
-        if recursive:
-            if status['type'] == 'DIRECTORY':
-                for root, dirs, files in self.client.walk(path, depth=0, status=False):
-                    for f in files + dirs:
-                        fpath = os.path.join(root, f)
-                        changed |= self.hdfs_remove_all_file_acl(path=fpath, strict=False)
-        return changed
+        if operation == 'modify':
+            self.client.modifyAclEntries(hdfs_path=path, aclspec=','.join(entries))
+        elif operation == 'set':
+            self.client.setAcl(hdfs_path=path, aclspec=','.join(entries))
+        elif operation == 'remove':
+            self.client.removeAclEntries(hdfs_path=path, aclspec=','.join(entries))
+        else:
+            self.client.removeAcl(hdfs_path=path)
+            self.client.removeDefaultAcl(hdfs_path=path)
 
-    def hdfs_remove_file_acl(self, path, entries, strict=False):
-        changed = False
+        if verify:
+            new = HdfsAcl.from_status(self.client.status(path), self.client.getAclStatus(hdfs_path=path))
+            if new != expected:
+                raise HdfsError("acls of %s are %s instead of the expected %s", path, ','.join(new.to_list()), ','.join(expected.to_list()))
+        return True
 
-        status = self.hdfs_status(path=path,strict=False)
+    def hdfs_apply_acls(self, path, operation, entries=None, recursive=False, strict=False, verify=False, on_result=None):
+        ''' Apply an acl operation (modify, set, remove or remove_all) to a path and, if recursive, to
+            all the files and directories under it. The tree is listed once, every acl status is
+            fetched once and only the paths which acls differ from the spec are changed, the
+            fetch and mutation calls run on concurrency threads. With verify the acls are read
+            back after each change and checked against the expected ones. on_result is called with the
+            path and its changed flag of every path, from the calling thread. '''
+        status = self.hdfs_status(path=path, strict=strict)
         if status is None:
             return False
-             
+
+        def _paths():
+            yield path, status
+            if recursive and status['type'] == 'DIRECTORY':
+                for (root, _), dirs, files in self.client.walk(path, depth=0, status=True):
+                    for fsobj, fstatus in dirs + files:
+                        yield os.path.join(root, fsobj), fstatus
+
+        changed = False
         try:
-            orig_entries = self.hdfs_getacls(path=path,strict=strict)
-            raw_entries = ','.join(entries)
-            self.client.removeAclEntries(hdfs_path=path, aclspec=raw_entries, strict=strict)
-            new_entries = self.hdfs_getacls(path=path,strict=strict)
-            if not self.compare_acl_entries(orig_entries=orig_entries, new_entries=new_entries):
-                changed = True
+            for item, path_changed in hdfs_map(lambda item: self._hdfs_acl_worker(item[0], item[1], operation, entries, verify),
+                                               _paths(), self.module.params.get('concurrency')):
+                changed |= path_changed
+                if on_result is not None:
+                    on_result(item[0], path_changed)
         except HdfsError, e:
-            self.hdfs_fail_json(msg="hdfs error, could not remove file acls: %s" % str(e))
+            self.hdfs_fail_json(msg="hdfs error, could not %s file acls: %s" % (operation.replace('_', ' '), str(e)))
         except Exception, e:
-            self.hdfs_fail_json(msg="unknown error, could not remove file acls: %s" % str(e))
+            self.hdfs_fail_json(msg="unknown error, could not %s file acls: %s" % (operation.replace('_', ' '), str(e)))
         return changed
 
-    def hdfs_remove_acls(self, path, entries, recursive=False, strict=False):
+    def hdfs_remove_all_file_acl(self, path, strict=False):
+        return self.hdfs_apply_acls(path=path, operation='remove_all', strict=strict)
+
+    def hdfs_remove_allacls(self, path, recursive=False, strict=False, verify=False, on_result=None):
+        return self.hdfs_apply_acls(path=path, operation='remove_all', recursive=recursive, strict=strict, verify=verify, on_result=on_result)
+
+    def hdfs_remove_file_acl(self, path, entries, strict=False):
+        return self.hdfs_apply_acls(path=path, operation='remove', entries=entries, strict=strict)
+
+    def hdfs_remove_acls(self, path, entries, recursive=False, strict=False, verify=False, on_result=None):
         # Validate and normalize acl entries
         self.validate_acl_entries(entries=entries)
         for entry in entries:
@@ -1063,105 +2256,18 @@ class HDFSAnsibleModule(object):
             if ( entry_tab[0] != 'default' and entry_tab[2] != "" ) or ( entry_tab[0] == 'default' and entry_tab[3] != "" ):
                 self.hdfs_fail_json(msg="Invalid ACLs entry %r the permission need to be null in delete." % entry, changed=False)
 
-        # Fail if file does not exist
-        status = self.hdfs_status(path=path,strict=strict)
-        if status is None:
-            return False
-
-        changed = False
-
-        changed |= self.hdfs_remove_file_acl(path=path, entries=entries, strict=False)
-        if recursive:
-            if status['type'] == 'DIRECTORY':
-                for root, dirs, files in self.client.walk(path, depth=0, status=False):
-                    for f in files + dirs:
-                        fpath = os.path.join(root, f)
-                        changed |= self.hdfs_remove_file_acl(path=fpath, entries=entries, strict=False)
-        return changed
+        return self.hdfs_apply_acls(path=path, operation='remove', entries=entries, recursive=recursive, strict=strict, verify=verify, on_result=on_result)
 
     def hdfs_add_file_acl(self, path, entries, strict=False):
-        changed = False
-        
-        status = self.hdfs_status(path=path,strict=False)
-        if status is None:
-            return False
-        elif status['type'] == 'FILE':
-            proc_entries = []
-            for entry in entries:
-                entry_tab = entry.split(":")
-                if entry_tab[0] != 'default':
-                    proc_entries.append(entry)
-            entries = proc_entries
-        # if directory keep it as it is
-
-        try:
-            orig_entries = self.hdfs_getacls(path=path,strict=strict)
+        return self.hdfs_apply_acls(path=path, operation='modify', entries=entries, strict=strict)
 
-            raw_entries = ','.join(entries)
-            self.client.modifyAclEntries(hdfs_path=path, aclspec=raw_entries)
-
-            # It looks like the getacls does not print all acls, so we can really know if the acls
-            # we are going to put really change something or not. so the only way is to always run
-            # then perform the check, so that we know if something have changed or not.
-            new_entries = self.hdfs_getacls(path=path,strict=strict)
-            if not self.compare_acl_entries(orig_entries=orig_entries, new_entries=new_entries):
-                changed = True
-
-        except HdfsError, e:
-            self.hdfs_fail_json(msg="hdfs error, could not add file acls: %s" % str(e))
-        except Exception, e:
-            self.hdfs_fail_json(msg="unknown error, could not add file acls: %s" % str(e))
-        return changed
-
-    def hdfs_addacls(self, path, entries, recursive=False, strict=False):
-        
-        # Fail if file does not exist
-        status = self.hdfs_status(path=path,strict=strict)
-        if status is None:
-            return False
-
-        changed = False
-        changed |= self.hdfs_add_file_acl(path=path, entries=entries, strict=False)
-        if recursive:
-            if status['type'] == 'DIRECTORY':
-                for root, dirs, files in self.client.walk(path, depth=0, status=False):
-                    for f in files + dirs:
-                        fpath = os.path.join(root, f)
-                        changed |= self.hdfs_add_file_acl(path=fpath, entries=entries, strict=False)
-        return changed
+    def hdfs_addacls(self, path, entries, recursive=False, strict=False, verify=False, on_result=None):
+        return self.hdfs_apply_acls(path=path, operation='modify', entries=entries, recursive=recursive, strict=strict, verify=verify, on_result=on_result)
 
     def hdfs_set_file_acl(self, path, entries, strict=False):
-        changed = False
+        return self.hdfs_apply_acls(path=path, operation='set', entries=entries, strict=strict)
 
-        status = self.hdfs_status(path=path,strict=False)
-        if status is None:
-            return False
-        elif status['type'] == 'FILE':
-            proc_entries = []
-            for entry in entries:
-                entry_tab = entry.split(":")
-                if entry_tab[0] != 'default':
-                    proc_entries.append(entry)
-            entries = proc_entries
-        # if directory keep it as it is
-
-        try:
-            orig_entries = self.hdfs_getacls(path=path,strict=strict)
-
-            raw_entries = ','.join(entries)
-            self.client.setAcl(hdfs_path=path, aclspec=raw_entries)
-
-            new_entries = self.hdfs_getacls(path=path,strict=strict)
-            if not self.compare_acl_entries(orig_entries=orig_entries, new_entries=new_entries):
-                changed = True
-        
-        except HdfsError, e:
-            self.hdfs_fail_json(msg="hdfs error, could not set file acls: %s" % str(e))
-        except Exception, e:
-            self.hdfs_fail_json(msg="unknown error, could not set file acls: %s" % str(e))
-        return changed
-
-    def hdfs_setacls(self, path, entries, recursive=False, strict=False):
+    def hdfs_setacls(self, path, entries, recursive=False, strict=False, verify=False, on_result=None):
 
         # check that entries for user, group, and others are provided
         u_valid = False
@@ -1178,17 +2284,4 @@ class HDFSAnsibleModule(object):
         if not g_valid or not u_valid or not o_valid :
             self.hdfs_fail_json(msg="Invalid ACLs the user, group and other entries are required")
 
-        # Fail if file does not exist
-        status = self.hdfs_status(path=path,strict=strict)
-        if status is None:
-            return False
-
-        changed = False
-        changed |= self.hdfs_set_file_acl(path=path, entries=entries, strict=False)
-        if recursive:
-            if status['type'] == 'DIRECTORY':
-                for root, dirs, files in self.client.walk(path, depth=0, status=False):
-                    for f in files + dirs:
-                        fpath = os.path.join(root, f)
-                        changed |= self.hdfs_set_file_acl(path=fpath, entries=entries, strict=False)
-        return changed
+        return self.hdfs_apply_acls(path=path, operation='set', entries=entries, recursive=recursive, strict=strict, verify=verify, on_result=on_result)
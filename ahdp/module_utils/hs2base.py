@@ -7,14 +7,22 @@ import stat
 import json
 import os.path as osp
 import socket
-from impala._thrift_api import TTransportException
-from .hdfsbase import _check_required_if,_check_required_one_of_if,_check_invalid_if,kinit,kdestroy
+from .hdfsbase import _check_required_if,_check_required_one_of_if,_check_invalid_if,kerberos_login,CCACHE_DEFAULT_DIR
 
-try:
-    import impala.dbapi as hs2
-    has_lib_hs2 = True
-except ImportError:
-    has_lib_hs2 = False
+# impyla and thrift are imported when the first connection is opened, not when the module starts
+has_lib_hs2 = None
+
+def load_impyla():
+    global has_lib_hs2, hs2, TTransportException
+    if has_lib_hs2 is None:
+        try:
+            import impala.dbapi as hs2
+            from impala._thrift_api import TTransportException
+        except ImportError:
+            has_lib_hs2 = False
+        else:
+            has_lib_hs2 = True
+    return has_lib_hs2
 
 def hs2_argument_spec():
     return dict(
@@ -43,6 +51,15 @@ def hs2_argument_spec():
         truststore= dict(required=False,default=None, no_log=True),
         # Connection timeout in seconds. Default is no timeout.
         timeout= dict(required=False, default=None, type='float'),
+        # Reuse the kerberos TGT between invocations from a credential cache of ccache_dir, renewed before it expires.
+        ccache_reuse= dict(required=False, default=True, type='bool'),
+        ccache_dir= dict(required=False, default=CCACHE_DEFAULT_DIR, type='path'),
+        # Lifetime of the TGT requested, in the kinit -l format (ex: 10h).
+        ccache_lifetime= dict(required=False, default=None, type='str'),
+        # Run the queries on a connection kept by the ahdp agent listening on agent_socket (~/.ahdp/agent.sock by
+        # default), started in the background if none is running.
+        agent= dict(required=False, default=False, type='bool'),
+        agent_socket= dict(required=False, default=None, type='path'),
     )
 
 def hs2_required_together():
@@ -68,9 +85,6 @@ class HS2AnsibleModule(object):
     def __init__(self, module, bypass_checks=False,required_if=None,required_one_of_if=None,invalid_if=None):
         self.module = module
 
-        if not has_lib_hs2:
-            self.module.fail_json(msg="python library impyla required: pip install impyla")
-
         authentication = self.module.params.get('authentication')
 
         self.file_cleanup_onfail = []
@@ -78,6 +92,8 @@ class HS2AnsibleModule(object):
         self.local_file_cleanup_onfail = []
         self.local_file_restore_onfail = []
 
+        self.ccache = None
+
         self.hs2_required_if = hs2_required_if()
         self.hs2_required_one_of_if = hs2_required_one_of_if()
         self.hs2_invalid_if = hs2_invalid_if()
@@ -96,28 +112,38 @@ class HS2AnsibleModule(object):
             _check_required_one_of_if(module,self.hs2_required_one_of_if)
             _check_invalid_if(module,self.hs2_invalid_if)
 
-        # Request a TGT if the authentication uses kerberos
-        if authentication == 'GSSAPI':
-            principal = module.params['principal']
-            password = module.params['password']
-            keytab = module.params['keytab']
+        ## Use the connection kept by the ahdp agent if it is running
+        self.connnection = None
+        if module.params.get('agent'):
+            from .agent import AGENT_CALL_TIMEOUT, AGENT_DEFAULT_SOCKET, AgentHS2Connection, connect_agent
+            spec = hs2_argument_spec()
+            params = dict( (k, v) for k, v in module.params.items() if k in spec )
+            agent = connect_agent(params['agent_socket'] or AGENT_DEFAULT_SOCKET, 'hs2', params, timeout=AGENT_CALL_TIMEOUT, start=True)
+            if agent is not None:
+                self.connnection = AgentHS2Connection(agent)
+
+        if self.connnection is None and not load_impyla():
+            self.module.fail_json(msg="python library impyla required: pip install impyla")
+
+        # Request a TGT if the authentication uses kerberos, or reuse the cached one
+        if authentication == 'GSSAPI' and self.connnection is None:
             try:
-               kinit(principal, password, keytab)
+               self.ccache = kerberos_login(module.params)
             except Exception, e:
                self.hdfs_fail_json(msg="Kerberos authentication failed: %s." % str(e))
 
         ## Get the client
-        self.connnection = self.get_connnection()
+        if self.connnection is None:
+            self.connnection = self.get_connnection()
         ## Create a Cursor
         self.cursor = self.connnection.cursor()
 
     def __del__(self):
         self.cursor.close()
         self.connnection.close()
-        authentication = self.module.params.get('authentication')
-    	if authentication == 'GSSAPI':
+    	if getattr(self, 'ccache', None) is not None:
             try:
-    	       kdestroy()
+    	       self.ccache.release()
             except Exception, e:
                self.hdfs_fail_json(msg="failed to clean kerberos TGT: %s." % str(e))
 
@@ -331,7 +357,11 @@ class HS2AnsibleModule(object):
 
         query = ''.join(query_fragments)
 
-        # need to switch database before setting priveleges on Table
+        # need to switch database before setting priveleges on Table, in the same call with the agent connection
+        # shared with other invocations
+        if switch_database and hasattr(self.cursor, 'execute_in'):
+          self.cursor.execute_in(switch_database, query)
+          return True
         if switch_database:
           self.db_set(switch_database)
 
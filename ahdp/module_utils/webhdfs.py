@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+'''
+A webhdfs client built for the operations applied to many paths (recursive acls, hdfsfind actions, ...), selected
+with the engine module parameter. It implements the pywhdfs client methods the modules use, on the REST api directly,
+with the same authentications (simple, kerberos and delegation token), federation mounts and namenodes failover.
+
+The difference is how the requests are scheduled. pywhdfs walks a tree one LISTSTATUS at a time while the operations
+applied to the paths run on the module threads, so the listing bounds the throughput of the recursive operations.
+The engine lists the directories of a walk in parallel, and all the threads sharing it (walk listings and module
+workers) hold one of concurrency slots while their namenode request runs, so the namenode never gets more than
+concurrency requests of the module at a time however many pools are busy. The data transfers of OPEN and CREATE
+are redirected to the datanodes and do not take a slot.
+
+With observer_reads, the read only operations are sent to the observer namenodes of the nameservice when its spec
+declares some (hadoop 3 observer reads), in turn, so big sweeps do not load the rpc queue of the active namenode. It is
+only set by the modules which change nothing: the state a module reads to decide what to change must come from the
+active namenode, the changes of the previous tasks may not have reached the observers yet. The observers tail the
+edit log of the active namenode and may lag behind it, so the reads of the paths the client changed, of the paths
+under the deleted or renamed ones, of the parent directories listing them and the content summaries of their ancestors
+go to the active namenode (read your writes), and a read failing on an observer is sent again to the active namenode.
+'''
+
+import time
+import posixpath
+import threading
+from collections import deque
+from contextlib import contextmanager
+from getpass import getuser
+
+import requests
+
+WEBHDFS_PREFIX = '/webhdfs/v1'
+# transient errors retried on the same namenode, RETRY_DELAY seconds times the attempt apart
+RETRY_COUNT = 5
+RETRY_DELAY = 1
+RETRIABLE_EXCEPTIONS = ('RetriableException', 'RecoveryInProgressException', 'SafeModeException')
+# operations an observer namenode can run
+OBSERVER_OPERATIONS = frozenset([ 'GETFILESTATUS', 'LISTSTATUS', 'GETCONTENTSUMMARY', 'GETFILECHECKSUM', 'GETACLSTATUS',
+                                  'GETXATTRS', 'LISTXATTRS', 'OPEN' ])
+
+class WebHDFSError(Exception):
+    ''' Default error of the engine, the modules pass HdfsError instead. '''
+
+    def __init__(self, message, *args):
+        super(WebHDFSError, self).__init__(message % args if args else message)
+
+class NameserviceHosts(object):
+    ''' The namenodes urls of the nameservices, the first url of a nameservice is the one used, it is moved to the end
+        of the list when it fails. Same interface as the pywhdfs SyncHostsList, so the ActiveNamenodeCache can wrap it. '''
+
+    def __init__(self, nameservices):
+        self.nameservices = nameservices
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return repr(self.nameservices)
+
+    def resolve_nameservice_from_path(self, hdfs_path):
+        ''' the nameservice of the longest mount point containing hdfs_path '''
+        path = hdfs_path.rstrip('/') + '/'
+        best = None
+        for nameservice in self.nameservices:
+            for mount in nameservice['mounts']:
+                prefix = mount.rstrip('/') + '/'
+                if path.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+                    best = (prefix, nameservice)
+        if best is None:
+            raise WebHDFSError('Could not resolve any nameservice mount for hdfs path %s.', hdfs_path)
+        return best[1]
+
+    def resolve_hosts_from_path(self, hdfs_path):
+        return self.resolve_nameservice_from_path(hdfs_path)['urls']
+
+    def get_observer_host(self, hdfs_path):
+        ''' the next observer of the nameservice of hdfs_path, in turn, None if it has none left '''
+        with self.lock:
+            observers = self.resolve_nameservice_from_path(hdfs_path).get('observers')
+            if not observers:
+                return None
+            observers.append(observers.pop(0))
+            return observers[-1]
+
+    def drop_observer_host(self, url, hdfs_path):
+        ''' stop using an observer which failed '''
+        with self.lock:
+            observers = self.resolve_nameservice_from_path(hdfs_path).get('observers') or []
+            if url in observers:
+                observers.remove(url)
+
+    def get_active_host(self, hdfs_path):
+        with self.lock:
+            return self.resolve_hosts_from_path(hdfs_path)[0]
+
+    def get_host_count(self, hdfs_path):
+        return len(self.resolve_hosts_from_path(hdfs_path))
+
+    def switch_active_host(self, url, hdfs_path):
+        ''' move url to the end of its nameservice urls, return False if another thread already did '''
+        with self.lock:
+            hosts = self.resolve_hosts_from_path(hdfs_path)
+            if hosts[0] != url:
+                return False
+            hosts.append(hosts.pop(0))
+            return True
+
+class WebHDFSEngine(object):
+    ''' webhdfs client running up to concurrency namenode requests at a time, shared by the threads of a module.
+        The methods take the arguments of the pywhdfs client ones and raise error (a function of the message)
+        when a request fails. '''
+
+    def __init__(self, nameservices, auth_mechanism='NONE', user=None, token=None, proxy=None, root=None,
+                 timeout=None, verify=False, truststore=None, concurrency=10, error=None, session=None, observer_reads=False):
+        self.host_list = NameserviceHosts(nameservices)
+        self.root = root
+        self.proxy = proxy
+        self.concurrency = max(int(concurrency or 1), 1)
+        self.error = error or WebHDFSError
+        self._timeout = timeout
+        self._verify = truststore if verify and truststore is not None else verify
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self.observer_reads = observer_reads
+        # the paths changed by the client, the deleted or renamed ones, the parents of the changed paths and all their
+        # ancestors (which content summary changed), their reads are not sent to the observers
+        self._written = set()
+        self._written_trees = set()
+        self._written_parents = set()
+        self._written_ancestors = set()
+        self._written_lock = threading.Lock()
+
+        self._session = session or requests.Session()
+        # the authentication parameters are only sent to the namenodes, the datanodes urls they redirect to carry
+        # their own delegation token
+        self._auth_params = {}
+        if auth_mechanism == 'GSSAPI':
+            from requests_kerberos import HTTPKerberosAuth, DISABLED
+            self._session.auth = HTTPKerberosAuth(mutual_authentication=DISABLED)
+        elif auth_mechanism == 'TOKEN':
+            self._auth_params['delegation'] = token
+        else:
+            self._auth_params['user.name'] = user or getuser()
+        if proxy:
+            self._auth_params['doas'] = proxy
+
+    def __repr__(self):
+        return '<%s(nameservices=%r)>' % (self.__class__.__name__, self.host_list)
+
+    #################################################################################################################
+    #                                     Requests
+    #################################################################################################################
+
+    def _remote_exception(self, response):
+        try:
+            remote = response.json()['RemoteException']
+            return remote.get('exception', ''), remote.get('message', '')
+        except (ValueError, KeyError, TypeError):
+            return '', response.content
+
+    def _mark_written(self, hdfs_path, tree=False, creates=False):
+        ''' record a change of hdfs_path (of the tree under it with tree), creates if its missing ancestors may
+            have been created with it (MKDIRS, CREATE) and their parents listings changed too '''
+        with self._written_lock:
+            self._written.add(hdfs_path)
+            if tree:
+                self._written_trees.add(hdfs_path)
+            parent = posixpath.dirname(hdfs_path)
+            self._written_parents.add(parent)
+            while True:
+                self._written_ancestors.add(parent)
+                if creates:
+                    self._written_parents.add(parent)
+                if parent == '/':
+                    break
+                parent = posixpath.dirname(parent)
+
+    def _is_written(self, hdfs_path, operation):
+        ''' whether the client changed what operation reads on hdfs_path '''
+        # the listing of a directory has the statuses of its children, not its own
+        if hdfs_path in self._written_parents or (hdfs_path in self._written and operation != 'LISTSTATUS'):
+            return True
+        if operation == 'GETCONTENTSUMMARY' and hdfs_path in self._written_ancestors:
+            return True
+        path = hdfs_path
+        while self._written_trees:
+            if path in self._written_trees:
+                return True
+            if path == '/':
+                break
+            path = posixpath.dirname(path)
+        return False
+
+    def _observer_request(self, method, params, hdfs_path, rqargs):
+        ''' Send a read to an observer of the nameservice of hdfs_path, return None if there is none or it failed. '''
+        host = self.host_list.get_observer_host(hdfs_path)
+        if host is None:
+            return None
+        url = '%s%s%s' % (host.rstrip('/'), WEBHDFS_PREFIX, hdfs_path)
+        try:
+            with self._slots:
+                response = self._session.request(method=method, url=url, params=params, timeout=self._timeout,
+                                                 verify=self._verify, **rqargs)
+        except requests.exceptions.ConnectionError:
+            self.host_list.drop_observer_host(host, hdfs_path)
+            return None
+        except requests.exceptions.RequestException:
+            # timeouts of a lagging observer, ...
+            return None
+        if response.ok:
+            return response
+        exception, message = self._remote_exception(response)
+        if exception in ('StandbyException', 'ObserverRetryOnActiveException'):
+            # not an observer (anymore), or it does not serve webhdfs reads
+            self.host_list.drop_observer_host(host, hdfs_path)
+        # the active namenode has the last word on the errors, the observer may be behind
+        return None
+
+    def _api_request(self, method, params, hdfs_path, data=None, strict=True, **rqargs):
+        ''' Send a request to the namenode of hdfs_path, switch to the next namenode of the nameservice on standby
+            and connection errors. With observer_reads, the reads go to an observer if the nameservice has one and
+            hdfs_path was not changed by the client. Return the response, or None if it failed and strict is False. '''
+        hdfs_path = self.resolvepath(hdfs_path)
+        params = dict( (k, v) for k, v in params.items() if v is not None )
+        params.update(self._auth_params)
+        if method == 'GET':
+            if self.observer_reads and params.get('op') in OBSERVER_OPERATIONS and not self._is_written(hdfs_path, params['op']):
+                response = self._observer_request(method, params, hdfs_path, rqargs)
+                if response is not None:
+                    return response
+        elif params.get('op') not in ('RENEWDELEGATIONTOKEN', 'CANCELDELEGATIONTOKEN'):
+            # a delete or a rename changes the whole tree under the path
+            tree = params.get('op') in ('DELETE', 'RENAME')
+            self._mark_written(hdfs_path, tree, creates=params.get('op') in ('MKDIRS', 'CREATE'))
+            if 'destination' in params:
+                self._mark_written(posixpath.normpath(params['destination']), tree)
+        failovers = 0
+        retries = 0
+        while True:
+            host = self.host_list.get_active_host(hdfs_path)
+            url = '%s%s%s' % (host.rstrip('/'), WEBHDFS_PREFIX, hdfs_path)
+            try:
+                with self._slots:
+                    response = self._session.request(method=method, url=url, params=params, data=data,
+                                                     timeout=self._timeout, verify=self._verify, **rqargs)
+            except requests.exceptions.ConnectionError, e:
+                exception, message = 'ConnectionError', str(e)
+            else:
+                if response.ok:
+                    return response
+                if response.status_code == 401:
+                    raise self.error('Authentication failure on %s, check your credentials.' % host)
+                exception, message = self._remote_exception(response)
+                if response.status_code in (408, 504):
+                    exception = 'RetriableException'
+
+            if exception in ('StandbyException', 'ConnectionError'):
+                self.host_list.switch_active_host(host, hdfs_path)
+                failovers += 1
+                if failovers >= self.host_list.get_host_count(hdfs_path):
+                    raise self.error('Could not find any active namenode for %s: %s' % (hdfs_path, message))
+            elif exception in RETRIABLE_EXCEPTIONS and retries < RETRY_COUNT:
+                retries += 1
+                time.sleep(RETRY_DELAY * retries)
+            elif strict:
+                raise self.error('%s %s %s failed: %s %s' % (method, params.get('op'), hdfs_path, exception, message))
+            else:
+                return None
+
+    def _redirected(self, method, params, hdfs_path, data=None, strict=True, **rqargs):
+        ''' Send a request redirected by the namenode to a datanode, out of the namenode slots. '''
+        response = self._api_request(method, params, hdfs_path, strict=strict, allow_redirects=False)
+        if response is None or 'location' not in response.headers:
+            return response
+        location = response.headers['location']
+        response = self._session.request(method=method, url=location, data=data, timeout=self._timeout,
+                                         verify=self._verify, **rqargs)
+        if not response.ok:
+            exception, message = self._remote_exception(response)
+            if not strict:
+                return None
+            raise self.error('%s %s %s failed: %s %s' % (method, params.get('op'), hdfs_path, exception, message))
+        return response
+
+    def resolvepath(self, hdfs_path):
+        ''' return the absolute, normalized path '''
+        path = hdfs_path
+        if not posixpath.isabs(path):
+            if not self.root or not posixpath.isabs(self.root):
+                home = self._api_request('GET', { 'op': 'GETHOMEDIRECTORY' }, '/').json()['Path']
+                self.root = posixpath.join(home, self.root) if self.root else home
+            path = posixpath.join(self.root, path)
+        return posixpath.normpath(path)
+
+    #################################################################################################################
+    #                                     Namespace operations
+    #################################################################################################################
+
+    def status(self, hdfs_path, strict=True):
+        res = self._api_request('GET', { 'op': 'GETFILESTATUS' }, hdfs_path, strict=strict)
+        return res.json()['FileStatus'] if res is not None else None
+
+    def content(self, hdfs_path, strict=True):
+        res = self._api_request('GET', { 'op': 'GETCONTENTSUMMARY' }, hdfs_path, strict=strict)
+        return res.json()['ContentSummary'] if res is not None else None
+
+    def checksum(self, hdfs_path):
+        return self._redirected('GET', { 'op': 'GETFILECHECKSUM' }, hdfs_path).json()['FileChecksum']
+
+    def list(self, hdfs_path, status=False):
+        hdfs_path = self.resolvepath(hdfs_path)
+        statuses = self._api_request('GET', { 'op': 'LISTSTATUS' }, hdfs_path).json()['FileStatuses']['FileStatus']
+        # a file lists itself with an empty suffix, httpfs names it instead: only then is it checked
+        if len(statuses) == 1 and statuses[0]['type'] == 'FILE' and (
+            not statuses[0]['pathSuffix'] or
+            (statuses[0]['pathSuffix'] == posixpath.basename(hdfs_path) and self.status(hdfs_path)['type'] == 'FILE')):
+            raise self.error('%s is not a directory.' % hdfs_path)
+        if status:
+            return [ (s['pathSuffix'], s) for s in statuses ]
+        return [ s['pathSuffix'] for s in statuses ]
+
+    def walk(self, hdfs_path, depth=0, status=False):
+        ''' Walk the tree under hdfs_path like the pywhdfs walk, yielding (path, dirs, files) tuples, or with status
+            ((path, status), [ (name, status) ], [ (name, status) ]). The directories are listed concurrency at a
+            time and yielded breadth first, as their listings complete in order. depth 0 means no limit. '''
+        hdfs_path = self.resolvepath(hdfs_path)
+        top = self.status(hdfs_path)
+        if top['type'] != 'DIRECTORY':
+            return
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.concurrency)
+        # the directories left to list, the listings are requested a window ahead of the one yielded
+        waiting = deque([ (hdfs_path, top, depth) ])
+        listing = deque()
+        try:
+            while waiting or listing:
+                while waiting and len(listing) < self.concurrency * 4:
+                    dir_path, dir_status, level = waiting.popleft()
+                    listing.append((dir_path, dir_status, level, pool.apply_async(self.list, (dir_path,), { 'status': True })))
+                dir_path, dir_status, level, result = listing.popleft()
+                infos = result.get()
+                dir_infos = [ info for info in infos if info[1]['type'] == 'DIRECTORY' ]
+                file_infos = [ info for info in infos if info[1]['type'] != 'DIRECTORY' ]
+                if level != 1:
+                    waiting.extend( (posixpath.join(dir_path, name), s, level - 1) for name, s in dir_infos )
+                if status:
+                    yield (dir_path, dir_status), dir_infos, file_infos
+                else:
+                    yield dir_path, [ name for name, _ in dir_infos ], [ name for name, _ in file_infos ]
+        finally:
+            pool.terminate()
+
+    def makedirs(self, hdfs_path, permission=None):
+        self._api_request('PUT', { 'op': 'MKDIRS', 'permission': permission }, hdfs_path)
+
+    def delete(self, hdfs_path, recursive=False):
+        return self._api_request('DELETE', { 'op': 'DELETE', 'recursive': 'true' if recursive else 'false' }, hdfs_path).json()['boolean']
+
+    def rename(self, hdfs_src_path, hdfs_dst_path):
+        hdfs_dst_path = self.resolvepath(hdfs_dst_path)
+        if not self._api_request('PUT', { 'op': 'RENAME', 'destination': hdfs_dst_path }, hdfs_src_path).json()['boolean']:
+            raise self.error('Unable to rename %s to %s.' % (self.resolvepath(hdfs_src_path), hdfs_dst_path))
+
+    def set_owner(self, hdfs_path, owner=None, group=None):
+        if not owner and not group:
+            raise ValueError('Must set at least one of owner or group.')
+        self._api_request('PUT', { 'op': 'SETOWNER', 'owner': owner, 'group': group }, hdfs_path)
+
+    def set_permission(self, hdfs_path, permission):
+        self._api_request('PUT', { 'op': 'SETPERMISSION', 'permission': permission }, hdfs_path)
+
+    def set_times(self, hdfs_path, access_time=None, modification_time=None):
+        if not access_time and not modification_time:
+            raise ValueError('At least one of time must be specified.')
+        self._api_request('PUT', { 'op': 'SETTIMES', 'accesstime': access_time, 'modificationtime': modification_time }, hdfs_path)
+
+    def set_replication(self, hdfs_path, replication):
+        if not self._api_request('PUT', { 'op': 'SETREPLICATION', 'replication': replication }, hdfs_path).json()['boolean']:
+            raise self.error('%s is not a file.' % hdfs_path)
+
+    #################################################################################################################
+    #                                     Acls and extended attributes
+    #################################################################################################################
+
+    def getAclStatus(self, hdfs_path, strict=True):
+        res = self._api_request('GET', { 'op': 'GETACLSTATUS' }, hdfs_path, strict=strict)
+        return res.json()['AclStatus'] if res is not None else None
+
+    def setAcl(self, hdfs_path, aclspec):
+        self._api_request('PUT', { 'op': 'SETACL', 'aclspec': aclspec }, hdfs_path)
+
+    def modifyAclEntries(self, hdfs_path, aclspec, strict=True):
+        self._api_request('PUT', { 'op': 'MODIFYACLENTRIES', 'aclspec': aclspec }, hdfs_path, strict=strict)
+
+    def removeAclEntries(self, hdfs_path, aclspec, strict=True):
+        self._api_request('PUT', { 'op': 'REMOVEACLENTRIES', 'aclspec': aclspec }, hdfs_path, strict=strict)
+
+    def removeAcl(self, hdfs_path, strict=True):
+        self._api_request('PUT', { 'op': 'REMOVEACL' }, hdfs_path, strict=strict)
+
+    def removeDefaultAcl(self, hdfs_path, strict=True):
+        self._api_request('PUT', { 'op': 'REMOVEDEFAULTACL' }, hdfs_path, strict=strict)
+
+    def getxattrs(self, hdfs_path, key=None, encoding='text', strict=True):
+        res = self._api_request('GET', { 'op': 'GETXATTRS', 'encoding': encoding, 'xattr.name': key }, hdfs_path, strict=strict)
+        if res is None:
+            return None
+        return dict( (xattr['name'], xattr['value']) for xattr in res.json()['XAttrs'] )
+
+    def listxattrs(self, hdfs_path, strict=True):
+        res = self._api_request('GET', { 'op': 'LISTXATTRS' }, hdfs_path, strict=strict)
+        return res.json()['XAttrNames'] if res is not None else None
+
+    def setxattr(self, hdfs_path, key, value, overwrite=True):
+        params = { 'op': 'SETXATTR', 'flag': 'CREATE', 'xattr.name': key, 'xattr.value': value }
+        try:
+            self._api_request('PUT', params, hdfs_path)
+        except Exception, e:
+            if not overwrite or 'already exists' not in str(e):
+                raise
+            params['flag'] = 'REPLACE'
+            self._api_request('PUT', params, hdfs_path)
+        return True
+
+    def removexattr(self, hdfs_path, key, strict=False):
+        return self._api_request('PUT', { 'op': 'REMOVEXATTR', 'xattr.name': key }, hdfs_path, strict=strict) is not None
+
+    #################################################################################################################
+    #                                     Snapshots and delegation tokens
+    #################################################################################################################
+
+    def create_snapshot(self, hdfs_path, snapshotname=None):
+        return self._api_request('PUT', { 'op': 'CREATESNAPSHOT', 'snapshotname': snapshotname }, hdfs_path).json()['Path']
+
+    def delete_snapshot(self, hdfs_path, snapshotname):
+        self._api_request('DELETE', { 'op': 'DELETESNAPSHOT', 'snapshotname': snapshotname }, hdfs_path)
+
+    def rename_snapshot(self, hdfs_path, oldsnapshotname, snapshotname):
+        self._api_request('PUT', { 'op': 'RENAMESNAPSHOT', 'oldsnapshotname': oldsnapshotname, 'snapshotname': snapshotname }, hdfs_path)
+
+    def getDelegationToken(self, renewer, service=None, kind=None):
+        return self._api_request('GET', { 'op': 'GETDELEGATIONTOKEN', 'renewer': renewer, 'service': service, 'kind': kind }, '/').json()['Token']
+
+    def renewDelegationToken(self, token):
+        return self._api_request('PUT', { 'op': 'RENEWDELEGATIONTOKEN', 'token': token }, '/').json()['long']
+
+    def cancelDelegationToken(self, token):
+        self._api_request('PUT', { 'op': 'CANCELDELEGATIONTOKEN', 'token': token }, '/')
+
+    #################################################################################################################
+    #                                     Data transfers
+    #################################################################################################################
+
+    @contextmanager
+    def read(self, hdfs_path, offset=0, length=None, buffer_size=None, chunk_size=None):
+        ''' Open a file, yield a file like object, or a generator of chunk_size chunks. '''
+        res = self._redirected('GET', { 'op': 'OPEN', 'offset': offset, 'length': length, 'buffersize': buffer_size },
+                               hdfs_path, stream=True)
+        try:
+            yield res.iter_content(chunk_size=chunk_size) if chunk_size else res.raw
+        finally:
+            res.close()
+
+    def write(self, hdfs_path, data, overwrite=False, permission=None, blocksize=None, replication=None,
+              buffersize=None, append=False):
+        ''' Create (or append to) a file with data, a string, a file object or a generator. '''
+        if append:
+            if overwrite:
+                raise ValueError('Cannot both overwrite and append.')
+            self._redirected('POST', { 'op': 'APPEND', 'buffersize': buffersize }, hdfs_path, data=data)
+        else:
+            self._redirected('PUT', { 'op': 'CREATE', 'overwrite': 'true' if overwrite else 'false', 'permission': permission,
+                                      'blocksize': blocksize, 'replication': replication, 'buffersize': buffersize },
+                             hdfs_path, data=data)
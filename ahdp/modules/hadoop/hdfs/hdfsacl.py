@@ -47,6 +47,19 @@ options:
     description:
       - If used acls will be completely replaced. Fully replaces ACL of files and directories, discarding all existing entries.
       - Note that default acls are not overwritten by the overwrite parameter, you can change default acls either delelting all acls or by using the scope default in acl entries with state absent or prensent to modify/delete individual default acls.
+  verify_changes:
+    required: false
+    default: no
+    choices: [ 'yes', 'no' ]
+    description:
+      - The acls resulting from a change are computed locally. If used, the acls of every changed path are also read back
+        and the module fails if they differ from the expected ones.
+  result_file:
+    required: false
+    default: null
+    description:
+      - Local file on the target where a newline delimited json record (path and changed) is written for every
+        path processed, the file is written while the paths are processed and only the counters are returned.
 notes:
     - The "acl" module requires that hdfs acls are enabled on your cluster using dfs.namenode.acls.enabled.
     - Note when using this module do not use the folded block scalar ">" after the module name like "hdfsacl >" because the list parameters will be interpreted as string argument.
@@ -103,6 +116,16 @@ EXAMPLES = '''
 '''
 
 RETURN = '''
+examined:
+    description: number of paths processed
+    returned: when result_file is used
+    type: int
+    sample: 10234
+changed_count:
+    description: number of paths which acls changed
+    returned: when result_file is used
+    type: int
+    sample: 12
 acls:
     description: Current acl on provided path (after changes, if any)
     returned: success
@@ -116,7 +139,7 @@ from ahdp.module_utils.hdfsbase import *
 from ansible.module_utils.basic import AnsibleModule
 
 def invalid_if():
-    return [ ('state', 'query', ['recursive','entries','overwrite']),('state', 'absent', ['overwrite']) ]
+    return [ ('state', 'query', ['recursive','entries','overwrite','verify_changes','result_file']),('state', 'absent', ['overwrite']) ]
 
 def hdfs_required_if():
     return [ ('state', 'present', ['entries'])  ]
@@ -136,6 +159,8 @@ def main():
             ),
             overwrite=dict(required=False, type='bool', default=False),
             recursive=dict(required=False, type='bool', default=False),
+            verify_changes=dict(required=False, type='bool', default=False),
+            result_file=dict(required=False, type='path', default=None),
         )
     )
 
@@ -159,6 +184,8 @@ def main():
     state        = params['state']
     overwrite    = params['overwrite']
     recursive    = params['recursive']
+    verify       = params['verify_changes']
+    result_file  = params['result_file']
 
     if entries is not None:
         hdfs.validate_acl_entries(entries=entries)
@@ -179,32 +206,49 @@ def main():
     # individual default acls.
 
     changed = False
+    counters = { 'examined': 0, 'changed_count': 0 }
+    spool = ResultSpool(result_file) if result_file is not None else None
 
-    if state == 'present':
-        # if state present all entries need to have permissions
-        for entry in entries:
-            if (entry[0] == 'default' and entry[3] == "") or (entry[0] != 'default' and entry[2] == ""):
-                 hdfs.hdfs_fail_json(msg='Invalid acl to be set %r null permission.' % entry, changed=False)
+    def on_result(path, path_changed):
+        counters['examined'] += 1
+        counters['changed_count'] += int(path_changed)
+        if spool is not None:
+            spool.write({ 'path': path, 'changed': path_changed })
 
-        if overwrite:
-            # will overwrite all existing acls
-            changed = hdfs.hdfs_setacls(path=hdfs_path, entries=entries, recursive=recursive, strict=False)
-        else:
-            # add acls
-            changed = hdfs.hdfs_addacls(path=hdfs_path, entries=entries, recursive=recursive, strict=False)
+    try:
+        if state == 'present':
+            # if state present all entries need to have permissions
+            for entry in entries:
+                if (entry[0] == 'default' and entry[3] == "") or (entry[0] != 'default' and entry[2] == ""):
+                     hdfs.hdfs_fail_json(msg='Invalid acl to be set %r null permission.' % entry, changed=False)
 
-    elif state == 'absent':
-        if entries is None:
-            # Remove all acls
-            changed = hdfs.hdfs_remove_allacls(path=hdfs_path, recursive=recursive, strict=False)
+            if overwrite:
+                # will overwrite all existing acls
+                changed = hdfs.hdfs_setacls(path=hdfs_path, entries=entries, recursive=recursive, strict=False, verify=verify, on_result=on_result)
+            else:
+                # add acls
+                changed = hdfs.hdfs_addacls(path=hdfs_path, entries=entries, recursive=recursive, strict=False, verify=verify, on_result=on_result)
+
+        elif state == 'absent':
+            if entries is None:
+                # Remove all acls
+                changed = hdfs.hdfs_remove_allacls(path=hdfs_path, recursive=recursive, strict=False, verify=verify, on_result=on_result)
+            else:
+                # Remove specified entries
+                changed = hdfs.hdfs_remove_acls(path=hdfs_path, entries=entries, recursive=recursive, strict=False, verify=verify, on_result=on_result)
+        elif state == 'query':
+            # Nothing to do
+            changed = False
         else:
-            # Remove specified entries
-            changed = hdfs.hdfs_remove_acls(path=hdfs_path, entries=entries, recursive=recursive, strict=False)
-    elif state == 'query':
-        # Nothing to do
-        changed = False
-    else:
-        hdfs.hdfs_fail_json(changed=False, msg='unexpected position reached')
+            hdfs.hdfs_fail_json(changed=False, msg='unexpected position reached')
+    except:
+        if spool is not None:
+            spool.abort()
+        raise
+
+    if spool is not None:
+        spool.close()
+        module.exit_json(changed=changed, path=hdfs_path, result_file=spool.path, **counters)
 
     acls = hdfs.hdfs_getacls(path=hdfs_path,strict=False)
     module.exit_json(changed=changed, path=hdfs_path, acls=acls)
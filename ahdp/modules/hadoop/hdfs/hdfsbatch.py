@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## (c) 2016, Yassine Azzouz <yassine.azzouz@gmail.com>
+
+DOCUMENTATION = '''
+---
+module: hdfsbatch
+short_description: Runs many hdfs module operations in a single invocation
+extends_documentation_fragment: hdfs
+description:
+     - Runs a list of operations of the other hdfs modules (hdfsfile, hdfsacl, hdfsxattr, ...) one after the other
+       in a single process sharing the same client and kerberos credentials, instead of transferring and starting
+       a module, authenticating and connecting for every task.
+     - Every operation takes the parameters of its module. The connection parameters given to hdfsbatch are used
+       by the operations which do not set them.
+     - The hdfsbatch action plugin (ahdp/plugins/action) checks the operations on the ansible host before sending them,
+       add its directory to the action_plugins configuration to use it.
+version_added: "1.9"
+requirements: [ pywhdfs ]
+author: "Yassine Azzouz"
+options:
+  operations:
+    required: true
+    description:
+      - The list of operations, every operation is a dict with the name of the module as key and its parameters as
+        value, like a task, and an optional C(name) used to label its result.
+  continue_on_error:
+    required: false
+    default: no
+    choices: [ 'yes', 'no' ]
+    description:
+      - Run the next operations when one fails, the module fails anyway once all the operations were run.
+notes:
+    - The operations run in check mode are skipped by the modules not supporting it.
+'''
+
+EXAMPLES = '''
+- name: "Provision a tenant"
+  hdfsbatch:
+    authentication: "kerberos"
+    principal: "hdfs@HADOOP.LOCALDOMAIN"
+    keytab: "/etc/security/keytabs/hdfs.keytab"
+    nameservices: "{{nameservices | to_json}}"
+    operations:
+      - name: "tenant directory"
+        hdfsfile:
+          path: "/tenants/{{tenant}}"
+          state: "directory"
+          owner: "{{tenant}}"
+          mode: "0750"
+      - hdfsacl:
+          path: "/tenants/{{tenant}}"
+          state: "present"
+          entries: [ "group:{{tenant}}-ro:r-x", "default:group:{{tenant}}-ro:r-x" ]
+      - hdfsxattr:
+          path: "/tenants/{{tenant}}"
+          key: "user.tenant"
+          value: "{{tenant}}"
+      - hdfsquota:
+          path: "/tenants/{{tenant}}"
+          spacequota: 10t
+'''
+
+RETURN = '''
+results:
+    description: the result of every operation run, with the name of its module and its label
+    returned: always
+    type: list
+    sample: [ { "module": "hdfsfile", "name": "tenant directory", "changed": true, "path": "/tenants/a" } ]
+failed_count:
+    description: number of operations which failed
+    returned: always
+    type: int
+    sample: 0
+'''
+
+import sys
+import json
+import importlib
+from StringIO import StringIO
+
+# import module snippets
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+from ahdp.module_utils.hdfsbase import *
+
+# the modules which operations can be batched
+BATCH_MODULES = ( 'hdfsfile', 'hdfsacl', 'hdfsxattr', 'hdfsquota', 'hdfs_snapshot', 'hdfsstat',
+                  'hdfstoken', 'hdfsfind', 'hdfsupload', 'hdfsdownload', 'hdfscopy' )
+
+def parse_operation(operation):
+    ''' return the (module, label, parameters) of an operation, raise ValueError if it is not valid '''
+    if not isinstance(operation, dict):
+        raise ValueError('an operation must be a dict, got %r' % (operation,))
+    label = operation.get('name')
+    modules = [ key for key in operation if key != 'name' ]
+    if len(modules) != 1:
+        raise ValueError('an operation must have a single module, got %s' % ', '.join(sorted(modules)))
+    name = modules[0]
+    if name not in BATCH_MODULES:
+        raise ValueError('module %s can not be batched, supported modules: %s' % (name, ', '.join(BATCH_MODULES)))
+    args = operation[name] or {}
+    if not isinstance(args, dict):
+        raise ValueError('the parameters of the %s operation must be a dict' % name)
+    return name, label, args
+
+def run_operation(name, args):
+    ''' Run the main of an hdfs module in this process with args, return its result. The modules exit with
+        exit_json or fail_json, which print the result and exit. '''
+    basic._ANSIBLE_ARGS = json.dumps({ 'ANSIBLE_MODULE_ARGS': args })
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        try:
+            importlib.import_module('ahdp.modules.hadoop.hdfs.%s' % name).main()
+        except SystemExit:
+            pass
+        except Exception, e:
+            return { 'failed': True, 'msg': 'module %s raised %s: %s' % (name, type(e).__name__, str(e)) }
+    finally:
+        sys.stdout = stdout
+    try:
+        return json.loads(output.getvalue())
+    except ValueError:
+        return { 'failed': True, 'msg': 'module %s did not return a result: %s' % (name, output.getvalue().strip()) }
+
+def main():
+
+    argument_spec = hdfs_argument_spec()
+
+    argument_spec.update( dict(
+            operations = dict(required=True, type='list'),
+            continue_on_error = dict(required=False, default=False, type='bool'),
+        )
+    )
+
+    required_together = hdfs_required_together()
+    mutually_exclusive = hdfs_mutually_exclusive()
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_together=required_together,
+        mutually_exclusive=mutually_exclusive,
+        supports_check_mode=True
+    )
+
+    params = module.params
+    continue_on_error = params['continue_on_error']
+
+    try:
+        operations = [ parse_operation(operation) for operation in params['operations'] ]
+    except ValueError, e:
+        module.fail_json(msg=str(e))
+
+    # the internal parameters (check mode, diff, ...) are passed on to the operations
+    internal = {}
+    if basic._ANSIBLE_ARGS is not None:
+        internal = dict( (k, v) for k, v in json.loads(basic._ANSIBLE_ARGS)['ANSIBLE_MODULE_ARGS'].items() if k.startswith('_ansible_') )
+    connection = dict( (k, v) for k, v in params.items() if k in hdfs_argument_spec() and v is not None )
+
+    # the operations authenticate and connect once
+    hdfs_share_connections()
+
+    results = []
+    failed_count = 0
+    for name, label, args in operations:
+        operation_args = dict(connection)
+        operation_args.update(args)
+        operation_args.update(internal)
+
+        result = run_operation(name, operation_args)
+        result.pop('invocation', None)
+        result['module'] = name
+        if label is not None:
+            result['name'] = label
+        results.append(result)
+
+        if result.get('failed'):
+            failed_count += 1
+            if not continue_on_error:
+                break
+
+    hdfs_share_connections(False)
+
+    changed = any( r.get('changed', False) for r in results )
+    if failed_count:
+        module.fail_json(msg='%d of %d operations failed' % (failed_count, len(operations)), changed=changed,
+                         results=results, failed_count=failed_count)
+    module.exit_json(changed=changed, results=results, failed_count=failed_count)
+
+if __name__ == '__main__':
+    main()
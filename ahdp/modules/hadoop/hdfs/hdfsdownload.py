@@ -62,6 +62,12 @@ options:
     required: false
     choices: [ "yes", "no" ]
     default: "no"
+  result_file:
+    description:
+      - Local file on the target where a newline delimited json record (hdfs_path, local_path, backup_path and changed)
+        is written for every downloaded file while the files are downloaded, the number of files is returned.
+    required: false
+    default: null
 '''
 
 EXAMPLES = '''
@@ -237,6 +243,7 @@ def main():
             force  = dict(default=False, type='bool'),
             preserve  = dict(default=False, type='bool'),
             backup  = dict(default=False, type='bool'),
+            result_file  = dict(default=None, type='path'),
         )
     )
 
@@ -264,6 +271,7 @@ def main():
     force        = params['force']
     preserve     = params['preserve']
     backup       = params['backup']
+    result_file  = params['result_file']
 
     changed = False
 
@@ -296,47 +304,52 @@ def main():
             # Copy the whole directory recursively
             local_path =  osp.join( local_path, osp.basename(hdfs_path) )
 
-    # Then we figure out which files we need to download, and where.
-    to_download_tuples = []
-
+    # Then we figure out which files we need to download, and where, while walking
     if hdfs.hdfs_is_dir(hdfs_path):
-        remote_fpaths = [
-          osp.join(dpath, fpath)
-          for dpath, _, fpaths in hdfs.client.walk(hdfs_path)
-          for fpath in fpaths
-        ]
-
         offset = len(hdfs_path.rstrip(os.sep)) + len(os.sep)
-        to_download_tuples =  [ dict({ 'hdfs_path' : fpath, 'local_path'  : osp.join(local_path, fpath[offset:].replace(os.sep, '/')) })
-                                for fpath in remote_fpaths
-                            ]
+        to_download_tuples = ( dict({ 'hdfs_path' : fpath, 'local_path'  : osp.join(local_path, fpath[offset:].replace(os.sep, '/')) })
+                               for fpath in ( osp.join(dpath, fpath) for dpath, _, fpaths in hdfs.client.walk(hdfs_path) for fpath in fpaths )
+                             )
     elif hdfs.hdfs_exist(hdfs_path):
         to_download_tuples =  [ dict({ 'local_path' : local_path, 'hdfs_path'  : hdfs_path }) ]
     else:
         hdfs.hdfs_fail_json(msg='HDFS path %r does not exist.' % hdfs_path, changed=False)
 
+    # with result_file the downloaded files are written to the file instead of being kept,
+    # only the backups to remove once everything went fine are kept
+    spool = ResultSpool(result_file) if result_file is not None else None
     downloaded_tuples = []
-    for download in to_download_tuples:
-          downloaded_tuples.append(
-                      download_file( hdfs_module=hdfs,
-                                     hdfs_path=download['hdfs_path'],
-                                     local_path=download['local_path'], 
-                                     preserve=preserve, 
-                                     owner=owner, 
-                                     group=group, 
-                                     mode=mode,
-                                     overwrite=force )
-                                   )
+    try:
+        for download in to_download_tuples:
+            downloaded_file = download_file( hdfs_module=hdfs,
+                                             hdfs_path=download['hdfs_path'],
+                                             local_path=download['local_path'], 
+                                             preserve=preserve, 
+                                             owner=owner, 
+                                             group=group, 
+                                             mode=mode,
+                                             overwrite=force )
+            changed = changed or downloaded_file['changed']
+            if spool is not None:
+                spool.write(downloaded_file)
+            if downloaded_file['backup_path'] is not None and downloaded_file['backup_path'] != downloaded_file['local_path']:
+                downloaded_tuples.append(downloaded_file)
+    except:
+        if spool is not None:
+            spool.abort()
+        raise
+
     # everything went fine
-    for downloaded_file in downloaded_tuples:
-      changed = changed or downloaded_file['changed']
-      if not backup:
-        if downloaded_file['backup_path'] is not None and downloaded_file['backup_path'] != downloaded_file['local_path']:
-          os.remove(downloaded_file['backup_path'])
+    if not backup:
+      for downloaded_file in downloaded_tuples:
+        os.remove(downloaded_file['backup_path'])
 
     res_args = dict(
         dest = local_path , src = hdfs_path, changed = changed
     )
+    if spool is not None:
+        spool.close()
+        res_args.update(result_file=spool.path, records=spool.count)
 
     module.exit_json(**res_args)
 
@@ -61,11 +61,19 @@ options:
     default: null
     description:
       - The name quota to be applied to the directory. This option applies only to directories.
+        C(-1) clears the quota.
   spacequota:
     required: false
     default: null
     description:
       - The space quota to be applied to the directory. This option applies only to directories.
+        Units are accepted (for example C(10g)), C(-1) clears the quota.
+  storage_type:
+    required: false
+    default: null
+    choices: [ RAM_DISK, SSD, DISK, ARCHIVE ]
+    description:
+      - Apply the space quota only to the given storage type.
   recursive:
     required: false
     default: "no"
@@ -119,7 +127,7 @@ from ahdp.module_utils.hdfsbase import HDFSAnsibleModule, hdfs_argument_spec, hd
 
 # recursive,spacequota and namequota  options requires state to be 'directory'
 def invalid_if():
-    return [ ('state', 'file', ['recursive','spacequota','namequota']),('state', 'touch', ['recursive','spacequota','namequota']),('state', 'absent', ['recursive','spacequota','namequota']) ]
+    return [ ('state', 'file', ['recursive','spacequota','namequota','storage_type']),('state', 'touch', ['recursive','spacequota','namequota','storage_type']),('state', 'absent', ['recursive','spacequota','namequota','storage_type']) ]
 
 def main():
     
@@ -133,6 +141,7 @@ def main():
             replication = dict(required=False,default=None),
             namequota = dict(required=False,default=None),
             spacequota = dict(required=False,default=None),
+            storage_type = dict(choices=['RAM_DISK','SSD','DISK','ARCHIVE'],default=None),
             recursive  = dict(default=False, type='bool'),
         )
     )
@@ -165,6 +174,7 @@ def main():
     mode          = params['mode']
     spacequota    = params['spacequota']
     namequota     = params['namequota']
+    storage_type  = params['storage_type']
 
     prev_state = hdfs.get_state(path)
 
@@ -221,7 +231,7 @@ def main():
         # Set the attribute for the actual destination path
         # Quotas are never set recursively; just to the destination directory
         changed |= hdfs.hdfs_set_attributes(  path=path, owner=owner, group=group, replication=replication, 
-                                              quota=namequota, spaceQuota=spacequota, permission=mode )
+                                              quota=namequota, spaceQuota=spacequota, permission=mode, storage_type=storage_type )
         
         if recursive:
             changed |= hdfs.hdfs_set_attributes_recursive( path=path, owner=owner, group=group, replication=replication, permission=mode)
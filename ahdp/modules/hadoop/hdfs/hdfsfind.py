@@ -11,6 +11,10 @@ description:
     - Return a list of files in HDFS based on specific criteria. This module is inspired from the base ansible find module.
 version_added: "1.9"
 requirements: [ pywhdfs ]
+notes:
+    - When numpy is installed on the target the type, age, size and permission filters of large directory
+      listings are evaluated as vectorized masks, and the patterns are then matched on the remaining entries only.
+      The aggregates are also computed on batches of entries.
 author: "Yassine Azzouz"
 options:
     age:
@@ -33,12 +37,25 @@ options:
         required: false
         default: null
         description:
-            - One or more re patterns which should be matched against the file content.
+            - A re pattern which should be matched against the begining of a line of the file content.
+            - The lines are matched as raw bytes, they are not decoded: a non ascii pattern matches its utf-8
+              encoding, but C(.) and the character classes match single bytes, not characters.
+            - Files are searched in parallel (see C(concurrency)) and read only up to the first match,
+              .gz, .bz2 and .snappy (hadoop snappy codec, requires python-snappy) files are decompressed.
+    contains_max_bytes:
+        required: false
+        default: null
+        description:
+            - Maximum number of bytes read from each file when searching its content, files are fully read by default.
+              b, k, m, g, and t can be appended to specify bytes, kilobytes, megabytes, gigabytes, and terabytes.
     paths:
         required: true
         aliases: [ "name", "path" ]
         description:
             - List of paths to the file or directory to search. All paths must be fully qualified.
+            - Paths can be glob patterns (for example C(/data/*/dt=2024-*/hour=0[0-5])), the pattern components
+              are matched while traversing so the non matching directories are never listed. The matching
+              directories are searched and the matching files are filtered as any other entry.
     file_type:
         required: false
         description:
@@ -51,6 +68,23 @@ options:
         choices: [ "yes", "no" ]
         description:
             - If target is a directory, recursively descend into the directory looking for files.
+    max_depth:
+        required: false
+        default: null
+        description:
+            - Descend at most this number of levels below the searched directories, 1 only examines their
+              direct children. Implies C(recurse), the directories below are never listed.
+    min_depth:
+        required: false
+        default: null
+        description:
+            - Do not return the entries less than this number of levels below the searched directories.
+    prune:
+        required: false
+        default: null
+        description:
+            - One or more (shell) patterns of directory names which subtrees are skipped entirely, the
+              matching directories are neither returned nor listed (for example C(.snapshot) or C(_temporary)).
     size:
         required: false
         default: null
@@ -59,7 +93,15 @@ options:
               Use a negative size to find files equal to or less than the specified size.
               Unqualified values are in bytes, but b, k, m, g, and t can be appended to specify
               bytes, kilobytes, megabytes, gigabytes, and terabytes, respectively.
-              Size is not evaluated for directories.
+              For directories the total length of their content is compared, which requires a content
+              summary request per directory matching the other filters.
+    perm:
+        required: false
+        default: null
+        description:
+            - Select the entries by permission bits, like the find C(-perm) test. C(mode) (for example C(644))
+              selects the entries with exactly these permissions, C(-mode) the entries with at least all these
+              bits set and C(/mode) the entries with any of these bits set (for example C(/002) for world writable).
     age_stamp:
         required: false
         default: "mtime"
@@ -78,6 +120,110 @@ options:
         choices: [ True, False ]
         description:
             - If false the patterns are file globs (shell) if true they are python regexes
+    sort_by:
+        required: false
+        default: null
+        choices: [ "path", "length", "spaceConsumed", "modificationTime", "accessTime", "replication", "blockSize", "owner", "group" ]
+        description:
+            - Sort the returned entries by this attribute.
+    order:
+        required: false
+        default: "asc"
+        choices: [ "asc", "desc" ]
+        description:
+            - Sort order used with C(sort_by).
+    limit:
+        required: false
+        default: null
+        description:
+            - Return at most this number of entries. With C(sort_by) only the top entries are kept while
+              searching, so memory and output stay bounded by C(limit). Without it the search stops as soon
+              as C(limit) entries are found.
+    fields:
+        required: false
+        default: null
+        description:
+            - Only return these attributes of the matched entries (see the hdfsstat module for the list), C(path)
+              is always returned. The content summary of the entries is only requested if one of the returned
+              fields needs it (C(spaceConsumed), C(quota), C(spaceQuota), C(directoryCount), C(fileCount) and
+              the C(length) of directories).
+    output_format:
+        required: false
+        default: "list"
+        choices: [ "list", "columnar" ]
+        description:
+            - C(list) returns a list of dictionaries. C(columnar) returns a dictionary of lists, one list
+              per field holding its value for every entry, much smaller to return for large results.
+    result_file:
+        required: false
+        default: null
+        description:
+            - Local file on the target where the matched entries are written as newline delimited json while
+              they are found, instead of being returned. Only the counters are returned. Incompatible with
+              C(output_format=columnar).
+            - The file is dropped when the search fails. When the C(action) fails on some entries it is kept
+              with all the matched entries and returned along with the failures.
+    aggregate:
+        required: false
+        default: null
+        choices: [ "owner", "group", "toplevel", "age", "replication", "type", "storagePolicy" ]
+        description:
+            - Instead of the matched entries return their count, length and space consumed grouped by
+              these attributes, computed in one pass from the directory listings. C(toplevel) is the
+              first level directory below the searched path, C(age) is the C(age_buckets) bucket.
+            - The space consumed by a file is its length times its replication factor.
+    age_buckets:
+        required: false
+        default: null
+        description:
+            - List of ages (same format as C(age)) delimiting the age buckets of C(aggregate=age),
+              for example C(['7d', '30d', '365d']).
+    action:
+        required: false
+        default: null
+        choices: [ "delete", "chmod", "chown", "setrep", "setxattr", "storagepolicy" ]
+        description:
+            - Action applied to every matched entry while searching, on C(concurrency) threads, so the
+              entries found are changed in the same task. The entries already in the wanted state are skipped
+              without any request, using the status from the directory listing.
+            - With C(delete) the directories matched by the name, type, age and size filters are not searched,
+              their content is deleted with them. Their size is checked before the walk goes on, the directories
+              rejected by it are searched.
+    action_args:
+        required: false
+        default: null
+        description:
+            - Arguments of the action, C(mode) for C(chmod) (octal or symbolic), C(owner) and/or C(group) for C(chown),
+              C(replication) for C(setrep) (applied to files only), C(key) and C(value) for C(setxattr) and
+              C(policy) for C(storagepolicy) (one of HOT, WARM, COLD, ALL_SSD, ONE_SSD, LAZY_PERSIST and PROVIDED).
+    dry_run:
+        required: false
+        default: "no"
+        choices: [ "yes", "no" ]
+        description:
+            - Only count the entries the action would change, nothing is changed. Also enabled in check mode.
+    backend:
+        required: false
+        default: "webhdfs"
+        choices: [ "webhdfs", "fsimage" ]
+        description:
+            - Where the namespace is searched. C(fsimage) searches a local dump of the fsimage instead of listing the
+              directories through webhdfs, so the search sends no request to the namenode. The dump is indexed on
+              the target the first time it is searched. Only C(contains) and C(get_checksum) still need the cluster.
+            - C(action) can not be used with C(backend=fsimage), the dump may be days old and the entries changed since.
+            - The dump has no storage policy, and the Delimited one has no file ids and the times are rounded to the minute.
+    fsimage:
+        required: false
+        default: null
+        description:
+            - Local file holding the output of the offline image viewer Delimited or XML processor
+              (C(hdfs oiv -p Delimited -i fsimage_N -o fsimage.tsv)), or an index built from it. Required with C(backend=fsimage).
+    fsimage_index:
+        required: false
+        default: null
+        description:
+            - Local file where the index of C(fsimage) is stored, C(fsimage) followed by C(.idx) by default.
+              The index is rebuilt when it is older than the dump.
 '''
 
 
@@ -85,22 +231,69 @@ EXAMPLES = '''
 # Recursively find /tmp files older than 2 days
 - find: paths="/tmp" age="2d" recurse=yes
 
+# find the files of the first hours partitions of 2024 in all the warehouse tables
+- hdfsfind: paths="/data/*/dt=2024-*/hour=0[0-5]"
+
+# find the table directories without descending into the partitions nor the temporary directories
+- hdfsfind: paths="/data" file_type=directory min_depth=2 max_depth=2 prune="'_temporary','.hive-staging*','.snapshot'"
+
 # Recursively find /tmp files older than 4 weeks and equal or greater than 1 megabyte
 - find: paths="/tmp" age="4w" size="1m" recurse=yes
 
 # Recursively find /var/tmp files with last access time greater than 3600 seconds
 - find: paths="/var/tmp" age="3600" age_stamp=atime recurse=yes
 
+# find the world writable directories
+- hdfsfind: paths="/" recurse=yes file_type=directory perm="/002"
+
 # find /var/log files equal or greater than 10 megabytes ending with .old or .log.gz
 - find: paths="/var/tmp" patterns="'*.old','*.log.gz'" size="10m"
 
+# find the 100 largest files under /data
+- hdfsfind: paths="/data" recurse=yes sort_by=length order=desc limit=100
+
+# modification time of all the files under /data, returned as a compact dictionary of lists
+- hdfsfind: paths="/data" recurse=yes fields="length,modificationTime" output_format=columnar
+
+# usage of /data per owner and age
+- hdfsfind: paths="/data" recurse=yes aggregate="owner,age" age_buckets="30d,90d,365d"
+
 # find /var/log files equal or greater than 10 megabytes ending with .old or .log.gz via regex
 - find: paths="/var/tmp" patterns="^.*?\.(?:old|log\.gz)$" size="10m" use_regex=True
+
+# delete the staging directories older than a week, counting them first
+- hdfsfind: paths="/data" recurse=yes file_type=directory patterns=".hive-staging*" age="1w" action=delete dry_run=yes
+- hdfsfind: paths="/data" recurse=yes file_type=directory patterns=".hive-staging*" age="1w" action=delete
+
+# move the partitions older than 90 days to the archive storage
+- hdfsfind:
+    paths: "/data/*"
+    patterns: "dt=*"
+    file_type: directory
+    age: 90d
+    action: storagepolicy
+    action_args:
+      policy: COLD
+
+# make the files under /data group readable
+- hdfsfind:
+    paths: "/data"
+    recurse: yes
+    action: chmod
+    action_args:
+      mode: "g+r"
+
+# usage per owner of the files older than 2 years, from last night fsimage dump
+- hdfsfind: paths="/" recurse=yes age="104w" aggregate=owner backend=fsimage fsimage="/backup/fsimage.tsv"
+
+# find the compressed logs mentioning a job, reading at most 100 megabytes of each file
+- hdfsfind: paths="/app-logs" patterns="*.gz" recurse=yes contains=".*job_1490000000000_0042" contains_max_bytes="100m"
 '''
 
 RETURN = '''
 files:
-    description: all matches found with the specified criteria (see stat module for full output of each dictionary)
+    description: all matches found with the specified criteria (see stat module for full output of each dictionary),
+                 a dictionary of lists with C(output_format=columnar)
     returned: success
     type: list of dictionaries
     sample: [
@@ -114,7 +307,7 @@ files:
         },
         ]
 matched:
-    description: number of matches
+    description: number of matches, can be greater than the number of returned files when C(limit) is used
     returned: success
     type: string
     sample: 14
@@ -123,6 +316,33 @@ examined:
     returned: success
     type: string
     sample: 34
+aggregates:
+    description: the count, length and space consumed of the matched entries per group, largest groups first
+    returned: when aggregate is used
+    type: list of dictionaries
+    sample: [ { "owner": "hive", "age": "30d-90d", "count": 1204, "length": 52428800, "spaceConsumed": 157286400 } ]
+result_file:
+    description: the file the matched entries were written to
+    returned: when result_file is used
+    type: string
+    sample: /tmp/find.ndjson
+records:
+    description: number of entries written to result_file
+    returned: when result_file is used
+    type: int
+    sample: 123456
+changed_count:
+    description: number of matched entries changed by the action, or which would be changed with C(dry_run)
+    returned: when action is used
+    type: int
+    sample: 1024
+rejected:
+    description: number of filesystem objects rejected by each filter stage, stages are evaluated from the
+                 cheapest (name) to the most expensive (content) one, except for the vectorized listings where
+                 the listing stage is evaluated first
+    returned: success
+    type: dict
+    sample: { "name": 12, "listing": 6, "summary": 0, "content": 2 }
 '''
 
 import os
@@ -130,30 +350,26 @@ import stat
 import fnmatch
 import time
 import re
+import heapq
+
+# numpy is only imported by the first listing large enough to be vectorized
+has_numpy = None
+
+def load_numpy():
+    global has_numpy, np
+    if has_numpy is None:
+        try:
+            import numpy as np
+        except ImportError:
+            has_numpy = False
+        else:
+            has_numpy = True
+    return has_numpy
 
 # import module snippets
 from ansible.module_utils.basic import AnsibleModule
 from ahdp.module_utils.hdfsbase import *
-
-def pfilter(f, patterns=None, use_regex=False):
-    '''filter using glob patterns'''
-
-    if patterns is None:
-        return True
-
-    if use_regex:
-        for p in patterns:
-            r =  re.compile(p)
-            if r.match(f):
-                return True
-    else:
-
-        for p in patterns:
-            if fnmatch.fnmatch(f, p):
-                return True
-
-    return False
-
+from ahdp.module_utils.fsimage import FsImageError, open_fsimage_index
 
 def agefilter(status, now, age, timestamp):
     '''filter files older than age'''
@@ -175,56 +391,373 @@ def sizefilter(status, size):
 
     return False
 
-def contentfilter(hdfs, fsname, pattern):
-    '''filter files which contain the given expression'''
-    if pattern is None: return True
+def project(r, fields):
+    '''restrict an entry to the requested fields'''
+    if fields is None:
+        return r
+    return dict( (field, r[field]) for field in fields if field in r )
 
-    try:
-        prog = re.compile(pattern)
-        with hdfs.client.read(fsname, delimiter='\n', encoding='utf-8') as _reader:
-            for line in _reader:
-                if prog.match (line):
-                    return True
-    except:
-       pass
-    return False
+# listings and batches smaller than this are processed entry by entry, building the arrays would cost more
+VECTORIZE_MIN_ENTRIES = 256
+AGGREGATE_BATCH_SIZE = 4096
+
+def parse_perm(perm):
+    ''' convert a perm test (ex: 644, -022, /002) to its (kind, bits), None if invalid '''
+    m = re.match("^([-/]?)([0-7]{1,4})$", str(perm))
+    if m:
+        return m.group(1), int(m.group(2), 8)
+    return None
+
+def permfilter(mode, perm):
+    '''filter modes matching the perm test'''
+    if perm is None:
+        return True
+    kind, bits = perm
+    if kind == '-':
+        return mode & bits == bits
+    if kind == '/':
+        return mode & bits != 0
+    return mode == bits
+
+class FindFilter(object):
+    ''' The module filters compiled into one predicate chain ordered by cost:
+          name    : patterns on the base name, needs no data
+          listing : file type, age, permission and size of files, from the FileStatus of the directory listing
+          summary : size of directories, needs a content summary request
+          content : contains, needs to read the file
+        an entry reaches a stage only if all the cheaper stages accepted it, and the number of
+        entries rejected by each stage is kept in rejected. With numpy, the listing stage of large listings is
+        evaluated first as masks over arrays of the listing and the names are matched on the rows left. '''
+
+    STAGES = [ 'name', 'listing', 'summary', 'content' ]
+
+    def __init__(self, client, patterns=None, use_regex=False, file_type='file', age=None,
+                 age_stamp='modificationTime', size=None, perm=None, searcher=None, now=None):
+        self.client = client
+        # patterns are compiled once, '*' matches everything so it needs no check
+        self.name_regexes = None
+        if patterns and patterns != ['*']:
+            if use_regex:
+                self.name_regexes = [ re.compile(p) for p in patterns ]
+            else:
+                self.name_regexes = [ re.compile(fnmatch.translate(p)) for p in patterns ]
+        self.file_type = 'DIRECTORY' if file_type == 'directory' else 'FILE'
+        self.age = age
+        self.age_stamp = age_stamp
+        self.size = size
+        self.perm = perm
+        self.searcher = searcher
+        self.now = now if now is not None else int(time.time())
+        self.rejected = dict( (stage, 0) for stage in self.STAGES )
+
+    def match_name(self, name):
+        if self.name_regexes is None:
+            return True
+        for r in self.name_regexes:
+            if r.match(name):
+                return True
+        return False
+
+    def match_listing(self, status):
+        if status['type'] != self.file_type or not agefilter(status, self.now, self.age, self.age_stamp):
+            return False
+        if not permfilter(hdfs_status_mode(status), self.perm):
+            return False
+        # the size of a directory is only known from its content summary
+        return self.file_type == 'DIRECTORY' or sizefilter(status, self.size)
+
+    def cheap(self, name, status):
+        ''' name and listing stages, they need no request so they run in the walking thread '''
+        if not self.match_name(name):
+            self.rejected['name'] += 1
+            return False
+        if not self.match_listing(status):
+            self.rejected['listing'] += 1
+            return False
+        return True
+
+    def accept(self, entries):
+        ''' the (name, status) of a listing accepted by the name and listing stages '''
+        if len(entries) >= VECTORIZE_MIN_ENTRIES and load_numpy():
+            return self._accept_vectorized(entries)
+        return [ (name, status) for name, status in entries if self.cheap(name, status) ]
+
+    def _accept_vectorized(self, entries):
+        n = len(entries)
+        statuses = [ status for _, status in entries ]
+        mask = np.fromiter((status['type'] == self.file_type for status in statuses), dtype=bool, count=n)
+        if self.age is not None:
+            ages = self.now - np.fromiter((status[self.age_stamp] for status in statuses), dtype=np.int64, count=n) // 1000
+            mask &= (ages >= self.age) if self.age >= 0 else (ages <= -self.age)
+        if self.perm is not None:
+            modes = np.fromiter((hdfs_status_mode(status) for status in statuses), dtype=np.int64, count=n)
+            kind, bits = self.perm
+            if kind == '-':
+                mask &= (modes & bits) == bits
+            elif kind == '/':
+                mask &= (modes & bits) != 0
+            else:
+                mask &= modes == bits
+        if self.size is not None and self.file_type == 'FILE':
+            lengths = np.fromiter((status['length'] for status in statuses), dtype=np.int64, count=n)
+            mask &= (lengths >= self.size) if self.size >= 0 else (lengths <= -self.size)
+        survivors = np.flatnonzero(mask)
+        self.rejected['listing'] += n - len(survivors)
+        accepted = [ entries[i] for i in survivors if self.match_name(entries[i][0]) ]
+        self.rejected['name'] += len(survivors) - len(accepted)
+        return accepted
+
+    def costly_directories(self):
+        ''' whether the directories go through the summary stage '''
+        return self.file_type == 'DIRECTORY' and self.size is not None
+
+    def costly(self, path):
+        ''' summary and content stages, they send requests so they run on the worker threads.
+            Returns the rejecting stage (None if accepted), the content summary if it was fetched
+            and the error message if any. '''
+        content = None
+        if self.costly_directories():
+            content = self.client.content(path)
+            if not sizefilter(content, self.size):
+                return 'summary', content, None
+        if self.file_type == 'FILE' and self.searcher is not None:
+            try:
+                if not self.searcher.match(path):
+                    return 'content', content, None
+            except Exception, e:
+                return 'content', content, "%s content could not be searched: %s\n" % (path, str(e))
+        return None, content, None
+
+class _Reversed(object):
+    ''' inverts the ordering of a value, so a min heap keeps the smallest values '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+class TopEntries(object):
+    ''' Keep the first limit entries by key in a bounded heap, so only limit entries are in memory
+        whatever the number of entries added. Without limit all the entries are kept and sorted. '''
+
+    def __init__(self, key, reverse=False, limit=None):
+        self.key = key
+        self.reverse = reverse
+        self.limit = limit
+        self.heap = []
+        self.count = 0
+
+    def add(self, entry, status=None):
+        # earlier entries win the ties, the sequence also avoids comparing the entries
+        self.count += 1
+        value = entry[self.key] if self.reverse else _Reversed(entry[self.key])
+        item = (value, -self.count, entry, status)
+        if self.limit is None or len(self.heap) < self.limit:
+            heapq.heappush(self.heap, item)
+        else:
+            heapq.heappushpop(self.heap, item)
+
+    def items(self):
+        ''' the (entry, status) of the kept entries '''
+        return [ (entry, status) for _, _, entry, status in sorted(self.heap, reverse=True) ]
+
+def parse_age(age):
+    ''' convert an age (ex: 2d) to seconds, None if invalid '''
+    m = re.match("^(-?\d+)(s|m|h|d|w)?$", str(age).lower())
+    seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    if m:
+        return int(m.group(1)) * seconds_per_unit.get(m.group(2), 1)
+    return None
+
+AGGREGATE_KEYS = [ 'owner', 'group', 'toplevel', 'age', 'replication', 'type', 'storagePolicy' ]
+
+class Aggregator(object):
+    ''' du like rollup of the matched entries: count, length and space consumed per group of keys,
+        computed in one pass from the listing statuses. The space consumed by a file is its length
+        times its replication, erasure coded files are not accounted precisely. '''
+
+    def __init__(self, keys, now, age_stamp='modificationTime', age_buckets=None):
+        self.keys = keys
+        self.now = now
+        self.age_stamp = age_stamp
+        # (label, seconds) sorted by age
+        self.age_buckets = sorted(age_buckets or [], key=lambda bucket: bucket[1])
+        # key values -> [ count, length, space consumed ]
+        self.groups = {}
+
+    def age_bucket(self, status):
+        age = self.now - int(status[self.age_stamp]/1000)
+        lower = None
+        for label, seconds in self.age_buckets:
+            if age < seconds:
+                return '<%s' % label if lower is None else '%s-%s' % (lower, label)
+            lower = label
+        return '>=%s' % lower
+
+    def add(self, status, toplevel):
+        values = []
+        for key in self.keys:
+            if key == 'age':
+                values.append(self.age_bucket(status))
+            elif key == 'toplevel':
+                values.append(toplevel)
+            else:
+                values.append(status.get(key))
+        group = self.groups.get(tuple(values))
+        if group is None:
+            group = self.groups[tuple(values)] = [ 0, 0, 0 ]
+        group[0] += 1
+        if status['type'] == 'FILE':
+            group[1] += status['length']
+            group[2] += status['length'] * status['replication']
+
+    def add_many(self, entries):
+        ''' add a batch of (status, toplevel) entries, with numpy the sizes and the age buckets are
+            computed as arrays and summed per group in one pass '''
+        if len(entries) < VECTORIZE_MIN_ENTRIES or not load_numpy():
+            for status, toplevel in entries:
+                self.add(status, toplevel)
+            return
+        n = len(entries)
+        statuses = [ status for status, _ in entries ]
+        is_file = np.fromiter((status['type'] == 'FILE' for status in statuses), dtype=bool, count=n)
+        lengths = np.fromiter((status['length'] for status in statuses), dtype=np.int64, count=n) * is_file
+        consumed = lengths * np.fromiter((status['replication'] for status in statuses), dtype=np.int64, count=n)
+        labels = None
+        if 'age' in self.keys:
+            ages = self.now - np.fromiter((status[self.age_stamp] for status in statuses), dtype=np.int64, count=n) // 1000
+            # index of the first bucket older than the age
+            buckets = np.searchsorted(np.array([ seconds for _, seconds in self.age_buckets ], dtype=np.int64), ages, side='right')
+            names = [ label for label, _ in self.age_buckets ]
+            bucket_labels = [ '<%s' % names[0] ] + [ '%s-%s' % (names[i - 1], names[i]) for i in range(1, len(names)) ] + [ '>=%s' % names[-1] ]
+            labels = [ bucket_labels[i] for i in buckets ]
+
+        index = {}
+        inverse = np.empty(n, dtype=np.int64)
+        for i, (status, toplevel) in enumerate(entries):
+            values = []
+            for key in self.keys:
+                if key == 'age':
+                    values.append(labels[i])
+                elif key == 'toplevel':
+                    values.append(toplevel)
+                else:
+                    values.append(status.get(key))
+            inverse[i] = index.setdefault(tuple(values), len(index))
+
+        counts = np.bincount(inverse, minlength=len(index))
+        sums = np.zeros((2, len(index)), dtype=np.int64)
+        np.add.at(sums[0], inverse, lengths)
+        np.add.at(sums[1], inverse, consumed)
+        for values, g in index.items():
+            group = self.groups.get(values)
+            if group is None:
+                group = self.groups[values] = [ 0, 0, 0 ]
+            group[0] += int(counts[g])
+            group[1] += int(sums[0][g])
+            group[2] += int(sums[1][g])
+
+    def results(self):
+        rows = []
+        for values, (count, length, consumed) in self.groups.items():
+            row = dict(zip(self.keys, values))
+            row.update(count=count, length=length, spaceConsumed=consumed)
+            rows.append(row)
+        return sorted(rows, key=lambda row: row['spaceConsumed'], reverse=True)
+
+# ids of the builtin storage policies, as reported in the storagePolicy of the file statuses
+STORAGE_POLICY_IDS = { 'PROVIDED': 1, 'COLD': 2, 'WARM': 5, 'HOT': 7, 'ONE_SSD': 10, 'ALL_SSD': 12, 'LAZY_PERSIST': 15 }
+
+FIND_ACTIONS = [ 'delete', 'chmod', 'chown', 'setrep', 'setxattr', 'storagepolicy' ]
+
+class FindAction(object):
+    ''' An action applied to the matched entries on the worker threads. The status of the listing is
+        compared to the wanted state first, so no request is sent for the entries already in that state.
+        apply returns whether the entry was changed (would be with dry_run) and raises on failure. '''
+
+    def __init__(self, client, action, args=None, dry_run=False):
+        self.client = client
+        self.action = action
+        self.args = args or {}
+        self.dry_run = dry_run
+        self.mode = None
+
+        required = { 'chmod': [ 'mode' ], 'setrep': [ 'replication' ], 'setxattr': [ 'key', 'value' ], 'storagepolicy': [ 'policy' ] }
+        missing = [ arg for arg in required.get(action, []) if self.args.get(arg) is None ]
+        if missing:
+            raise ValueError("%s requires the action_args %s" % (action, ', '.join(missing)))
+        if action == 'chown' and not self.args.get('owner') and not self.args.get('group'):
+            raise ValueError("chown requires the action_args owner and/or group")
+        if action == 'chmod':
+            # an unquoted yaml mode (0644) is already an int, like with hdfs_set_mode
+            mode = self.args['mode']
+            if not isinstance(mode, (int, long)):
+                try:
+                    mode = int(mode, 8)
+                except ValueError:
+                    mode = None
+            if mode is not None:
+                self.mode = lambda current_mode, is_dir: mode
+            else:
+                self.mode = compile_symbolic_mode(self.args['mode'])
+        if action == 'setrep':
+            self.args['replication'] = int(self.args['replication'])
+        if action == 'storagepolicy' and self.args['policy'] not in STORAGE_POLICY_IDS:
+            raise ValueError("unknown storage policy %s, valid policies are %s" % (self.args['policy'], ', '.join(sorted(STORAGE_POLICY_IDS))))
+
+    def apply(self, path, status):
+        return getattr(self, '_' + self.action)(path, status)
+
+    def _delete(self, path, status):
+        if self.dry_run:
+            return True
+        # False if it was already deleted
+        return self.client.delete(path, recursive=True)
 
-def statinfo(status,content):
-    d = {
-        'pathSuffix'        : status['pathSuffix'],
-        'type'              : status['type'],
-        'owner'             : status['owner'],
-        'group'             : status['group'],
-        'permission'        : status['permission'],
-        'isdir'             : bool(status['type'] == 'DIRECTORY'),
-        'isfile'            : bool(status['type'] == 'FILE'),
-        'childrenNum'       : status['childrenNum'],
-        'replication'       : status['replication'],
-        'storagePolicy'     : status['storagePolicy'],
-        'fileId'            : status['fileId'],
-        'blockSize'         : status['blockSize'],
-        'accessTime'        : status['accessTime'],
-        'modificationTime'  : status['modificationTime'],
-        'length'            : content['length'],
-        'spaceConsumed'     : content['spaceConsumed'],
-        'quota'             : content['quota'],
-        'spaceQuota'        : content['spaceQuota'],
-        'directoryCount'    : content['directoryCount'],
-        'fileCount'         : content['fileCount'],
-        # First Byte of permissions for owner
-        'rusr'              : bool( (int(status['permission'][0]) >> 2) & 1),
-        'wusr'              : bool( (int(status['permission'][0]) >> 1) & 1),
-        'xusr'              : bool( int(status['permission'][0]) & 1),
-        # Second byte of permission for owner's group
-        'rgrp'              : bool( (int(status['permission'][1]) >> 2) & 1),
-        'wgrp'              : bool( (int(status['permission'][1]) >> 1) & 1),
-        'xgrp'              : bool( int(status['permission'][1]) & 1),
-        # Third byte of permissions for others
-        'roth'              : bool( (int(status['permission'][2]) >> 2) & 1),
-        'woth'              : bool( (int(status['permission'][2]) >> 1) & 1), 
-        'xoth'              : bool( int(status['permission'][2]) & 1),
-        }
-    return d
+    def _chmod(self, path, status):
+        mode = self.mode(hdfs_status_mode(status), status['type'] == 'DIRECTORY')
+        if mode == hdfs_status_mode(status):
+            return False
+        if not self.dry_run:
+            self.client.set_permission(path, int(oct(mode),10))
+        return True
+
+    def _chown(self, path, status):
+        owner = self.args.get('owner') if self.args.get('owner') != status['owner'] else None
+        group = self.args.get('group') if self.args.get('group') != status['group'] else None
+        if not owner and not group:
+            return False
+        if not self.dry_run:
+            self.client.set_owner(path, owner=owner, group=group)
+        return True
+
+    def _setrep(self, path, status):
+        if status['type'] != 'FILE' or status['replication'] == self.args['replication']:
+            return False
+        if not self.dry_run:
+            self.client.set_replication(path, self.args['replication'])
+        return True
+
+    def _setxattr(self, path, status):
+        key, value = self.args['key'], self.args['value']
+        current = self.client.getxattrs(hdfs_path=path, key=key, strict=False)
+        if current is not None and key in current and value == current[key]:
+            return False
+        if not self.dry_run:
+            self.client.setxattr(hdfs_path=path, key=key, value=value, overwrite=True)
+        return True
+
+    def _storagepolicy(self, path, status):
+        if status.get('storagePolicy') == STORAGE_POLICY_IDS[self.args['policy']]:
+            return False
+        if not self.dry_run:
+            self.client._api_request(method='PUT', hdfs_path=path, params={ 'op': 'SETSTORAGEPOLICY', 'storagepolicy': self.args['policy'] })
+        return True
 
 def main():
     argument_spec = hdfs_argument_spec()
@@ -232,27 +765,48 @@ def main():
             paths         = dict(required=True, aliases=['name','path'], type='list'),
             patterns      = dict(default=['*'], type='list', aliases=['pattern']),
             contains      = dict(default=None, type='str'),
+            contains_max_bytes = dict(default=None, type='str'),
             file_type     = dict(default="file", choices=['file', 'directory'], type='str'),
             age           = dict(default=None, type='str'),
             age_stamp     = dict(default="modificationTime", choices=['modificationTime','accessTime'], type='str'),
             size          = dict(default=None, type='str'),
+            perm          = dict(default=None, type='str'),
             recurse       = dict(default='no', type='bool'),
+            max_depth     = dict(default=None, type='int'),
+            min_depth     = dict(default=None, type='int'),
+            prune         = dict(default=None, type='list'),
             get_checksum  = dict(default="False", type='bool'),
             use_regex     = dict(default="False", type='bool'),
+            sort_by       = dict(default=None, choices=['path', 'length', 'spaceConsumed', 'modificationTime', 'accessTime', 'replication', 'blockSize', 'owner', 'group'], type='str'),
+            order         = dict(default='asc', choices=['asc', 'desc'], type='str'),
+            limit         = dict(default=None, type='int'),
+            fields        = dict(default=None, type='list'),
+            output_format = dict(default='list', choices=['list', 'columnar'], type='str'),
+            result_file   = dict(default=None, type='path'),
+            aggregate     = dict(default=None, type='list'),
+            age_buckets   = dict(default=None, type='list'),
+            action        = dict(default=None, choices=FIND_ACTIONS, type='str'),
+            action_args   = dict(default=None, type='dict'),
+            dry_run       = dict(default=False, type='bool'),
+            backend       = dict(default='webhdfs', choices=['webhdfs', 'fsimage'], type='str'),
+            fsimage       = dict(default=None, type='path'),
+            fsimage_index = dict(default=None, type='path'),
         )
     )
 
     required_together = hdfs_required_together()
-    mutually_exclusive = hdfs_mutually_exclusive()
+    mutually_exclusive = hdfs_mutually_exclusive() + [['aggregate', 'sort_by'], ['aggregate', 'limit'], ['aggregate', 'result_file'], ['aggregate', 'action']]
     required_if = hdfs_required_if()
 
     module = AnsibleModule(
         argument_spec=argument_spec,
         required_together=required_together,
-        mutually_exclusive=mutually_exclusive
+        mutually_exclusive=mutually_exclusive,
+        supports_check_mode=True
     )
 
-    hdfs = HDFSAnsibleModule(module)
+    # the actions skip the entries already in the wanted state, so they need the statuses of the active namenode
+    hdfs = HDFSAnsibleModule(module, observer_reads=module.params['action'] is None)
 
     params = module.params
 
@@ -263,11 +817,8 @@ def main():
         age = None
     else:
         # convert age to seconds:
-        m = re.match("^(-?\d+)(s|m|h|d|w)?$", params['age'].lower())
-        seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
-        if m:
-            age = int(m.group(1)) * seconds_per_unit.get(m.group(2), 1)
-        else:
+        age = parse_age(params['age'])
+        if age is None:
             module.fail_json(age=params['age'], msg="failed to process age")
 
     if params['size'] is None:
@@ -281,50 +832,283 @@ def main():
         else:
             module.fail_json(size=params['size'], msg="failed to process size")
 
-    # convert to seconds
-    now = int(time.time())
-    msg = ''
-    looked = 0
-    for npath in params['paths']:
-        if hdfs.hdfs_is_dir(npath):
-
-            for root,dirs,files in hdfs.client.walk(npath):
-                looked = looked + len(files) + len(dirs)
-                for fsobj in (files + dirs):
-                    fsname=os.path.normpath(os.path.join(root, fsobj))
-
-                    try:
-                        status = hdfs.client.status(fsname, strict=False)
-                        content = hdfs.client.content(fsname, strict=False)
-                    except:
-                        msg+="%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % fsname
+    perm = None
+    if params['perm'] is not None:
+        perm = parse_perm(params['perm'])
+        if perm is None:
+            module.fail_json(perm=params['perm'], msg="failed to process perm")
+
+    max_bytes = None
+    if params['contains_max_bytes'] is not None:
+        m = re.match("^(\d+)(b|k|m|g|t)?$", params['contains_max_bytes'].lower())
+        bytes_per_unit = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+        if m:
+            max_bytes = int(m.group(1)) * bytes_per_unit.get(m.group(2), 1)
+        else:
+            module.fail_json(contains_max_bytes=params['contains_max_bytes'], msg="failed to process contains_max_bytes")
+
+    searcher = None
+    if params['contains'] is not None:
+        try:
+            searcher = HdfsContentSearch(hdfs.client, params['contains'], max_bytes=max_bytes)
+        except re.error, e:
+            module.fail_json(contains=params['contains'], msg="invalid contains pattern: %s" % str(e))
+
+    # max_depth 1 is the non recursive search
+    max_depth = params['max_depth']
+    if max_depth is None and not params['recurse']:
+        max_depth = 1
+    min_depth = params['min_depth']
+    if (max_depth is not None and max_depth < 1) or (min_depth is not None and min_depth < 1):
+        module.fail_json(msg="max_depth and min_depth must be greater than 0")
+
+    # the namespace is listed either through webhdfs or from the fsimage index, which implements
+    # the same status, list and content methods
+    fs = hdfs.client
+    if params['backend'] == 'fsimage':
+        if params['fsimage'] is None:
+            module.fail_json(msg="fsimage is required with backend=fsimage")
+        if params['action'] is not None:
+            module.fail_json(msg="action can not be used with backend=fsimage")
+        try:
+            fs = open_fsimage_index(params['fsimage'], index=params['fsimage_index'])
+        except (FsImageError, EnvironmentError), e:
+            module.fail_json(fsimage=params['fsimage'], msg="failed to index the fsimage: %s" % str(e))
+
+    find_filter = FindFilter(fs, patterns=params['patterns'], use_regex=params['use_regex'],
+                             file_type=params['file_type'], age=age, age_stamp=params['age_stamp'],
+                             size=size, perm=perm, searcher=searcher, now=int(time.time()))
+
+    action = None
+    if params['action'] is not None:
+        if params['action'] == 'delete' and params['get_checksum']:
+            module.fail_json(msg="get_checksum can not be used with action=delete")
+        try:
+            action = FindAction(hdfs.client, params['action'], params['action_args'], dry_run=params['dry_run'] or module.check_mode)
+        except ValueError, e:
+            module.fail_json(action=params['action'], action_args=params['action_args'], msg=str(e))
+
+    def is_dir(path):
+        if fs is hdfs.client:
+            return hdfs.hdfs_is_dir(path)
+        status = fs.status(path, strict=False)
+        return status is not None and status['type'] == 'DIRECTORY'
+
+    # the candidates generator runs in the main thread, so it can update these
+    skipped = []
+    looked = [0]
+    # the directories examined by candidates before being pruned, by path
+    examined = {}
+
+    def candidates():
+        ''' entries accepted by the name and listing stages, the listing statuses are used
+            so no request is sent for the rejected entries '''
+        for npath in params['paths']:
+            if GLOB_MAGIC_RE.search(npath):
+                try:
+                    roots = list(hdfs_glob(fs, npath))
+                except Exception, e:
+                    skipped.append("%s was skipped as it could not be expanded: %s\n" % (npath, str(e)))
+                    continue
+                if not roots:
+                    skipped.append("%s was skipped as it does not match any file or directory\n" % npath)
+            elif is_dir(npath):
+                roots = [ (npath, None) ]
+            else:
+                skipped.append("%s was skipped as it does not seem to be a valid directory or it cannot be accessed\n" % npath)
+                continue
+
+            for root_path, root_status in roots:
+                if root_status is not None and root_status['type'] != 'DIRECTORY':
+                    # files matching a glob pattern are entries themselves
+                    looked[0] = looked[0] + 1
+                    if find_filter.cheap(os.path.basename(root_path), root_status):
+                        yield root_path, root_status, os.path.basename(root_path)
+                    continue
+
+                top = None
+                for (root, _), dirs, files in hdfs_walk(fs, root_path, status=root_status, max_depth=max_depth, prune=params['prune'],
+                                                        concurrency=params['concurrency']):
+                    looked[0] = looked[0] + len(files) + len(dirs)
+                    # depth of the listed entries below the searched directory
+                    if top is None:
+                        top = root
+                    depth = 1 if root == top else root[len(top):].strip('/').count('/') + 2
+                    if min_depth is not None and depth < min_depth:
                         continue
+                    toplevel = root[len(top):].strip('/').split('/')[0] if root != top else None
+                    for fsobj, status in find_filter.accept(files + dirs):
+                        fsname = os.path.normpath(os.path.join(root, fsobj))
+                        if action is not None and action.action == 'delete' and status['type'] == 'DIRECTORY':
+                            if find_filter.costly_directories():
+                                # a directory rejected by its summary is walked, its content may match
+                                examined[fsname] = examine( (fsname, status, None) )
+                                if examined[fsname][0] is not None or examined[fsname][2] is not None:
+                                    yield fsname, status, toplevel or fsobj
+                                    continue
+                            # the directories to delete are not listed
+                            dirs.remove((fsobj, status))
+                        yield fsname, status, toplevel or fsobj
 
-                    r = {'path': fsname}
-                    if status['type'] == 'DIRECTORY' and params['file_type'] == 'directory':
-                        if pfilter(fsobj, params['patterns'], params['use_regex']) and agefilter(status, now, age, params['age_stamp']):
+    if params['result_file'] is not None and params['output_format'] == 'columnar':
+        module.fail_json(msg="result_file can not be used with output_format=columnar")
 
-                            r.update(statinfo(status,content))
-                            filelist.append(r)
+    fields = None
+    if params['fields'] is not None:
+        invalid = [ field for field in params['fields'] if field not in STATINFO_FIELDS + ['path', 'checksum'] ]
+        if invalid:
+            module.fail_json(fields=params['fields'], msg="invalid fields %s, valid fields are %s" % (', '.join(invalid), ', '.join(STATINFO_FIELDS)))
+        fields = [ 'path' ] + [ field for field in params['fields'] if field != 'path' ]
+        if params['get_checksum'] and 'checksum' not in fields:
+            fields.append('checksum')
+        if action is not None and 'changed' not in fields:
+            fields.append('changed')
+    # the fields needed to produce the output, including the sort key
+    needed_fields = fields
+    if fields is not None and params['sort_by'] is not None:
+        needed_fields = fields + [ params['sort_by'] ]
 
-                    elif status['type'] == 'FILE' and params['file_type'] == 'file':
-                        if pfilter(fsobj, params['patterns'], params['use_regex']) and \
-                           agefilter(status, now, age, params['age_stamp']) and \
-                           sizefilter(status, size) and \
-                           contentfilter(hdfs, fsname, params['contains']):
+    def examine(candidate):
+        ''' summary and content stages, then the content summary of the accepted entries if needed '''
+        fsname, status, _ = candidate
+        if fsname in examined:
+            return examined.pop(fsname)
+        try:
+            stage, content, error = find_filter.costly(fsname)
+            # the aggregates only use the listing statuses
+            if stage is None and content is None and aggregator is None and hdfs_statinfo_needs_content(status, needed_fields):
+                content = fs.content(fsname)
+        except Exception, e:
+            return None, None, "%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % fsname
+        return stage, content, error
 
-                            r.update(statinfo(status,content))
-                            if params['get_checksum']:
-                                r['checksum'] = self.hdfs.hdfs_sha1(fsname)
-                            filelist.append(r)
+    aggregator = None
+    if params['aggregate'] is not None:
+        invalid = [ key for key in params['aggregate'] if key not in AGGREGATE_KEYS ]
+        if invalid:
+            module.fail_json(aggregate=params['aggregate'], msg="invalid aggregate keys %s, valid keys are %s" % (', '.join(invalid), ', '.join(AGGREGATE_KEYS)))
+        age_buckets = []
+        for bucket in params['age_buckets'] or []:
+            if parse_age(bucket) is None:
+                module.fail_json(age_buckets=params['age_buckets'], msg="failed to process age bucket %s" % bucket)
+            age_buckets.append( (bucket, parse_age(bucket)) )
+        if 'age' in params['aggregate'] and not age_buckets:
+            module.fail_json(msg="age_buckets is required to aggregate by age")
+        aggregator = Aggregator(params['aggregate'], int(time.time()), age_stamp=params['age_stamp'], age_buckets=age_buckets)
 
-                if not params['recurse']:
-                    break
-        else:
-            msg+="%s was skipped as it does not seem to be a valid directory or it cannot be accessed\n" % npath
+    top = None
+    if params['sort_by'] is not None:
+        top = TopEntries(params['sort_by'], reverse=params['order'] == 'desc', limit=params['limit'])
+
+    def checksum(r):
+        if params['get_checksum'] and r['type'] == 'FILE':
+            r['checksum'] = hdfs.hdfs_sha1(r['path'])
+        return r
+
+    # with result_file the entries are written to the file as they are found
+    spool = None
+    if params['result_file'] is not None:
+        spool = ResultSpool(params['result_file'])
+    output = spool.write if spool is not None else filelist.append
+
+    # the matches generator runs in the main thread, so it can update these
+    matched = [0]
+    changed_count = [0]
+    failures = []
+    pending = []
+
+    def matches():
+        ''' the matched entries in the output order '''
+        # the summary and content stages run on concurrency threads while the tree is walked
+        for (fsname, status, toplevel), (stage, content, error) in hdfs_map(examine, candidates(), params['concurrency']):
+            if error is not None:
+                skipped.append(error)
+            if stage is not None or error is not None:
+                if stage is not None:
+                    find_filter.rejected[stage] += 1
+                continue
+
+            matched[0] += 1
+            if aggregator is not None:
+                # the aggregates are computed on batches of entries
+                pending.append( (status, toplevel) )
+                if len(pending) >= AGGREGATE_BATCH_SIZE:
+                    aggregator.add_many(pending)
+                    del pending[:]
+                continue
+
+            r = {'path': fsname}
+            r.update(hdfs_statinfo(status, content))
+            if top is not None:
+                top.add(r, status)
+            else:
+                yield r, status
+                if params['limit'] is not None and matched[0] >= params['limit']:
+                    # nothing more to find
+                    return
+
+        if aggregator is not None:
+            aggregator.add_many(pending)
+        if top is not None:
+            for r, status in top.items():
+                yield r, status
+
+    def act(match):
+        ''' apply the action on a worker thread, errors are returned to the main thread '''
+        r, status = match
+        try:
+            return action.apply(r['path'], status), None
+        except Exception, e:
+            return False, "%s %s failed: %s" % (action.action, r['path'], str(e))
+
+    def acted():
+        ''' the matched entries, once the action was applied to them on a second pool of threads '''
+        for (r, _), (changed, error) in hdfs_map(act, matches(), params['concurrency']):
+            if error is not None:
+                failures.append(error)
+            r['changed'] = changed
+            if changed:
+                changed_count[0] += 1
+            yield r
+
+    try:
+        entries = acted() if action is not None else ( r for r, _ in matches() )
+        # checksums are only computed for the returned files
+        for r in entries:
+            output(project(checksum(r), fields))
+    except:
+        if spool is not None:
+            spool.abort()
+        raise
+
+    msg = ''.join(skipped)
+    looked = looked[0]
+    matched = matched[0]
+
+    counters = dict(matched=matched, examined=looked, rejected=find_filter.rejected)
+    changed = False
+    if action is not None:
+        counters['changed_count'] = changed_count[0]
+        changed = changed_count[0] > 0 and not params['dry_run']
+        if failures:
+            if spool is not None:
+                spool.close()
+                counters.update(result_file=spool.path, records=spool.count)
+            module.fail_json(msg=''.join(skipped + [ f + '\n' for f in failures ]), failed=len(failures), changed=changed, **counters)
+
+    if spool is not None:
+        spool.close()
+        module.exit_json(result_file=spool.path, records=spool.count, changed=changed, msg=msg, **counters)
+
+    if params['output_format'] == 'columnar':
+        columns = fields
+        if columns is None:
+            columns = [ 'path' ] + STATINFO_FIELDS + ( [ 'checksum' ] if params['get_checksum'] else [] ) + ( [ 'changed' ] if action is not None else [] )
+        filelist = hdfs_columnar(filelist, columns)
 
-    matched = len(filelist)
-    module.exit_json(files=filelist, changed=False, msg=msg, matched=matched, examined=looked)
+    if aggregator is not None:
+        module.exit_json(aggregates=aggregator.results(), changed=changed, msg=msg, **counters)
+    module.exit_json(files=filelist, changed=changed, msg=msg, **counters)
 
 if __name__ == '__main__':
    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## (c) 2016, Yassine Azzouz <yassine.azzouz@gmail.com>
+
+DOCUMENTATION = '''
+---
+module: hdfsquota
+short_description: Sets quotas on many hdfs directories at once
+extends_documentation_fragment: hdfs
+description:
+     - Sets or clears the name and space quotas of a list of HDFS directories.
+     - Quotas are set through webhdfs when the cluster supports it, otherwise all the
+       directories sharing the same quota are updated with a single hdfs dfsadmin call.
+version_added: "1.9"
+requirements: [ pywhdfs ]
+author: "Yassine Azzouz"
+options:
+  paths:
+    required: true
+    default: []
+    aliases: ['path', 'name']
+    description:
+      - The list of directories the quotas should be applied to.
+  namequota:
+    required: false
+    default: null
+    description:
+      - The name quota to be applied to the directories, C(-1) clears the quota.
+  spacequota:
+    required: false
+    default: null
+    description:
+      - The space quota to be applied to the directories, units are accepted (for example C(10g)).
+        C(-1) clears the quota.
+  storage_type:
+    required: false
+    default: null
+    choices: [ RAM_DISK, SSD, DISK, ARCHIVE ]
+    description:
+      - Apply the space quota only to the given storage type.
+'''
+
+EXAMPLES = '''
+- name: "Set project quotas"
+  hdfsquota:
+    authentication: "kerberos"
+    principal: "hdfs@HADOOP.LOCALDOMAIN"
+    password: "{{hdfs_kerberos_password}}"
+    urls: "{{namenodes_urls}}"
+    paths: "{{ projects | map('regex_replace', '^', '/projects/') | list }}"
+    namequota: 100000
+    spacequota: 10t
+- name: "Clear the SSD quota"
+  hdfsquota:
+    urls: "{{namenodes_urls}}"
+    paths: [ "/projects/a", "/projects/b" ]
+    spacequota: -1
+    storage_type: SSD
+'''
+
+RETURN = '''
+changed_paths:
+    description: directories which quotas were changed
+    returned: success
+    type: list
+    sample: [ "/projects/a", "/projects/b" ]
+'''
+
+# import module snippets
+from ansible.module_utils.basic import AnsibleModule
+from ahdp.module_utils.hdfsbase import *
+
+def main():
+
+    argument_spec = hdfs_argument_spec()
+
+    argument_spec.update( dict(
+            paths = dict(required=True, aliases=['path', 'name'], type='list'),
+            namequota = dict(required=False, default=None),
+            spacequota = dict(required=False, default=None),
+            storage_type = dict(choices=['RAM_DISK','SSD','DISK','ARCHIVE'], default=None),
+        )
+    )
+
+    required_together = hdfs_required_together()
+    mutually_exclusive = hdfs_mutually_exclusive()
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_together=required_together,
+        mutually_exclusive=mutually_exclusive
+    )
+
+    hdfs = HDFSAnsibleModule(module)
+
+    params = module.params
+    paths        = params['paths']
+    namequota    = params['namequota']
+    spacequota   = params['spacequota']
+    storage_type = params['storage_type']
+
+    if namequota is None and spacequota is None:
+        hdfs.hdfs_fail_json(msg="one of namequota or spacequota is required")
+
+    changed_paths = []
+    for path in paths:
+        status = hdfs.hdfs_status(path, strict=False)
+        if status is None or status['type'] != 'DIRECTORY':
+            hdfs.hdfs_fail_json(path=path, msg="quotas can only be set on existing directories")
+        # queue only the directories which quotas differ, then apply them all at once
+        if hdfs.hdfs_set_attributes(path=path, quota=namequota, spaceQuota=spacequota, status=status,
+                                    storage_type=storage_type, batch_quotas=True):
+            changed_paths.append(path)
+
+    hdfs.hdfs_flush_quotas()
+
+    module.exit_json(changed=len(changed_paths) > 0, changed_paths=changed_paths)
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,14 @@ options:
     required: false
     default: yes
     aliases: []
+  fields:
+    description:
+      - Only return these attributes, C(exists) and C(path) are always returned. The content summary
+        is only requested if one of the fields needs it (C(spaceConsumed), C(quota), C(spaceQuota),
+        C(directoryCount), C(fileCount) and the C(length) of directories).
+    required: false
+    default: null
+    aliases: []
 '''
 
 EXAMPLES = '''
@@ -233,7 +241,8 @@ def main():
     argument_spec = hdfs_argument_spec()
     argument_spec.update(dict(
             path = dict(required=True),
-            get_checksum = dict(default='yes', type='bool')
+            get_checksum = dict(default='yes', type='bool'),
+            fields = dict(default=None, type='list'),
         )
     )
     required_together = hdfs_required_together()
@@ -247,55 +256,30 @@ def main():
 #        required_if=required_if
     )
 
-    hdfs = HDFSAnsibleModule(module)
+    hdfs = HDFSAnsibleModule(module, observer_reads=True)
     path = module.params.get('path')
     get_checksum = module.params.get('get_checksum')
 
+    fields = module.params.get('fields')
+    if fields is not None:
+        invalid = [ field for field in fields if field not in STATINFO_FIELDS + ['exists', 'path', 'checksum'] ]
+        if invalid:
+            hdfs.hdfs_fail_json(msg="invalid fields %s, valid fields are %s" % (', '.join(invalid), ', '.join(STATINFO_FIELDS)))
+        get_checksum = get_checksum and 'checksum' in fields
+
     status = hdfs.hdfs_status(path)
-    content = hdfs.hdfs_content(path)
 
     if status is None:
         d = { 'exists' : False }
         module.exit_json(changed=False, stat=d)
 
-    # back to ansible
-    d = {
-        'exists'            : True,
-        'path'              : path,
-        'pathSuffix'        : status['pathSuffix'],
-        'type'              : status['type'],
-        'owner'             : status['owner'],
-        'group'             : status['group'],
-        'permission'        : status['permission'],
-        'isdir'             : bool(status['type'] == 'DIRECTORY'),
-        'isfile'            : bool(status['type'] == 'FILE'),
-        'childrenNum'       : status['childrenNum'],
-        'replication'       : status['replication'],
-        'storagePolicy'     : status['storagePolicy'],
-        'fileId'            : status['fileId'],
-        'blockSize'         : status['blockSize'],
-        'accessTime'        : status['accessTime'],
-        'modificationTime'  : status['modificationTime'],
-        'length'            : content['length'],
-        'spaceConsumed'     : content['spaceConsumed'],
-        'quota'             : content['quota'],
-        'spaceQuota'        : content['spaceQuota'],
-        'directoryCount'    : content['directoryCount'],
-        'fileCount'         : content['fileCount'],
-        # First Byte of permissions for owner
-        'rusr'              : bool( (int(status['permission'][0]) >> 2) & 1),
-        'wusr'              : bool( (int(status['permission'][0]) >> 1) & 1),
-        'xusr'              : bool( int(status['permission'][0]) & 1),
-        # Second byte of permission for owner's group
-        'rgrp'              : bool( (int(status['permission'][1]) >> 2) & 1),
-        'wgrp'              : bool( (int(status['permission'][1]) >> 1) & 1),
-        'xgrp'              : bool( int(status['permission'][1]) & 1),
-        # Third byte of permissions for others
-        'roth'              : bool( (int(status['permission'][2]) >> 2) & 1),
-        'woth'              : bool( (int(status['permission'][2]) >> 1) & 1), 
-        'xoth'              : bool( int(status['permission'][2]) & 1),
-        }
+    content = None
+    if hdfs_statinfo_needs_content(status, fields):
+        content = hdfs.hdfs_content(path)
 
+    # back to ansible
+    d = { 'exists' : True, 'path' : path }
+    d.update(hdfs_statinfo(status, content, fields))
 
     if status['type'] == 'FILE' and get_checksum:
         checksum = hdfs.hdfs_checksum(path, strict=False)
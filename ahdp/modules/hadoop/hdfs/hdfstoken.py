@@ -118,7 +118,9 @@ def main():
     hdfs = HDFSAnsibleModule(
         module=module,
         invalid_if=invalid_if(),
-        required_if=required_if()
+        required_if=required_if(),
+        # the tokens are managed with kerberos
+        use_token_cache=False
     )
 
     params = module.params
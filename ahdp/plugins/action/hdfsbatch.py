@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+## (c) 2016, Yassine Azzouz <yassine.azzouz@gmail.com>
+
+from ansible.plugins.action import ActionBase
+
+from ahdp.modules.hadoop.hdfs.hdfsbatch import parse_operation
+
+class ActionModule(ActionBase):
+    ''' Check the hdfsbatch operations on the ansible host, so a malformed batch fails before the module is sent
+        to the target, then run all of them with a single hdfsbatch invocation. '''
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+
+        operations = self._task.args.get('operations')
+        if not isinstance(operations, list):
+            result.update(failed=True, msg='operations must be a list of operations')
+            return result
+
+        errors = []
+        for i, operation in enumerate(operations):
+            try:
+                parse_operation(operation)
+            except ValueError, e:
+                errors.append('operation %d: %s' % (i + 1, str(e)))
+        if errors:
+            result.update(failed=True, msg='invalid operations, %s' % '; '.join(errors))
+            return result
+
+        result.update(self._execute_module(module_name='hdfsbatch', module_args=self._task.args, task_vars=task_vars))
+        return result
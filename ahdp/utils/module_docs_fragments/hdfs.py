@@ -54,6 +54,13 @@ options:
     description:
       - A json list of nameservices to connect to, each nameservice is a dict having a list of namenodes urls and the associated mount points.
       - You can create the spec in yml then use the to_json filter.
+      - A nameservice may also list the urls of its C(observers) namenodes (hadoop 3), the read only requests (status, listings,
+        acls and xattrs reads, ...) of the modules changing nothing (hdfsstat, and hdfsfind without C(action)) are then sent to
+        them in turn instead of the active namenode, with C(engine=webhdfs) only. The other modules read the state they change
+        from the active namenode, the observers may not have the changes of the previous tasks yet.
+        The paths changed by the task, the paths under the deleted or renamed ones and the parent directories listing them
+        (all the ancestors of the created directories and files) are read from the active namenode, as are the reads failing
+        or timing out on an observer, since the observers may lag behind the active namenode.
   verify:
     required: false
     default: "no"
@@ -75,4 +82,105 @@ options:
     default: null
     description:
       - Root path, this will be prefixed to all HDFS paths passed. If the root is relative, the path will be assumed relative to the user home directory.
+  concurrency:
+    required: false
+    default: 10
+    description:
+      - Maximum number of concurrent requests sent to the namenode by operations applied to many paths, for example recursive acls.
+  engine:
+    required: false
+    default: pywhdfs
+    choices: [ "pywhdfs", "webhdfs" ]
+    description:
+      - Client sending the webhdfs requests. C(webhdfs) uses the ahdp webhdfs engine, which only needs python-requests
+        (and requests-kerberos with kerberos), instead of pywhdfs.
+      - The engine lists the directories of the recursive operations in parallel, and never sends more than C(concurrency)
+        requests to the namenode at a time over all the threads of the module, the listings and the operations applied to
+        the paths included.
+  ccache_reuse:
+    required: false
+    default: "yes"
+    choices: [ "yes", "no" ]
+    description:
+      - With kerberos, reuse the TGT of the previous invocations from a credential cache of C(ccache_dir) instead of running kinit
+        and kdestroy every time. The cache is specific to the principal and its keytab or password, the TGT is renewed before
+        it expires and requested again once it can not be renewed.
+      - If C(no) the TGT is requested for the task only, in a private credential cache file dropped at the end of the task,
+        so the parallel tasks running on the same host never share the default cache.
+      - The TGT is requested in-process when python-gssapi is installed, kinit is used otherwise.
+  ccache_dir:
+    required: false
+    default: "~/.ahdp/ccache"
+    description:
+      - Directory of the credential caches reused between invocations. The caches are named after a hash of the
+        credentials keyed with a random key kept in the directory, readable only by the user running the module.
+  ccache_lifetime:
+    required: false
+    default: null
+    description:
+      - Lifetime of the TGT requested when the cache is refreshed, in the kinit C(-l) format (for example C(10h)).
+        Defaults to the lifetime configured for the realm.
+  token_cache:
+    required: false
+    default: false
+    description:
+      - With C(kerberos) authentication, authenticate the requests with a delegation token of the principal instead of
+        a SPNEGO negotiation. The token is obtained with kerberos once and kept in C(token_cache_dir) with its expiration
+        time for the next invocations, it is renewed or requested again when it is about to expire.
+      - Delegation tokens are issued per nameservice, the modules configured with several nameservices keep using
+        kerberos.
+  token_cache_dir:
+    required: false
+    default: "~/.ahdp/tokens"
+    description:
+      - Directory on the target where the delegation tokens are kept, readable only by the user running the module.
+  pool_size:
+    required: false
+    default: null
+    description:
+      - Number of connections kept open per host, the namenodes and the datanodes the reads and writes are redirected to.
+        Defaults to the greater of 10 and C(concurrency), so the concurrent operations never open new connections.
+  pool_hosts:
+    required: false
+    default: 100
+    description:
+      - Number of hosts which connections are kept open, the least recently used host connections are closed.
+  keep_alive:
+    required: false
+    default: "yes"
+    choices: [ "yes", "no" ]
+    description:
+      - Keep the connections open between requests. If C(no) every request opens a new connection.
+  spnego_preemptive:
+    required: false
+    default: "no"
+    choices: [ "yes", "no" ]
+    description:
+      - With C(authentication=kerberos), send the SPNEGO token with the first request to a host instead of waiting for its
+        authentication challenge, saving a round trip per connection. Requires requests-kerberos 0.8 or later.
+  namenode_cache:
+    required: false
+    default: "~/.ahdp/namenodes.json"
+    description:
+      - File on the target where the active namenode of each nameservice is recorded when the client fails over. The next
+        invocations send their requests to that namenode first instead of probing the namenodes in the C(nameservices) order.
+  namenode_cache_ttl:
+    required: false
+    default: 3600
+    description:
+      - Number of seconds a recorded active namenode is tried first, C(0) disables the cache.
+  agent:
+    required: false
+    default: false
+    description:
+      - Forward the requests to the ahdp agent listening on C(agent_socket), a process of the target keeping the
+        authenticated clients open between the invocations. When no agent is running, one is started in the background
+        for the next invocations and the module runs on its own.
+      - The agent serves a single kerberos principal. The transfers (reads and writes) are run by the module.
+  agent_socket:
+    required: false
+    default: null
+    description:
+      - Unix socket of the ahdp agent, C(~/.ahdp/agent.sock) by default. The agent only accepts connections from the
+        processes of its user.
 """
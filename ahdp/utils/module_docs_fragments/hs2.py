@@ -68,4 +68,41 @@ options:
     default: null
     description:
       - Connection timeouts, forwarded to the request handler. This determines how long to wait for the server to send data before giving up.
+  ccache_reuse:
+    required: false
+    default: "yes"
+    choices: [ "yes", "no" ]
+    description:
+      - With kerberos, reuse the TGT of the previous invocations from a credential cache of C(ccache_dir) instead of running kinit
+        and kdestroy every time. The cache is specific to the principal and its keytab or password, the TGT is renewed before
+        it expires and requested again once it can not be renewed.
+      - If C(no) the TGT is requested for the task only, in a private credential cache file dropped at the end of the task,
+        so the parallel tasks running on the same host never share the default cache.
+      - The TGT is requested in-process when python-gssapi is installed, kinit is used otherwise.
+  ccache_dir:
+    required: false
+    default: "~/.ahdp/ccache"
+    description:
+      - Directory of the credential caches reused between invocations. The caches are named after a hash of the
+        credentials keyed with a random key kept in the directory, readable only by the user running the module.
+  ccache_lifetime:
+    required: false
+    default: null
+    description:
+      - Lifetime of the TGT requested when the cache is refreshed, in the kinit C(-l) format (for example C(10h)).
+        Defaults to the lifetime configured for the realm.
+  agent:
+    required: false
+    default: false
+    description:
+      - Run the queries on a connection kept by the ahdp agent listening on C(agent_socket), a process of the target keeping the
+        authenticated clients open between the invocations. When no agent is running, one is started in the background
+        for the next invocations and the module runs on its own.
+      - The agent serves a single kerberos principal.
+  agent_socket:
+    required: false
+    default: null
+    description:
+      - Unix socket of the ahdp agent, C(~/.ahdp/agent.sock) by default. The agent only accepts connections from the
+        processes of its user.
 """
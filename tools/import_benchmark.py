@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+#
+# (c) 2016 Yassine Azzouz, <yassine.azzouz@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+'''
+ahdp Import Benchmark
+=======================
+Author: Yassine Azzouz
+Description:
+  Measure the import time of the ahdp module_utils (and of module files given by path), which every module
+  invocation pays before doing anything. Each target is imported in a new interpreter, several times, and the
+  best time less the time of an empty interpreter is reported. --verbose prints the slowest imports, the
+  cumulative time of every module imported by the target like python 3 -X importtime (not available in python 2).
+  The benchmark fails (exit code 1) when a target takes more than the budget or loads one of the heavy
+  dependencies which are supposed to be imported on first use only (pywhdfs, requests, impyla, thrift, ...).
+Usage:
+  python tools/import_benchmark.py [--budget-ms 60] [--repeat 5] [--verbose] [TARGET ...]
+'''
+
+import os
+import sys
+import json
+import subprocess
+import time
+from optparse import OptionParser
+
+DEFAULT_TARGETS = [ 'ahdp.module_utils.hdfsbase', 'ahdp.module_utils.hs2base', 'ahdp.module_utils.fsimage' ]
+
+# imported on first use only
+LAZY_MODULES = [ 'pywhdfs', 'requests', 'requests_kerberos', 'gssapi', 'snappy', 'impala', 'thrift', 'thrift_sasl',
+                 'sasl', 'numpy', 'multiprocessing', 'SocketServer', 'socketserver' ]
+
+IMPORT_SNIPPET = '''
+import sys
+import time
+import json
+import __builtin__
+
+# cumulative time of the first import of every module
+timings = {}
+builtin_import = __builtin__.__import__
+def timed_import(name, *args, **kwargs):
+    fresh = name not in sys.modules
+    start = time.time()
+    try:
+        return builtin_import(name, *args, **kwargs)
+    finally:
+        if fresh and name in sys.modules and name not in timings:
+            timings[name] = time.time() - start
+__builtin__.__import__ = timed_import
+
+target = sys.argv[1]
+if target.endswith('.py'):
+    import imp
+    imp.load_source('__ahdp_benchmark__', target)
+else:
+    __import__(target)
+loaded = [ m for m in sys.argv[2].split(',') if m in sys.modules ]
+sys.stdout.write(','.join(loaded))
+sys.stderr.write(json.dumps(timings))
+'''
+
+def run(args, env):
+    start = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = process.communicate()
+    elapsed = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError(err.strip())
+    return elapsed, out, err
+
+def benchmark(target, repeat, env):
+    ''' return (best import time in seconds, lazy modules loaded by the import, {module: cumulative import time}) '''
+    baseline = min( run([ sys.executable, '-c', 'pass' ], env)[0] for i in range(repeat) )
+    best = None
+    for i in range(repeat):
+        elapsed, loaded, timings = run([ sys.executable, '-c', IMPORT_SNIPPET, target, ','.join(LAZY_MODULES) ], env)
+        if best is None or elapsed < best[0]:
+            best = (elapsed, loaded, timings)
+    elapsed, loaded, timings = best
+    return max(0.0, elapsed - baseline), [ m for m in loaded.split(',') if m ], json.loads(timings)
+
+def main():
+    parser = OptionParser(usage='%prog [--budget-ms MS] [--repeat N] [--verbose] [TARGET ...]')
+    parser.add_option('--budget-ms', type='float', default=60.0, help='maximum import time of a target in milliseconds')
+    parser.add_option('--repeat', type='int', default=5, help='number of imports of each target, the best one is kept')
+    parser.add_option('--verbose', action='store_true', default=False, help='print the slowest imports of every target')
+    options, targets = parser.parse_args()
+
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([ root ] + [ p for p in [ env.get('PYTHONPATH') ] if p ])
+
+    failed = False
+    for target in targets or DEFAULT_TARGETS:
+        try:
+            elapsed, loaded, timings = benchmark(target, options.repeat, env)
+        except RuntimeError, e:
+            print '%-45s import failed: %s' % (target, str(e).splitlines()[-1] if str(e) else '')
+            failed = True
+            continue
+        over_budget = elapsed * 1000 > options.budget_ms
+        status = 'OK'
+        if over_budget:
+            status = 'OVER BUDGET'
+        if loaded:
+            status = 'LOADS %s' % ', '.join(loaded)
+        failed = failed or over_budget or bool(loaded)
+        print '%-45s %8.1f ms  %s' % (target, elapsed * 1000, status)
+        if options.verbose:
+            for name, cumulative in sorted(timings.items(), key=lambda item: item[1], reverse=True)[:15]:
+                print '    %8.1f ms  %s' % (cumulative * 1000, name)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()